@@ -68,6 +68,18 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    # python -m src.migrate передает соединение, на котором удерживает advisory-блокировку
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        context.configure(
+            connection=connection, target_metadata=target_metadata
+        )
+
+        with context.begin_transaction():
+            context.run_migrations()
+        connection.commit()
+        return
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
@@ -0,0 +1,56 @@
+"""courier stats
+
+Revision ID: 13853f409861
+Revises: ea8ac3eab941
+Create Date: 2026-10-18 10:10:12.408317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '13853f409861'
+down_revision: Union[str, None] = 'ea8ac3eab941'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('couriers', sa.Column('completed_orders', sa.Integer(), server_default='0', nullable=True))
+    op.add_column('couriers', sa.Column('total_complete_time', sa.Float(), server_default='0', nullable=True))
+    op.add_column('couriers', sa.Column('work_days', sa.Integer(), server_default='0', nullable=True))
+    op.create_table('courier_daily_stats',
+    sa.Column('courier_id', sa.UUID(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('orders_count', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['courier_id'], ['couriers.id'], ),
+    sa.PrimaryKeyConstraint('courier_id', 'day')
+    )
+    # накопленная статистика заполняется по уже завершенным заказам (status = 2), иначе первое завершение
+    # после обновления заменило бы прежние средние значения курьера временем одного заказа
+    op.execute("""
+        INSERT INTO courier_daily_stats (courier_id, day, orders_count)
+        SELECT courier_id, date(date_publication), count(*) FROM orders
+        WHERE status = 2 AND courier_id IS NOT NULL
+        GROUP BY courier_id, date(date_publication)
+    """)
+    op.execute("""
+        UPDATE couriers SET completed_orders = s.completed_orders,
+                            total_complete_time = s.total_complete_time,
+                            work_days = s.work_days
+        FROM (SELECT courier_id, count(*) AS completed_orders,
+                     sum(extract(epoch FROM date_completion - date_publication)) AS total_complete_time,
+                     count(DISTINCT date(date_publication)) AS work_days
+              FROM orders WHERE status = 2 GROUP BY courier_id) AS s
+        WHERE couriers.id = s.courier_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('courier_daily_stats')
+    op.drop_column('couriers', 'work_days')
+    op.drop_column('couriers', 'total_complete_time')
+    op.drop_column('couriers', 'completed_orders')
@@ -0,0 +1,38 @@
+"""hot path indexes
+
+Revision ID: 61ccaaa2b4e7
+Revises: 13853f409861
+Create Date: 2026-10-18 11:25:40.117204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '61ccaaa2b4e7'
+down_revision: Union[str, None] = '13853f409861'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # индексы строятся без блокировки записи в таблицы; если у курьера уже несколько заказов
+    # в работе, уникальный индекс не создастся - такие заказы нужно завершить заранее
+    with op.get_context().autocommit_block():
+        op.create_index('ix_orders_active_courier', 'orders', ['courier_id'], unique=True,
+                        postgresql_where=sa.text('status = 1'), postgresql_concurrently=True)
+        op.create_index('ix_orders_district_id_status', 'orders', ['district_id', 'status'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_couriers_districts_district_id', 'couriers_districts', ['district_id', 'courier_id'],
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_couriers_districts_district_id', table_name='couriers_districts',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_orders_district_id_status', table_name='orders', postgresql_concurrently=True)
+        op.drop_index('ix_orders_active_courier', table_name='orders', postgresql_concurrently=True)
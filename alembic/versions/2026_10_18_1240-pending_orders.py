@@ -0,0 +1,31 @@
+"""pending orders
+
+Revision ID: cf2273b3e97a
+Revises: 61ccaaa2b4e7
+Create Date: 2026-10-18 12:40:03.561829
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'cf2273b3e97a'
+down_revision: Union[str, None] = '61ccaaa2b4e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('date_assignment', sa.DateTime(), nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index('ix_orders_pending', 'orders', ['district_id', 'date_publication'],
+                        postgresql_where=sa.text('status = 0'), postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_orders_pending', table_name='orders', postgresql_concurrently=True)
+    op.drop_column('orders', 'date_assignment')
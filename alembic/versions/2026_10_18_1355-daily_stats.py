@@ -0,0 +1,60 @@
+"""daily stats
+
+Revision ID: 5b0e6d1f93a4
+Revises: cf2273b3e97a
+Create Date: 2026-10-18 13:55:21.804613
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b0e6d1f93a4'
+down_revision: Union[str, None] = 'cf2273b3e97a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('courier_daily_stats', sa.Column('total_seconds', sa.Float(), server_default='0', nullable=True))
+    op.add_column('courier_daily_stats', sa.Column('min_seconds', sa.Float(), nullable=True))
+    op.add_column('courier_daily_stats', sa.Column('max_seconds', sa.Float(), nullable=True))
+    op.create_table('district_daily_stats',
+    sa.Column('district_id', sa.UUID(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('orders_count', sa.Integer(), nullable=True),
+    sa.Column('total_seconds', sa.Float(), nullable=True),
+    sa.Column('min_seconds', sa.Float(), nullable=True),
+    sa.Column('max_seconds', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['district_id'], ['districts.id'], ),
+    sa.PrimaryKeyConstraint('district_id', 'day')
+    )
+    # время выполнения за прошлые дни заполняется по уже завершенным заказам (status = 2)
+    completed = """
+        SELECT courier_id, district_id, date(date_publication) AS day,
+               extract(epoch FROM date_completion - coalesce(date_assignment, date_publication)) AS seconds
+        FROM orders WHERE status = 2
+    """
+    op.execute(f"""
+        UPDATE courier_daily_stats SET total_seconds = s.total_seconds, min_seconds = s.min_seconds,
+                                       max_seconds = s.max_seconds
+        FROM (SELECT courier_id, day, sum(seconds) AS total_seconds, min(seconds) AS min_seconds,
+                     max(seconds) AS max_seconds
+              FROM ({completed}) AS c GROUP BY courier_id, day) AS s
+        WHERE courier_daily_stats.courier_id = s.courier_id AND courier_daily_stats.day = s.day
+    """)
+    op.execute(f"""
+        INSERT INTO district_daily_stats (district_id, day, orders_count, total_seconds, min_seconds, max_seconds)
+        SELECT district_id, day, count(*), sum(seconds), min(seconds), max(seconds)
+        FROM ({completed}) AS c WHERE district_id IS NOT NULL GROUP BY district_id, day
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('district_daily_stats')
+    op.drop_column('courier_daily_stats', 'max_seconds')
+    op.drop_column('courier_daily_stats', 'min_seconds')
+    op.drop_column('courier_daily_stats', 'total_seconds')
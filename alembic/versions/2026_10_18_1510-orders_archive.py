@@ -0,0 +1,43 @@
+"""orders archive
+
+Revision ID: 8d4c2a7e6f15
+Revises: 5b0e6d1f93a4
+Create Date: 2026-10-18 15:10:47.226190
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d4c2a7e6f15'
+down_revision: Union[str, None] = '5b0e6d1f93a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('orders_archive',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('district_id', sa.UUID(), nullable=True),
+    sa.Column('courier_id', sa.UUID(), nullable=True),
+    sa.Column('status', sa.Integer(), nullable=True),
+    sa.Column('date_publication', sa.DateTime(), nullable=True),
+    sa.Column('date_completion', sa.DateTime(), nullable=True),
+    sa.Column('date_assignment', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['courier_id'], ['couriers.id'], ),
+    sa.ForeignKeyConstraint(['district_id'], ['districts.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.get_context().autocommit_block():
+        op.create_index('ix_orders_completed', 'orders', ['date_completion'],
+                        postgresql_where=sa.text('status = 2'), postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_orders_completed', table_name='orders', postgresql_concurrently=True)
+    op.drop_table('orders_archive')
@@ -0,0 +1,41 @@
+"""courier locations
+
+Revision ID: 3e9b57d0c8a6
+Revises: a71f3c95e0d2
+Create Date: 2026-10-18 17:35:52.140877
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e9b57d0c8a6'
+down_revision: Union[str, None] = 'a71f3c95e0d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('courier_locations',
+    sa.Column('courier_id', sa.UUID(), nullable=False),
+    sa.Column('latitude', sa.Float(), nullable=True),
+    sa.Column('longitude', sa.Float(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['courier_id'], ['couriers.id'], ),
+    sa.PrimaryKeyConstraint('courier_id')
+    )
+    op.add_column('orders', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('orders', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('orders_archive', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('orders_archive', sa.Column('longitude', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('orders_archive', 'longitude')
+    op.drop_column('orders_archive', 'latitude')
+    op.drop_column('orders', 'longitude')
+    op.drop_column('orders', 'latitude')
+    op.drop_table('courier_locations')
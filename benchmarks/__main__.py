@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+from pathlib import Path
+
+import httpx
+
+from . import simulate
+from .load import DEFAULT_MIX, LoadRunner, discover_couriers, register_couriers
+from .report import build_report, compare, format_report, save
+
+# модули, которым нужна БД, импортируются в командах: simulate запускается без настроек подключения
+
+
+def parse_mix(value: str) -> dict[str, int]:
+    # create_order=40,complete_order=30,...
+    return {name: int(weight) for name, weight in (item.split("=") for item in value.split(","))}
+
+
+def cmd_seed(args) -> None:
+    if args.url is not None:
+        asyncio.run(seed_api(args))
+        return
+
+    from src.database import get_session
+    from . import seed as seeding
+
+    db = get_session()
+    try:
+        counts = seeding.seed(db, districts=args.districts, couriers=args.couriers,
+                              districts_per_courier=args.districts_per_courier,
+                              orders_per_courier=args.orders_per_courier, history_days=args.history_days,
+                              batch_size=args.batch_size, rng_seed=args.seed)
+    finally:
+        db.close()
+    print(f"Seeded: {counts}. Restart the service so that it reloads districts and couriers.")
+
+
+async def seed_api(args) -> None:
+    async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+        count = await register_couriers(client, args.couriers, args.districts, args.districts_per_courier,
+                                        random.Random(args.seed), batch_size=min(args.batch_size, 1000))
+    print(f"Registered {count} couriers via {args.url}")
+
+
+def cmd_clear(args) -> None:
+    from src.database import get_session
+    from . import seed as seeding
+
+    db = get_session()
+    try:
+        print(f"Couriers removed: {seeding.clear(db)}. Restart the service so that it reloads districts and couriers.")
+    finally:
+        db.close()
+
+
+async def run_load(args) -> dict:
+    from . import seed as seeding
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        courier_ids = await discover_couriers(client)
+        if not courier_ids:
+            sys.exit("No benchmark couriers found, run `python -m benchmarks seed` first")
+        runner = LoadRunner(client, seeding.district_names(args.districts), courier_ids, args.mix, args.seed)
+        if args.warmup:
+            await runner.run(args.warmup, args.concurrency, args.rate)
+            runner.samples = {name: type(sample)() for name, sample in runner.samples.items()}
+        elapsed = await runner.run(args.duration, args.concurrency, args.rate)
+    params = {"url": args.url, "duration": args.duration, "warmup": args.warmup, "concurrency": args.concurrency,
+              "rate": args.rate, "mix": runner.mix, "couriers": len(courier_ids), "districts": args.districts}
+    return build_report(runner.samples, elapsed, params)
+
+
+def cmd_run(args) -> None:
+    report = asyncio.run(run_load(args))
+    print(format_report(report))
+    print(f"Saved to {save(report, args.output)}")
+
+
+def cmd_compare(args) -> None:
+    table, regression = compare(json.loads(args.old.read_text()), json.loads(args.new.read_text()), args.threshold)
+    print(table)
+    if regression:
+        sys.exit(f"Regression: p95 or throughput changed by more than {args.threshold}%")
+
+
+def parse_area(value: str) -> tuple[float, float, float]:
+    # 55.75,37.62,0.1 - широта и долгота центра, полуширина области в градусах
+    latitude, longitude, radius = (float(item) for item in value.split(","))
+    return latitude, longitude, radius
+
+
+def cmd_simulate(args) -> None:
+    rng = random.Random(args.seed)
+    if args.orders is not None:
+        orders = simulate.read_orders(args.orders)
+    else:
+        orders = simulate.synthetic_orders(args.synthetic_orders, args.districts, args.rate, args.mean_duration, rng,
+                                           args.area)
+    if args.couriers_file is not None:
+        couriers = simulate.read_couriers(args.couriers_file)
+    else:
+        couriers = simulate.synthetic_couriers(args.couriers, args.districts, args.districts_per_courier, rng,
+                                               args.area)
+    selector = simulate.StrategySelector(args.strategy, parse_mix_names(args.district_strategy))
+    report = simulate.Simulator(couriers, selector, queue=not args.no_queue).run(orders)
+    report["params"] = {name: str(value) if isinstance(value, Path) else value
+                        for name, value in vars(args).items() if name != "func"}
+    print(simulate.format_report({name: value for name, value in report.items() if name != "params"}))
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+        print(f"Saved to {args.output}")
+
+
+def parse_mix_names(value: str) -> dict[str, str]:
+    # центральный=weighted,заречный=productive
+    return {name: strategy for name, strategy in (item.split("=") for item in value.split(",") if item)}
+
+
+def cmd_export(args) -> None:
+    from src.database import get_session
+
+    db = get_session()
+    try:
+        print(f"Orders exported: {simulate.export_history(db, args.orders, args.couriers)}")
+    finally:
+        db.close()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Нагрузочное тестирование сервиса")
+    commands = parser.add_subparsers(required=True)
+
+    seed = commands.add_parser("seed", help="заполнить БД синтетическими данными")
+    seed.add_argument("--districts", type=int, default=50)
+    seed.add_argument("--couriers", type=int, default=10000)
+    seed.add_argument("--districts-per-courier", type=int, default=3)
+    seed.add_argument("--orders-per-courier", type=int, default=20)
+    seed.add_argument("--history-days", type=int, default=30)
+    seed.add_argument("--batch-size", type=int, default=5000)
+    seed.add_argument("--seed", type=int, default=0)
+    seed.add_argument("--url", default=None,
+                      help="зарегистрировать курьеров через API сервиса вместо записи в БД (STORAGE_BACKEND=memory)")
+    seed.set_defaults(func=cmd_seed)
+
+    clear = commands.add_parser("clear", help="удалить синтетические данные")
+    clear.set_defaults(func=cmd_clear)
+
+    run = commands.add_parser("run", help="запустить нагрузку на сервис")
+    run.add_argument("--url", default="http://localhost:7999")
+    run.add_argument("--districts", type=int, default=50, help="число районов, заданное при seed")
+    run.add_argument("--duration", type=float, default=30)
+    run.add_argument("--warmup", type=float, default=5)
+    run.add_argument("--concurrency", type=int, default=50)
+    run.add_argument("--rate", type=float, default=None, help="запросов в секунду; по умолчанию без ограничения")
+    run.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    run.add_argument("--timeout", type=float, default=10)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--output", type=Path, default=None)
+    run.set_defaults(func=cmd_run)
+
+    diff = commands.add_parser("compare", help="сравнить два сохраненных отчета")
+    diff.add_argument("old", type=Path)
+    diff.add_argument("new", type=Path)
+    diff.add_argument("--threshold", type=float, default=10, help="допустимое ухудшение, %%")
+    diff.set_defaults(func=cmd_compare)
+
+    sim = commands.add_parser("simulate", help="прогнать поток заказов через логику назначения без БД")
+    sim.add_argument("--orders", type=Path, default=None, help="CSV с заказами (см. export); по умолчанию синтетические")
+    sim.add_argument("--couriers-file", type=Path, default=None, help="CSV с курьерами; по умолчанию синтетические")
+    sim.add_argument("--synthetic-orders", type=int, default=100000)
+    sim.add_argument("--rate", type=float, default=1500, help="синтетических заказов в час")
+    sim.add_argument("--mean-duration", type=float, default=1800, help="среднее время выполнения, сек.")
+    sim.add_argument("--couriers", type=int, default=1000)
+    sim.add_argument("--districts", type=int, default=50)
+    sim.add_argument("--districts-per-courier", type=int, default=3)
+    sim.add_argument("--area", type=parse_area, default=None, help="координаты заказов и курьеров: lat,lon,радиус°")
+    sim.add_argument("--strategy", default="fastest")
+    sim.add_argument("--district-strategy", default="", help="стратегии районов: район=стратегия,...")
+    sim.add_argument("--no-queue", action="store_true", help="отклонять заказы без свободного курьера")
+    sim.add_argument("--seed", type=int, default=0)
+    sim.add_argument("--output", type=Path, default=None)
+    sim.set_defaults(func=cmd_simulate)
+
+    export = commands.add_parser("export", help="выгрузить историю заказов и курьеров из БД для simulate")
+    export.add_argument("orders", type=Path)
+    export.add_argument("couriers", type=Path)
+    export.set_defaults(func=cmd_export)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import asyncio
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import httpx
+
+# доли операций в нагрузке по умолчанию
+DEFAULT_MIX = {"create_order": 40, "complete_order": 30, "get_courier": 25, "get_couriers": 5}
+
+
+@dataclass
+class Sample:
+    latencies: list[float] = field(default_factory=list)  # секунды, только успешные ответы
+    statuses: dict[int, int] = field(default_factory=dict)
+    errors: int = 0  # сетевые ошибки и ответы 5xx
+
+    def add(self, latency: float, status: int | None) -> None:
+        if status is None or status >= 500:
+            self.errors += 1
+        else:
+            self.latencies.append(latency)
+        if status is not None:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+class LoadRunner:
+    """
+    Нагрузка на запущенный сервис: `concurrency` параллельных клиентов выполняют операции из `mix`.
+    Если задан `rate`, запросы запускаются с постоянной частотой (запросов в секунду на все клиенты),
+    иначе каждый клиент отправляет следующий запрос сразу после ответа на предыдущий.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, districts: list[str], courier_ids: list[str],
+                 mix: dict[str, int] | None = None, rng_seed: int = 0):
+        self.client = client
+        self.districts = districts
+        self.courier_ids = courier_ids
+        self.mix = mix or DEFAULT_MIX
+        self.rng = random.Random(rng_seed)
+        self.active_orders: list[str] = []  # заказы в работе, которые можно завершить
+        self.samples: dict[str, Sample] = {name: Sample() for name in self.mix}
+        self.operations = {"create_order": self.create_order, "complete_order": self.complete_order,
+                           "get_courier": self.get_courier, "get_couriers": self.get_couriers}
+        unknown = set(self.mix) - set(self.operations)
+        if unknown:
+            raise ValueError(f"Unknown operations: {', '.join(sorted(unknown))}")
+
+    async def request(self, name: str, method: str, url: str, **kwargs) -> httpx.Response | None:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.samples[name].add(time.perf_counter() - start, None)
+            return None
+        self.samples[name].add(time.perf_counter() - start, response.status_code)
+        return response
+
+    async def create_order(self) -> None:
+        response = await self.request("create_order", "POST", "/order",
+                                      json={"name": f"bench-order-{uuid.uuid4().hex[:8]}",
+                                            "district": self.rng.choice(self.districts)})
+        if response is not None and response.status_code == 200:
+            self.active_orders.append(response.json()["order_id"])
+
+    async def complete_order(self) -> None:
+        if not self.active_orders:  # завершать нечего - публикуем заказ
+            await self.create_order()
+            return
+        order_id = self.active_orders.pop(self.rng.randrange(len(self.active_orders)))
+        await self.request("complete_order", "POST", f"/order/{order_id}")
+
+    async def get_courier(self) -> None:
+        await self.request("get_courier", "GET", f"/courier/{self.rng.choice(self.courier_ids)}")
+
+    async def get_couriers(self) -> None:
+        await self.request("get_couriers", "GET", "/courier",
+                           params={"district": self.rng.choice(self.districts), "limit": 100})
+
+    def choose(self) -> str:
+        return self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+
+    async def run(self, duration: float, concurrency: int, rate: float | None = None) -> float:
+        """Выполняет нагрузку `duration` секунд и возвращает фактическую длительность."""
+        start = time.perf_counter()
+        deadline = start + duration
+        scheduled = 0
+
+        async def worker():
+            nonlocal scheduled
+            while True:
+                if rate:
+                    at = start + scheduled / rate
+                    scheduled += 1
+                    delay = at - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if time.perf_counter() >= deadline:
+                    return
+                await self.operations[self.choose()]()
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+
+async def register_couriers(client: httpx.AsyncClient, couriers: int, districts: int, districts_per_courier: int,
+                            rng: random.Random, batch_size: int = 1000, prefix: str = "bench") -> int:
+    """
+    Регистрирует синтетических курьеров через `POST /couriers/bulk` - для сервиса, данные которого
+    недоступны через БД (STORAGE_BACKEND=memory). История заказов не создается.
+    """
+    names = [f"{prefix}-district-{i}" for i in range(districts)]
+    for start in range(0, couriers, batch_size):
+        batch = [{"name": f"{prefix}-courier-{i}", "districts": rng.sample(names, min(districts_per_courier, districts))}
+                 for i in range(start, min(start + batch_size, couriers))]
+        response = await client.post("/couriers/bulk", json=batch)
+        response.raise_for_status()
+    return couriers
+
+
+async def discover_couriers(client: httpx.AsyncClient, prefix: str = "bench") -> list[str]:
+    """Идентификаторы курьеров синтетических данных, прочитанные из `GET /courier` по страницам."""
+    courier_ids, cursor = [], None
+    while True:
+        params = {"limit": 1000, **({"after": cursor} if cursor else {})}
+        response = await client.get("/courier", params=params)
+        response.raise_for_status()
+        courier_ids += [c["id"] for c in response.json() if c["name"].startswith(f"{prefix}-courier-")]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return courier_ids
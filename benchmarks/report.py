@@ -0,0 +1,113 @@
+import json
+import math
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .load import Sample
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    """Перцентиль методом ближайшего ранга; `values` должны быть отсортированы."""
+    if not values:
+        return None
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def summarize(sample: Sample, elapsed: float) -> dict:
+    latencies = sorted(sample.latencies)
+
+    def ms(value: float | None) -> float | None:
+        return None if value is None else round(value * 1000, 3)
+
+    return {"requests": len(latencies) + sample.errors,
+            "errors": sample.errors,
+            "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0,
+            "statuses": {str(code): count for code, count in sorted(sample.statuses.items())},
+            "latency_ms": {"mean": ms(sum(latencies) / len(latencies)) if latencies else None,
+                           "p50": ms(percentile(latencies, 50)),
+                           "p95": ms(percentile(latencies, 95)),
+                           "p99": ms(percentile(latencies, 99)),
+                           "max": ms(latencies[-1] if latencies else None)}}
+
+
+def git_commit() -> str | None:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def build_report(samples: dict[str, Sample], elapsed: float, params: dict) -> dict:
+    total = Sample()
+    for sample in samples.values():
+        total.latencies += sample.latencies
+        total.errors += sample.errors
+        for code, count in sample.statuses.items():
+            total.statuses[code] = total.statuses.get(code, 0) + count
+    return {"commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "params": params,
+            "elapsed": round(elapsed, 3),
+            "endpoints": {name: summarize(sample, elapsed) for name, sample in samples.items()},
+            "total": summarize(total, elapsed)}
+
+
+def save(report: dict, path: Path | None = None) -> Path:
+    if path is None:
+        stamp = report["timestamp"].replace(":", "").replace("-", "")[:15]
+        path = RESULTS_DIR / f"{stamp}-{(report['commit'] or 'unknown')[:12]}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    return path
+
+
+def format_report(report: dict) -> str:
+    lines = [f"{'endpoint':<16}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+    for name, row in {**report["endpoints"], "total": report["total"]}.items():
+        latency = row["latency_ms"]
+        cells = [latency[p] if latency[p] is not None else "-" for p in ("p50", "p95", "p99")]
+        lines.append(f"{name:<16}{row['requests']:>10}{row['errors']:>8}{row['throughput']:>10}"
+                     + "".join(f"{cell:>10}" for cell in cells))
+    return "\n".join(lines)
+
+
+def compare(old: dict, new: dict, threshold: float = 10.0) -> tuple[str, bool]:
+    """
+    Сравнивает два отчета по p95 и пропускной способности.
+    Возвращает таблицу и признак регрессии - ухудшения любого показателя больше чем на `threshold` процентов.
+    """
+    lines = [f"{old.get('commit')} -> {new.get('commit')}",
+             f"{'endpoint':<16}{'p95 ms':>20}{'change':>10}{'rps':>20}{'change':>10}"]
+    regression = False
+    for name in {**old["endpoints"], "total": None}:
+        if name not in new["endpoints"] and name != "total":
+            continue
+        a = old["total"] if name == "total" else old["endpoints"][name]
+        b = new["total"] if name == "total" else new["endpoints"][name]
+        p95_change = _change(a["latency_ms"]["p95"], b["latency_ms"]["p95"])
+        rps_change = _change(a["throughput"], b["throughput"])
+        if (p95_change or 0) > threshold or (rps_change or 0) < -threshold:
+            regression = True
+        lines.append(f"{name:<16}{_pair(a['latency_ms']['p95'], b['latency_ms']['p95']):>20}{_percent(p95_change):>10}"
+                     f"{_pair(a['throughput'], b['throughput']):>20}{_percent(rps_change):>10}")
+    return "\n".join(lines), regression
+
+
+def _change(old, new) -> float | None:
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def _pair(old, new) -> str:
+    return f"{old} -> {new}"
+
+
+def _percent(value: float | None) -> str:
+    return "-" if value is None else f"{value:+.1f}%"
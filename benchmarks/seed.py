@@ -0,0 +1,79 @@
+import random
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from src import crud, models
+from src.backfill import backfill_courier_stats
+
+PREFIX = "bench"
+
+
+def district_names(count: int) -> list[str]:
+    return [f"{PREFIX}-district-{i}" for i in range(count)]
+
+
+def seed(db: Session, districts: int = 50, couriers: int = 10000, districts_per_courier: int = 3,
+         orders_per_courier: int = 20, history_days: int = 30, batch_size: int = 5000, rng_seed: int = 0) -> dict:
+    """
+    Заполняет БД синтетическими районами, курьерами и историей завершенных заказов.
+    Все записи создаются пачками по `batch_size` строк; статистика курьеров пересчитывается в конце.
+    """
+    rng = random.Random(rng_seed)
+    names = district_names(districts)
+    district_ids = list(crud.create_or_get_districts(db, names).values())
+    now = datetime.now()
+
+    courier_rows, link_rows, order_rows = [], [], []
+    counts = {"couriers": 0, "orders": 0}
+
+    def flush(force: bool = False):
+        if not force and len(order_rows) < batch_size and len(courier_rows) < batch_size:
+            return
+        # порядок важен из-за внешних ключей: курьеры, их районы, затем заказы
+        for model, rows, key in ((models.Courier, courier_rows, "couriers"),
+                                 (models.CourierDistrict, link_rows, None),
+                                 (models.Order, order_rows, "orders")):
+            if rows:
+                db.execute(insert(model), rows)
+                if key:
+                    counts[key] += len(rows)
+                rows.clear()
+
+    for i in range(couriers):
+        courier_id = uuid.uuid4()
+        courier_rows.append({"id": courier_id, "name": f"{PREFIX}-courier-{i}"})
+        own = rng.sample(district_ids, min(districts_per_courier, len(district_ids)))
+        link_rows += [{"courier_id": courier_id, "district_id": d} for d in own]
+        for j in range(orders_per_courier):
+            published = now - timedelta(days=rng.uniform(0, history_days))
+            assigned = published + timedelta(seconds=rng.uniform(0, 120))
+            order_rows.append({"id": uuid.uuid4(), "name": f"{PREFIX}-order-{i}-{j}",
+                               "district_id": rng.choice(own), "courier_id": courier_id,
+                               "status": crud.Status.COMPLETED, "date_publication": published,
+                               "date_assignment": assigned,
+                               "date_completion": assigned + timedelta(minutes=rng.uniform(5, 60))})
+        flush()
+    flush(force=True)
+    db.commit()
+
+    backfill_courier_stats(db)
+    return {"districts": len(district_ids), **counts}
+
+
+def clear(db: Session) -> int:
+    """Удаляет данные, созданные `seed`, вместе с заказами, опубликованными в синтетических районах."""
+    districts = select(models.District.id).where(models.District.name.like(f"{PREFIX}-district-%"))
+    couriers = select(models.Courier.id).where(models.Courier.name.like(f"{PREFIX}-courier-%"))
+    db.execute(delete(models.Order).where(models.Order.district_id.in_(districts)))
+    db.execute(delete(models.OrderArchive).where(models.OrderArchive.district_id.in_(districts)))
+    db.execute(delete(models.CourierDailyStats).where(models.CourierDailyStats.courier_id.in_(couriers)))
+    db.execute(delete(models.DistrictDailyStats).where(models.DistrictDailyStats.district_id.in_(districts)))
+    db.execute(delete(models.CourierDistrict).where(models.CourierDistrict.courier_id.in_(couriers)))
+    db.execute(delete(models.CourierLocation).where(models.CourierLocation.courier_id.in_(couriers)))
+    result = db.execute(delete(models.Courier).where(models.Courier.id.in_(couriers)))
+    db.execute(delete(models.District).where(models.District.id.in_(districts)))
+    db.commit()
+    return result.rowcount
@@ -0,0 +1,325 @@
+import csv
+import heapq
+import itertools
+import math
+import random
+import time
+from array import array
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from src.config import COURIER_SPEED_KMH
+from src.dispatch import DispatchIndex, pick_courier
+from src.geo import GridIndex, distance_km
+from src.strategies import StrategySelector
+
+DAY = 86400
+
+
+@dataclass(slots=True)
+class SimOrder:
+    published_at: float  # секунды от начала потока
+    district: str
+    duration: float  # время выполнения курьером со скоростью 1 без учета дороги, сек.
+    latitude: float | None = None
+    longitude: float | None = None
+
+
+@dataclass(slots=True)
+class SimCourier:
+    districts: tuple[str, ...]
+    speed: float = 1.0  # множитель времени выполнения: 1.2 - на 20% медленнее среднего
+    latitude: float | None = None
+    longitude: float | None = None
+
+
+class Simulator:
+    """
+    Модель сервиса в памяти процесса, без БД. Заказы потока проходят через тот же выбор курьера,
+    что и `crud.create_order` в режиме index (`dispatch.pick_courier` и стратегии районов),
+    завершение обновляет показатели курьера как `crud.complete_orders`, а при `queue` заказы
+    без свободного курьера ждут в очереди района, как при ORDER_QUEUE_ENABLED.
+    Время модельное: события обрабатываются по порядку, без ожидания.
+    """
+
+    def __init__(self, couriers: list[SimCourier], selector: StrategySelector | None = None, queue: bool = True):
+        self.now = 0.0
+        self.couriers = couriers
+        self.selector = selector or StrategySelector()
+        self.queue = queue
+        self.index = DispatchIndex(clock=lambda: self.now, today=lambda: int(self.now // DAY))
+        self.index.load(((courier_id, 0, courier.districts) for courier_id, courier in enumerate(couriers)), ())
+        self.grid = GridIndex()
+        self.grid.load((courier_id, courier.latitude, courier.longitude)
+                       for courier_id, courier in enumerate(couriers) if courier.latitude is not None)
+
+        # показатели курьеров - списки: поштучные операции с ними быстрее, чем с массивами NumPy
+        count = len(couriers)
+        self.completed = [0] * count
+        self.total_seconds = [0.0] * count
+        self.work_days = [0] * count
+        self.last_day = [-1] * count
+
+        self._completions = []  # куча (время завершения, seq, курьер, заказ, время выполнения)
+        self._seq = itertools.count()
+        self._pending: dict[str, deque] = {}
+        self.published = self.queued = self.rejected = 0
+        self.first_published = self.last_completed = None
+        # компактные массивы: потоки в миллионы заказов не должны упираться в память
+        self.latencies = array("d")  # время выбора курьера, сек. реального времени
+        self.waits = array("d")  # от публикации до назначения, модельные сек.
+        self.durations = array("d")  # от назначения до завершения
+        self.events = 0
+
+    def run(self, orders) -> dict:
+        """`orders` - итерируемый поток `SimOrder`, упорядоченный по `published_at`."""
+        started = time.perf_counter()
+        for order in orders:
+            if order.published_at < self.now:
+                raise ValueError(f"Orders must be sorted by publication time: {order.published_at} < {self.now}")
+            while self._completions and self._completions[0][0] <= order.published_at:
+                self._complete(*heapq.heappop(self._completions))
+            self.now = order.published_at
+            self._publish(order)
+        while self._completions:
+            self._complete(*heapq.heappop(self._completions))
+        return self.report(time.perf_counter() - started)
+
+    def _publish(self, order: SimOrder) -> None:
+        self.events += 1
+        self.published += 1
+        if self.first_published is None:
+            self.first_published = order.published_at
+        strategy = self.selector.for_district(order.district)
+        start = time.perf_counter()
+        courier_id = pick_courier(self.index, order.district, strategy, order.latitude, order.longitude, self.grid)
+        self.latencies.append(time.perf_counter() - start)
+        if courier_id is not None:
+            self._assign(courier_id, order)
+        elif self.queue:
+            self.queued += 1
+            self._pending.setdefault(order.district, deque()).append(order)
+        else:
+            self.rejected += 1
+
+    def _assign(self, courier_id: int, order: SimOrder) -> None:
+        courier = self.couriers[courier_id]
+        duration = order.duration * courier.speed
+        if order.latitude is not None:
+            position = self.grid.position(courier_id)
+            if position is not None:
+                duration += distance_km(*position, order.latitude, order.longitude) / COURIER_SPEED_KMH * 3600
+        self.waits.append(self.now - order.published_at)
+        heapq.heappush(self._completions, (self.now + duration, next(self._seq), courier_id, order, duration))
+
+    def _complete(self, completed_at: float, _, courier_id: int, order: SimOrder, duration: float) -> None:
+        self.events += 1
+        self.now = completed_at
+        self.last_completed = completed_at
+        self.durations.append(duration)
+        # показатели курьера - как в crud.complete_orders: рабочий день по дате публикации заказа
+        self.completed[courier_id] += 1
+        self.total_seconds[courier_id] += duration
+        day = int(order.published_at // DAY)
+        if day != self.last_day[courier_id]:
+            self.last_day[courier_id] = day
+            self.work_days[courier_id] += 1
+        if order.latitude is not None:
+            self.grid.update(courier_id, order.latitude, order.longitude)
+        self.index.release(courier_id, round(self.total_seconds[courier_id] / self.completed[courier_id]),
+                           self.completed[courier_id] // self.work_days[courier_id], completion_seconds=duration)
+
+        # освободившийся курьер получает самый старый заказ из очередей своих районов
+        oldest = None
+        for district in self.couriers[courier_id].districts:
+            pending = self._pending.get(district)
+            if pending and (oldest is None or pending[0].published_at < oldest[0].published_at):
+                oldest = pending
+        if oldest is not None:
+            self.index.discard(courier_id)
+            self._assign(courier_id, oldest.popleft())
+
+    def report(self, elapsed: float) -> dict:
+        span = (self.last_completed - self.first_published) if self.published and self.last_completed else 0.0
+        waits = np.frombuffer(self.waits) if self.waits else np.zeros(0)
+        durations = np.frombuffer(self.durations) if self.durations else np.zeros(0)
+        latencies = np.frombuffer(self.latencies) if self.latencies else np.zeros(0)
+        utilisation = np.array(self.total_seconds) / span if span else np.zeros(len(self.couriers))
+        per_courier = np.array(self.completed, dtype=float)
+        # коэффициент вариации числа заказов на курьера
+        cv = None
+        if per_courier.size and per_courier.mean():
+            cv = round(float(per_courier.std() / per_courier.mean()), 4)
+        unserved = sum(len(pending) for pending in self._pending.values())
+
+        def quantiles(values: np.ndarray, scale: float = 1, digits: int = 3) -> dict:
+            if not len(values):
+                return {"mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+            p50, p95, p99 = np.percentile(values, [50, 95, 99], method="inverted_cdf") * scale
+            return {"mean": round(float(values.mean() * scale), digits), "p50": round(float(p50), digits),
+                    "p95": round(float(p95), digits), "p99": round(float(p99), digits),
+                    "max": round(float(values.max() * scale), digits)}
+
+        return {
+            "orders": {"published": self.published, "assigned": len(waits), "queued": self.queued,
+                       "rejected": self.rejected, "unserved": unserved},
+            "simulator": {"events": self.events, "elapsed": round(elapsed, 3),
+                          "events_per_second": round(self.events / elapsed) if elapsed else None},
+            "throughput": {"simulated_hours": round(span / 3600, 3),
+                           "completed_per_hour": round(len(durations) / span * 3600, 2) if span else None},
+            "assignment_latency_us": quantiles(latencies, scale=1e6),
+            "queue_delay_s": {"delayed_share": round(float((waits > 0).mean()), 4) if len(waits) else None,
+                              **quantiles(waits)},
+            "order_duration_s": quantiles(durations),
+            "utilisation": {"mean": round(float(utilisation.mean()), 4) if len(utilisation) else None,
+                            "p10": round(float(np.percentile(utilisation, 10)), 4) if len(utilisation) else None,
+                            "p90": round(float(np.percentile(utilisation, 90)), 4) if len(utilisation) else None},
+            # качество политики: среднее время от публикации до завершения и равномерность загрузки курьеров
+            "quality": {"mean_total_time_s": round(float((waits.mean() if len(waits) else 0)
+                                                        + (durations.mean() if len(durations) else 0)), 3),
+                        "orders_per_courier_cv": cv},
+        }
+
+
+def synthetic_couriers(couriers: int, districts: int, districts_per_courier: int, rng: random.Random,
+                       area: tuple[float, float, float] | None = None) -> list[SimCourier]:
+    """`area` - (широта, долгота, радиус в градусах) для случайных начальных положений курьеров."""
+    names = district_names(districts)
+    result = []
+    for _ in range(couriers):
+        courier = SimCourier(districts=tuple(rng.sample(names, min(districts_per_courier, districts))),
+                             speed=rng.lognormvariate(0, 0.25))
+        if area is not None:
+            courier.latitude, courier.longitude = _point(area, rng)
+        result.append(courier)
+    return result
+
+
+def synthetic_orders(orders: int, districts: int, rate: float, mean_duration: float, rng: random.Random,
+                     area: tuple[float, float, float] | None = None):
+    """
+    Пуассоновский поток `orders` заказов с частотой `rate` заказов в час; популярность районов
+    убывает по закону Ципфа, время выполнения распределено логнормально со средним `mean_duration`.
+    """
+    names = district_names(districts)
+    weights = list(itertools.accumulate(1 / (i + 1) for i in range(districts)))
+    sigma = 0.5
+    mu = math.log(mean_duration) - sigma ** 2 / 2
+    published_at = 0.0
+    for _ in range(orders):
+        published_at += rng.expovariate(rate / 3600)
+        district = rng.choices(names, cum_weights=weights)[0]
+        order = SimOrder(published_at, district, rng.lognormvariate(mu, sigma))
+        if area is not None:
+            order.latitude, order.longitude = _point(area, rng)
+        yield order
+
+
+def district_names(districts: int) -> list[str]:
+    return [f"sim-district-{i}" for i in range(districts)]
+
+
+def _point(area: tuple[float, float, float], rng: random.Random) -> tuple[float, float]:
+    latitude, longitude, radius = area
+    return latitude + rng.uniform(-radius, radius), longitude + rng.uniform(-radius, radius)
+
+
+def read_orders(path: Path):
+    """
+    Заказы из CSV с колонками published_at (секунды или дата ISO 8601), district, duration (сек.)
+    и необязательными latitude, longitude. Строки должны быть упорядочены по published_at.
+    """
+    with open(path, newline="") as f:
+        start = None
+        for row in csv.DictReader(f):
+            published_at = _seconds(row["published_at"])
+            if start is None:
+                start = published_at
+            order = SimOrder(published_at - start, row["district"].lower(), float(row["duration"]))
+            if row.get("latitude"):
+                order.latitude, order.longitude = float(row["latitude"]), float(row["longitude"])
+            yield order
+
+
+def read_couriers(path: Path) -> list[SimCourier]:
+    """Курьеры из CSV с колонками districts (через `;`) и необязательными speed, latitude, longitude."""
+    with open(path, newline="") as f:
+        return [SimCourier(districts=tuple(name.lower() for name in row["districts"].split(";") if name),
+                           speed=float(row.get("speed") or 1),
+                           latitude=float(row["latitude"]) if row.get("latitude") else None,
+                           longitude=float(row["longitude"]) if row.get("longitude") else None)
+                for row in csv.DictReader(f)]
+
+
+def _seconds(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def export_history(db, orders_path: Path, couriers_path: Path) -> int:
+    """
+    Выгружает завершенные заказы (вместе с архивом) и курьеров в файлы для `read_orders` и `read_couriers`.
+    Скорость курьера - отношение его avg_order_complete_time к среднему по всем курьерам, а время выполнения
+    заказа делится на скорость выполнившего его курьера. Возвращает число выгруженных заказов.
+    """
+    from sqlalchemy import func, select, union_all
+
+    from src import models
+    from src.crud import Status
+
+    couriers = {courier_id: avg for courier_id, avg in db.execute(
+        select(models.Courier.id, models.Courier.avg_order_complete_time)
+        .where(models.Courier.completed_orders > 0))}
+    mean = sum(couriers.values()) / len(couriers) if couriers else 0
+    speeds = {courier_id: (avg / mean if mean and avg else 1.0) for courier_id, avg in couriers.items()}
+
+    history = union_all(*(select(model.courier_id, model.district_id, model.date_publication, model.latitude,
+                                 model.longitude,
+                                 func.extract("epoch", model.date_completion
+                                              - func.coalesce(model.date_assignment, model.date_publication))
+                                 .label("seconds"))
+                          .where(model.status == Status.COMPLETED)
+                          for model in (models.Order, models.OrderArchive))).subquery()
+    rows = db.execute(select(history, models.District.name)
+                      .join(models.District, models.District.id == history.c.district_id)
+                      .order_by(history.c.date_publication)
+                      .execution_options(yield_per=10000))
+    exported = 0
+    with open(orders_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["published_at", "district", "duration", "latitude", "longitude"])
+        for row in rows:
+            writer.writerow([row.date_publication.isoformat(), row.name,
+                             round(float(row.seconds) / speeds.get(row.courier_id, 1.0), 3),
+                             row.latitude if row.latitude is not None else "",
+                             row.longitude if row.longitude is not None else ""])
+            exported += 1
+
+    districts: dict = {}
+    for courier_id, name in db.execute(select(models.CourierDistrict.courier_id, models.District.name)
+                                       .join(models.District,
+                                             models.District.id == models.CourierDistrict.district_id)):
+        districts.setdefault(courier_id, []).append(name)
+    locations = {courier_id: (latitude, longitude) for courier_id, latitude, longitude in db.execute(
+        select(models.CourierLocation.courier_id, models.CourierLocation.latitude, models.CourierLocation.longitude))}
+    with open(couriers_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "districts", "speed", "latitude", "longitude"])
+        for courier_id, names in districts.items():
+            latitude, longitude = locations.get(courier_id, ("", ""))
+            writer.writerow([courier_id, ";".join(names), round(speeds.get(courier_id, 1.0), 4), latitude, longitude])
+    return exported
+
+
+def format_report(report: dict) -> str:
+    lines = []
+    for section, values in report.items():
+        lines.append(section)
+        lines += [f"  {name:<24}{'-' if value is None else value}" for name, value in values.items()]
+    return "\n".join(lines)
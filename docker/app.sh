@@ -1,9 +1,4 @@
 #!/bin/bash
 
-alembic revision --autogenerate -m 'create tables'
-
-alembic upgrade head
-
-pytest -s -v -p no:warnings
-
-uvicorn src.main:app --host 0.0.0.0 --port 8000
\ No newline at end of file
+# схема БД проверяется в мастер-процессе gunicorn (docker/gunicorn.conf.py), миграции не генерируются
+exec gunicorn -c docker/gunicorn.conf.py src.main:app
@@ -0,0 +1,29 @@
+# Конфигурация gunicorn для запуска в контейнере: gunicorn -c docker/gunicorn.conf.py src.main:app
+import logging
+
+from src.config import DISPATCH_MODE, MIGRATE_ON_START, STORAGE_BACKEND, WEB_CONCURRENCY
+from src.migrate import ensure_schema
+
+bind = "0.0.0.0:8000"
+workers = WEB_CONCURRENCY
+worker_class = "uvicorn.workers.UvicornWorker"
+# приложение импортируется один раз в мастер-процессе, воркеры получают его при fork
+preload_app = True
+# индексы загружаются в каждом воркере при старте
+timeout = 60
+graceful_timeout = 30
+accesslog = "-"
+
+
+def on_starting(server):
+    # до запуска воркеров: схема БД проверяется (и обновляется) один раз на реплику
+    logger = logging.getLogger("gunicorn.error")
+    if STORAGE_BACKEND == "memory":
+        # БД не используется; у каждого воркера были бы свои курьеры и заказы
+        if WEB_CONCURRENCY > 1:
+            logger.warning("STORAGE_BACKEND=memory keeps all data per worker; use WEB_CONCURRENCY=1")
+        return
+    logger.info("Database schema: %s", ", ".join(ensure_schema(upgrade=MIGRATE_ON_START)))
+    if DISPATCH_MODE == "index" and WEB_CONCURRENCY > 1:
+        logger.warning("DISPATCH_MODE=index keeps idle couriers per worker; use DISPATCH_MODE=locking "
+                       "with WEB_CONCURRENCY > 1")
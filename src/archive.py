@@ -0,0 +1,94 @@
+import asyncio
+import datetime
+import logging
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from . import idempotency, models
+from .config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, DB_ASYNC
+from .crud import Status
+from .database import get_session, get_async_session
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_LOCK = 0x6f7264657273  # ключ advisory-блокировки: перенос выполняет один воркер за раз
+ARCHIVE_COLUMNS = ("id", "name", "district_id", "courier_id", "status",
+                   "date_publication", "date_completion", "date_assignment", "latitude", "longitude")
+
+
+def archive_batch(db: Session, completed_before: datetime.datetime, batch_size: int) -> int | None:
+    """
+    Переносит в orders_archive до `batch_size` заказов, завершенных раньше `completed_before`, одной транзакцией.
+    Возвращает число перенесенных заказов или `None`, если перенос уже выполняет другой процесс.
+    """
+    if not db.execute(select(func.pg_try_advisory_xact_lock(ARCHIVE_LOCK))).scalar():
+        db.rollback()
+        return None
+
+    batch = (select(models.Order.id)
+             .where(models.Order.status == Status.COMPLETED, models.Order.date_completion < completed_before)
+             .order_by(models.Order.date_completion)
+             .limit(batch_size)
+             .with_for_update(skip_locked=True))
+    # DELETE ... RETURNING и INSERT выполняются одним запросом
+    moved = (delete(models.Order)
+             .where(models.Order.id.in_(batch.scalar_subquery()))
+             .returning(*(getattr(models.Order, c) for c in ARCHIVE_COLUMNS))
+             .cte("moved"))
+    result = db.execute(insert(models.OrderArchive).from_select(ARCHIVE_COLUMNS, select(moved)))
+    db.commit()
+    return result.rowcount
+
+
+def archive_orders(db: Session, after_days: float = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Переносит в архив все заказы, завершенные больше `after_days` дней назад; возвращает их число."""
+    completed_before = datetime.datetime.now() - datetime.timedelta(days=after_days)
+    archived = 0
+    while True:
+        moved = archive_batch(db, completed_before, batch_size)
+        if moved is None:
+            break
+        archived += moved
+        if moved < batch_size:
+            break
+    return archived
+
+
+async def run_archiver(interval: float) -> None:
+    # фоновая задача приложения; короткие транзакции по пачкам не блокируют рабочую таблицу надолго
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if DB_ASYNC:
+                async with get_async_session() as db:
+                    archived = await db.run_sync(archive_orders)
+            else:
+                archived = await run_in_threadpool(_archive_orders)
+            if archived:
+                logger.info("Archived %d completed orders", archived)
+            await run_in_threadpool(_purge_idempotency_keys)
+        except Exception:
+            logger.exception("Order archiving failed")
+
+
+def _archive_orders() -> int:
+    db = get_session()
+    try:
+        return archive_orders(db)
+    finally:
+        db.close()
+
+
+def _purge_idempotency_keys() -> int:
+    # истекшие ответы по Idempotency-Key удаляются той же фоновой задачей
+    db = get_session()
+    try:
+        return idempotency.purge_expired(db)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    print(f"Orders archived: {_archive_orders()}")
@@ -0,0 +1,60 @@
+from sqlalchemy import delete, func, insert, select, update, extract, union_all
+from sqlalchemy.orm import Session
+
+from . import models
+from .crud import Status
+from .database import get_session
+
+
+def backfill_courier_stats(db: Session) -> int:
+    """Пересчитывает накопленную и дневную статистику курьеров и районов по уже завершенным заказам."""
+    # завершенные заказы из рабочей таблицы и из архива
+    columns = ("courier_id", "district_id", "date_publication", "date_assignment", "date_completion")
+    completed = union_all(
+        select(*(getattr(models.Order, c) for c in columns)).where(models.Order.status == Status.COMPLETED),
+        select(*(getattr(models.OrderArchive, c) for c in columns)),
+    ).subquery()
+    day = func.date(completed.c.date_publication)
+    started = func.coalesce(completed.c.date_assignment, completed.c.date_publication)
+    complete_time = extract("epoch", completed.c.date_completion - started)
+
+    # дневная статистика курьеров и районов: число заказов, суммарное, минимальное и максимальное время
+    for model, key in ((models.CourierDailyStats, completed.c.courier_id),
+                       (models.DistrictDailyStats, completed.c.district_id)):
+        db.execute(delete(model))
+        db.execute(insert(model).from_select(
+            [key.name, "day", "orders_count", "total_seconds", "min_seconds", "max_seconds"],
+            select(key, day, func.count(), func.sum(complete_time), func.min(complete_time), func.max(complete_time))
+            .group_by(key, day),
+        ))
+
+    orders = (select(completed.c.courier_id,
+                     func.count().label("completed_orders"),
+                     func.sum(complete_time).label("total_complete_time"))
+              .group_by(completed.c.courier_id)
+              .subquery())
+    days = (select(models.CourierDailyStats.courier_id, func.count().label("work_days"))
+            .group_by(models.CourierDailyStats.courier_id)
+            .subquery())
+
+    db.execute(update(models.Courier).values(completed_orders=0, total_complete_time=0, work_days=0,
+                                             avg_order_complete_time=0, avg_day_orders=0))
+    result = db.execute(
+        update(models.Courier)
+        .where(models.Courier.id == orders.c.courier_id, models.Courier.id == days.c.courier_id)
+        .values(completed_orders=orders.c.completed_orders,
+                total_complete_time=orders.c.total_complete_time,
+                work_days=days.c.work_days,
+                avg_order_complete_time=orders.c.total_complete_time / orders.c.completed_orders,
+                avg_day_orders=orders.c.completed_orders // days.c.work_days)
+    )
+    db.commit()
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    session = get_session()
+    try:
+        print(f"Courier stats recalculated: {backfill_courier_stats(session)}")
+    finally:
+        session.close()
@@ -0,0 +1,210 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .config import CACHE_TTL, CACHE_LOCAL_TTL, CACHE_MAXSIZE, CACHE_REDIS_URL, WEB_CONCURRENCY
+from .database import DEFERRED_COMMIT
+
+
+class LocalCache:
+    """Кэш в памяти процесса: LRU на `maxsize` записей, каждая запись живет `ttl` секунд."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._data: OrderedDict[str, tuple[float, object]] = OrderedDict()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.evictions += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class MemoryBackend:
+    """Общий бэкенд в памяти с интерфейсом RedisBackend - замена Redis в тестах и при локальном запуске."""
+
+    def __init__(self, ttl: float):
+        self.local = LocalCache(maxsize=2 ** 31, ttl=ttl)
+
+    def get(self, key: str):
+        value = self.local.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, value) -> None:
+        self.local.set(key, json.dumps(value))
+
+    def delete(self, *keys: str) -> None:
+        self.local.delete(*keys)
+
+
+class RedisBackend:
+    """Общий для всех воркеров кэш в Redis (нужен пакет `redis`)."""
+
+    def __init__(self, url: str, ttl: float):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key: str):
+        value = self.client.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, value) -> None:
+        self.client.set(key, json.dumps(value), px=int(self.ttl * 1000))
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*keys)
+
+
+class Cache:
+    """
+    Кэш чтения: сначала проверяется кэш процесса, затем общий бэкенд (если задан), затем данные загружаются из БД.
+    Значения должны сериализоваться в JSON.
+
+    Значение, загруженное до сброса ключа, в кэш не записывается: `invalidate` увеличивает поколение ключа,
+    и загрузка, начавшаяся в прежнем поколении, свой результат отбрасывает.
+    """
+
+    def __init__(self, local: LocalCache | None, shared=None):
+        self.local = local
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        # ключ -> [число загрузок в процессе, поколение]; хранится только пока ключ загружается
+        self._loading: dict[str, list[int]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.local is not None or self.shared is not None
+
+    def get_or_load(self, key: str, load):
+        value = self.local.get(key) if self.local is not None else None
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None and self.local is not None:
+                self.local.set(key, value)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        with self._lock:
+            self.misses += 1
+            loading = self._loading.setdefault(key, [0, 0])
+            loading[0] += 1
+            generation = loading[1]
+        try:
+            value = load()
+            if value is None:  # отсутствующие записи не кэшируются
+                return value
+            with self._lock:
+                if loading[1] != generation:
+                    return value  # ключ сброшен во время загрузки - значение могло устареть
+                if self.local is not None:
+                    self.local.set(key, value)
+            if self.shared is not None:
+                self.shared.set(key, value)
+                with self._lock:
+                    stale = loading[1] != generation
+                if stale:  # сброс прошел между проверкой и записью
+                    self.shared.delete(key)
+            return value
+        finally:
+            with self._lock:
+                loading[0] -= 1
+                if not loading[0]:
+                    del self._loading[key]
+
+    def invalidate(self, *keys: str) -> None:
+        if not keys:
+            return
+        with self._lock:
+            self.invalidations += len(keys)
+            for key in keys:
+                if key in self._loading:
+                    self._loading[key][1] += 1
+            if self.local is not None:
+                self.local.delete(*keys)
+        if self.shared is not None:
+            self.shared.delete(*keys)
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled,
+                "shared": type(self.shared).__name__ if self.shared is not None else None,
+                "size": len(self.local) if self.local is not None else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.local.evictions if self.local is not None else 0,
+                "invalidations": self.invalidations}
+
+
+def courier_key(courier_id) -> str:
+    return f"courier:{courier_id}"
+
+
+def order_key(order_id) -> str:
+    return f"order:{order_id}"
+
+
+def invalidate_on_commit(db: Session, *keys: str) -> None:
+    # ключи сбрасываются после успешного коммита транзакции; при откате они забываются
+    db.info.setdefault("cache_invalidate", set()).update(keys)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session) -> None:
+    if session.info.get(DEFERRED_COMMIT):
+        return  # коммит точки сохранения, см. database.DEFERRED_COMMIT
+    cache.invalidate(*session.info.pop("cache_invalidate", ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session: Session) -> None:
+    session.info.pop("cache_invalidate", None)
+
+
+def create_cache() -> Cache:
+    if not CACHE_TTL:
+        return Cache(local=None)
+    shared = RedisBackend(CACHE_REDIS_URL, CACHE_TTL) if CACHE_REDIS_URL else None
+    # сброс ключей виден только процессу, выполнившему коммит, поэтому кэш процесса допустим лишь при одном воркере
+    # и без общего бэкенда: общий бэкенд означает несколько воркеров или реплик, и кэшируется только он
+    local = LocalCache(CACHE_MAXSIZE, CACHE_LOCAL_TTL) if WEB_CONCURRENCY == 1 and shared is None else None
+    return Cache(local=local, shared=shared)
+
+
+cache = create_cache()
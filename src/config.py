@@ -14,3 +14,74 @@ DB_PORT_TEST = os.environ.get("DB_PORT_TEST")
 DB_NAME_TEST = os.environ.get("DB_NAME_TEST")
 DB_USER_TEST = os.environ.get("DB_USER_TEST")
 DB_PASS_TEST = os.environ.get("DB_PASS_TEST")
+
+DB_ASYNC = os.environ.get("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", -1))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT = int(os.environ.get("DB_STATEMENT_TIMEOUT", 0))  # мс, 0 - без ограничения
+DB_POOL_WARM = int(os.environ.get("DB_POOL_WARM", DB_POOL_SIZE))  # соединений, открываемых при старте воркера
+
+# sql - данные в PostgreSQL; memory - в памяти процесса (src/repository.py), без БД: для тестов и для оценки того,
+# какую часть задержки запроса занимает работа с БД. Данные теряются при перезапуске, воркер должен быть один
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sql")
+
+# index - свободные курьеры берутся из индекса в памяти процесса (один воркер);
+# locking - курьер захватывается в БД через SELECT ... FOR UPDATE SKIP LOCKED (несколько воркеров)
+DISPATCH_MODE = os.environ.get("DISPATCH_MODE", "index")
+
+# выбор курьера в районе (src/strategies.py): fastest, productive, least_recent, weighted;
+# DISPATCH_STRATEGY_DISTRICTS переопределяет стратегию для отдельных районов: "центральный=weighted,заречный=productive"
+DISPATCH_STRATEGY = os.environ.get("DISPATCH_STRATEGY", "fastest")
+DISPATCH_STRATEGY_DISTRICTS = {name.strip(): strategy.strip() for name, strategy in
+                               (item.split("=") for item in os.environ.get("DISPATCH_STRATEGY_DISTRICTS", "").split(",")
+                                if item.strip())}
+# веса признаков стратегии weighted и коэффициент сглаживания EWMA времени выполнения
+DISPATCH_WEIGHTS = {name.strip(): float(weight) for name, weight in
+                    (item.split("=") for item in os.environ.get("DISPATCH_WEIGHTS", "time=1,load=1,idle=1").split(",")
+                     if item.strip())}
+if not DISPATCH_WEIGHTS.keys() <= {"time", "load", "idle"}:
+    raise ValueError(f"Unknown DISPATCH_WEIGHTS keys {sorted(DISPATCH_WEIGHTS.keys() - {'time', 'load', 'idle'})}, "
+                     "expected time, load, idle")
+DISPATCH_EWMA_ALPHA = float(os.environ.get("DISPATCH_EWMA_ALPHA", 0.3))
+
+# если свободного курьера нет, заказ ставится в очередь района (status = 0) вместо ответа 404
+ORDER_QUEUE_ENABLED = os.environ.get("ORDER_QUEUE_ENABLED", "false").lower() in ("1", "true", "yes")
+
+COURIERS_PAGE_SIZE = int(os.environ.get("COURIERS_PAGE_SIZE", 100))  # курьеров на страницу GET /courier по умолчанию
+
+# кэш GET /courier/{id} и GET /order/{id}; CACHE_TTL=0 отключает кэш
+CACHE_TTL = float(os.environ.get("CACHE_TTL", 5))
+CACHE_LOCAL_TTL = float(os.environ.get("CACHE_LOCAL_TTL", CACHE_TTL))  # кэш процесса работает только при одном воркере без CACHE_REDIS_URL
+CACHE_MAXSIZE = int(os.environ.get("CACHE_MAXSIZE", 100000))
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")  # общий кэш для всех воркеров, например redis://redis:6379/0
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")  # метрики для GET /metrics
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 0))  # запросы дольше порога пишутся в лог с SQL, 0 - отключено
+SLOW_REQUEST_STATEMENTS = int(os.environ.get("SLOW_REQUEST_STATEMENTS", 50))  # сколько SQL-запросов сохранять для лога
+
+# перенос завершенных заказов в orders_archive: старше ARCHIVE_AFTER_DAYS дней, пачками по ARCHIVE_BATCH_SIZE,
+# раз в ARCHIVE_INTERVAL секунд в фоне (0 - фоновый перенос отключен, остается запуск python -m src.archive)
+ARCHIVE_AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", 30))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", 1000))
+ARCHIVE_INTERVAL = float(os.environ.get("ARCHIVE_INTERVAL", 0))
+
+# события о заказах для WebSocket-подписчиков; EVENTS_NOTIFY=true рассылает их через Postgres NOTIFY всем воркерам
+EVENTS_NOTIFY = os.environ.get("EVENTS_NOTIFY", "false").lower() in ("1", "true", "yes")
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", 100))  # непрочитанных событий на подписчика
+
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", 86400))  # сколько секунд хранится ответ по Idempotency-Key
+
+# назначение ближайшего курьера для заказов с координатами: оценка курьера - время в пути до заказа
+# со скоростью COURIER_SPEED_KMH плюс avg_order_complete_time; курьеры дальше GEO_MAX_RADIUS_KM не учитываются
+COURIER_SPEED_KMH = float(os.environ.get("COURIER_SPEED_KMH", 15))
+GEO_MAX_RADIUS_KM = float(os.environ.get("GEO_MAX_RADIUS_KM", 20))
+GEO_CELL_KM = float(os.environ.get("GEO_CELL_KM", 1))  # размер ячейки сетки положений курьеров
+LOCATIONS_FLUSH_INTERVAL = float(os.environ.get("LOCATIONS_FLUSH_INTERVAL", 1))  # секунд между записями положений в БД
+
+# запуск через gunicorn (docker/app.sh): проверка схемы БД и число воркеров
+MIGRATE_ON_START = os.environ.get("MIGRATE_ON_START", "true").lower() in ("1", "true", "yes")
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 1))
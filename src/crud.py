@@ -1,18 +1,34 @@
 import datetime
+import json
 import uuid
 from enum import IntEnum
-from math import floor
+from functools import partial
 
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
-from . import models, schemas
+from sqlalchemy import select, text, update, exists, func, values, column, Float, Integer, UUID
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
+from . import matching, models, schemas
+from .cache import cache, courier_key, order_key, invalidate_on_commit
+from .config import DISPATCH_MODE, ORDER_QUEUE_ENABLED, COURIER_SPEED_KMH, GEO_MAX_RADIUS_KM
+from .database import undo_on_rollback
+from .dispatch import dispatch_index, pick_courier
+from .districts import district_registry, normalize, register_on_commit
+from .events import publish_on_commit
+from .geo import EARTH_RADIUS_KM, courier_grid
+from .strategies import DispatchStrategy, Fastest, strategy_selector
 
 
 class Status(IntEnum):
+    PENDING = 0
     IN_PROGRESS = 1
     COMPLETED = 2
 
 
+ACTIVE_ORDER_INDEX = "ix_orders_active_courier"  # уникальный индекс: один заказ в работе на курьера
+
+
 def get_district(db: Session, district_param: str) -> schemas.District | None:
     district = db.query(models.District).filter(models.District.name == district_param.lower()).first()
     if district is None:
@@ -21,6 +37,39 @@ def get_district(db: Session, district_param: str) -> schemas.District | None:
     return district
 
 
+def load_district_registry(db: Session) -> None:
+    district_registry.load(db.execute(select(models.District.name, models.District.id)))
+
+
+def get_district_registry(db: Session):
+    if not district_registry.loaded:
+        load_district_registry(db)
+    return district_registry
+
+
+def get_district_id(db: Session, district_name: str) -> uuid.UUID | None:
+    # район ищется в реестре процесса; в БД - только если его создал другой воркер после загрузки реестра
+    registry = get_district_registry(db)
+    district_id = registry.get(district_name)
+    if district_id is None:
+        name = normalize(district_name)
+        district_id = db.execute(select(models.District.id).where(models.District.name == name)).scalar()
+        if district_id is not None:
+            registry.update({name: district_id})
+    return district_id
+
+
+def get_district_ids(db: Session, district_names) -> dict[str, uuid.UUID]:
+    registry = get_district_registry(db)
+    district_ids, missing = registry.resolve(district_names)
+    if missing:
+        found = dict(db.execute(select(models.District.name, models.District.id)
+                                .where(models.District.name.in_(missing))).all())
+        registry.update(found)
+        district_ids.update(found)
+    return district_ids
+
+
 def create_or_get_district(db: Session, district_name: schemas.DistrictBase):
     db_district = get_district(db, district_name)
     if db_district is not None:
@@ -28,45 +77,198 @@ def create_or_get_district(db: Session, district_name: schemas.DistrictBase):
 
     db_district = models.District(name=district_name.lower(), id=uuid.uuid4())
     db.add(db_district)
+    register_on_commit(db, {db_district.name: db_district.id})
     db.commit()
     db.refresh(db_district)
     return db_district
 
 
-def create_courier(db: Session, courier: schemas.CourierIn):
-    id_courier = uuid.uuid4()
-    db_courier = models.Courier(id=id_courier, name=courier.name)
-    db.add(db_courier)
+def create_or_get_districts(db: Session, district_names) -> dict[str, uuid.UUID]:
+    # известные районы берутся из реестра; один INSERT ... ON CONFLICT на остальные,
+    # сортировка задает одинаковый порядок блокировок для параллельных запросов
+    district_ids, missing = get_district_registry(db).resolve(district_names)
+    names = sorted(missing)
+    if not names:
+        return district_ids
+    created = dict(db.execute(
+        insert(models.District)
+        .values([{"id": uuid.uuid4(), "name": name} for name in names])
+        .on_conflict_do_nothing(index_elements=[models.District.name])
+        .returning(models.District.name, models.District.id)
+    ).all())
+    existing = [name for name in names if name not in created]
+    if existing:
+        created.update(db.execute(select(models.District.name, models.District.id)
+                                  .where(models.District.name.in_(existing))).all())
+    register_on_commit(db, created)
+    return district_ids | created
+
+
+def load_dispatch_index(db: Session) -> None:
+    couriers_districts: dict[uuid.UUID, list[uuid.UUID]] = {}
+    for courier_id, district_id in db.query(models.CourierDistrict.courier_id, models.CourierDistrict.district_id):
+        couriers_districts.setdefault(courier_id, []).append(district_id)
+
+    couriers = db.query(models.Courier.id, models.Courier.avg_order_complete_time, models.Courier.avg_day_orders).all()
+    busy = db.query(models.Order.courier_id).filter(models.Order.status == Status.IN_PROGRESS).distinct()
+    orders_today = db.query(models.CourierDailyStats.courier_id, models.CourierDailyStats.orders_count).filter(
+        models.CourierDailyStats.day == datetime.date.today())
+
+    dispatch_index.load(((courier_id, metric, couriers_districts.get(courier_id, ()))
+                         for courier_id, metric, _ in couriers),
+                        (courier_id for courier_id, in busy),
+                        avg_day_orders={courier_id: day_orders for courier_id, _, day_orders in couriers},
+                        orders_today=dict(orders_today.all()))
+    courier_grid.load(db.execute(select(models.CourierLocation.courier_id, models.CourierLocation.latitude,
+                                        models.CourierLocation.longitude)))
+
+
+def get_dispatch_index(db: Session):
+    if DISPATCH_MODE == "locking":
+        return None  # свободные курьеры определяются запросом к БД, индекс не ведется
+    if not dispatch_index.loaded:
+        load_dispatch_index(db)
+    return dispatch_index
+
+
+def lock_idle_courier(db: Session, district_id: uuid.UUID, latitude: float | None = None,
+                      longitude: float | None = None, strategy: DispatchStrategy | None = None) -> uuid.UUID | None:
+    # строка курьера блокируется до конца транзакции, параллельные запросы пропускают ее и берут следующего
+    has_active_order = exists().where(models.Order.courier_id == models.Courier.id,
+                                      models.Order.status == Status.IN_PROGRESS)
+    query = (select(models.Courier.id)
+             .join(models.CourierDistrict, models.CourierDistrict.courier_id == models.Courier.id)
+             .where(models.CourierDistrict.district_id == district_id, ~has_active_order))
+    if latitude is not None:
+        # курьеры с известным положением в пределах GEO_MAX_RADIUS_KM - по travel_score, остальные - после них
+        location = models.CourierLocation
+        distance = EARTH_RADIUS_KM * func.sqrt(
+            func.power(func.radians(location.longitude - longitude)
+                       * func.cos(func.radians((location.latitude + latitude) / 2)), 2)
+            + func.power(func.radians(location.latitude - latitude), 2))
+        query = (query.outerjoin(location, location.courier_id == models.Courier.id)
+                 .order_by(func.coalesce(distance, GEO_MAX_RADIUS_KM + 1) > GEO_MAX_RADIUS_KM,
+                           distance / COURIER_SPEED_KMH * 3600 + models.Courier.avg_order_complete_time))
+    # стратегии, признаки которых есть только в памяти процесса, выбирают по avg_order_complete_time
+    order_by = (strategy and strategy.order_by()) or Fastest().order_by()
+    query = (query.order_by(*order_by)
+             .limit(1)
+             .with_for_update(of=models.Courier, skip_locked=True))
+    return db.execute(query).scalar()
+
+
+def lock_idle_couriers(db: Session, district_ids: list[uuid.UUID]) -> list[uuid.UUID | None]:
+    # по len(district_ids) самых быстрых свободных курьеров каждого района; занятые другими транзакциями пропускаются
+    has_active_order = exists().where(models.Order.courier_id == models.Courier.id,
+                                      models.Order.status == Status.IN_PROGRESS)
+    rank = func.row_number().over(partition_by=models.CourierDistrict.district_id,
+                                  order_by=models.Courier.avg_order_complete_time)
+    ranked = (select(models.Courier.id, models.Courier.avg_order_complete_time, models.CourierDistrict.district_id,
+                     rank.label("rank"))
+              .join(models.CourierDistrict, models.CourierDistrict.courier_id == models.Courier.id)
+              .where(models.CourierDistrict.district_id.in_(set(district_ids)), ~has_active_order)
+              .subquery())
+    rows = db.execute(select(ranked.c.id, ranked.c.avg_order_complete_time, ranked.c.district_id)
+                      .where(ranked.c.rank <= len(district_ids))).all()
+    locked = set(db.execute(select(models.Courier.id)
+                            .where(models.Courier.id.in_({row.id for row in rows}), ~has_active_order)
+                            .with_for_update(skip_locked=True)).scalars()) if rows else set()
+
+    candidates: dict[uuid.UUID, tuple[int, set]] = {}
+    for courier_id, metric, district_id in rows:
+        if courier_id in locked:
+            candidates.setdefault(courier_id, (metric or 0, set()))[1].add(district_id)
+    couriers = list(candidates)
+    costs = [[candidates[c][0] if d in candidates[c][1] else None for c in couriers] for d in district_ids]
+    return [None if col is None else couriers[col] for col in matching.assign(costs)]
+
+
+def get_existing_couriers(db: Session, courier_ids) -> set[uuid.UUID]:
+    return set(db.execute(select(models.Courier.id).where(models.Courier.id.in_(set(courier_ids)))).scalars())
+
+
+def create_couriers(db: Session, couriers: list[schemas.CourierIn]) -> list[schemas.CourierBase]:
+    index = get_dispatch_index(db)
+    if not couriers:
+        return []
+
+    district_ids = create_or_get_districts(db, (d for courier in couriers for d in courier.districts))
+    created = [schemas.CourierBase(id=uuid.uuid4(), name=courier.name) for courier in couriers]
+    couriers_districts = {courier.id: sorted({district_ids[d.lower()] for d in courier_in.districts})
+                          for courier, courier_in in zip(created, couriers)}
+
+    db.execute(insert(models.Courier), [{"id": courier.id, "name": courier.name} for courier in created])
+    db.execute(insert(models.CourierDistrict), [{"courier_id": courier_id, "district_id": district_id}
+                                                for courier_id, ids in couriers_districts.items()
+                                                for district_id in ids])
+
+    busy = set()
+    if ORDER_QUEUE_ENABLED:
+        # новые курьеры сразу разбирают очереди своих районов
+        lock_district_queues(db, district_ids.values())
+        pending_districts = set(db.execute(
+            select(models.Order.district_id.distinct())
+            .where(models.Order.status == Status.PENDING,
+                   models.Order.district_id.in_(set(district_ids.values())))
+        ).scalars())
+        for courier_id, ids in couriers_districts.items():
+            if pending_districts.intersection(ids) and assign_pending_order(db, courier_id) is not None:
+                busy.add(courier_id)
+
     db.commit()
+    if index is not None:
+        for courier_id, ids in couriers_districts.items():
+            index.add_courier(courier_id, 0, ids, idle=courier_id not in busy)
+    return created
 
-    districts = courier.districts
-    for district in districts:
-        db_district = create_or_get_district(db, district)
-        db_district.name = db_district.name.lower()
-        courier_district = models.CourierDistrict(courier_id=id_courier, district_id=db_district.id)
-        db.add(courier_district)
 
-    db.commit()
-    db.refresh(db_courier)
-    return db_courier
+def create_courier(db: Session, courier: schemas.CourierIn) -> schemas.CourierBase:
+    return create_couriers(db, [courier])[0]
 
 
-def get_active_order_by_courier(db: Session, courier: schemas.Courier):
-    try:
-        db_order = db.query(models.Order).filter(models.Order.status == Status.IN_PROGRESS,
-                                                 models.Order.courier_id == courier.id).first()
-    except Exception:
-        db_order = None
-    return db_order
+def select_couriers(filters: schemas.CourierFilters):
+    query = select(models.Courier.id, models.Courier.name)
+    if filters.district is not None:
+        district_id = select(models.District.id).where(models.District.name == filters.district.lower())
+        query = (query.join(models.CourierDistrict, models.CourierDistrict.courier_id == models.Courier.id)
+                 .where(models.CourierDistrict.district_id == district_id.scalar_subquery()))
+    if filters.state is not None:
+        has_active_order = exists().where(models.Order.courier_id == models.Courier.id,
+                                          models.Order.status == Status.IN_PROGRESS)
+        query = query.where(has_active_order if filters.state == schemas.CourierState.busy else ~has_active_order)
+    return query.order_by(models.Courier.id)
+
+
+def get_couriers(db: Session, filters: schemas.CourierFilters = schemas.CourierFilters(),
+                 after: uuid.UUID | None = None, limit: int | None = None):
+    # постраничная выборка по ключу: следующая страница начинается после id последнего курьера
+    query = select_couriers(filters)
+    if after is not None:
+        query = query.where(models.Courier.id > after)
+    if limit is not None:
+        query = query.limit(limit)
+    return db.execute(query).all()
+
 
+def courier_ndjson(courier_id: uuid.UUID, name: str) -> str:
+    return json.dumps({"id": str(courier_id), "name": name}, ensure_ascii=False) + "\n"
 
-def get_couriers(db: Session):
-    return db.query(models.Courier).all()
+
+def stream_couriers(db: Session, filters: schemas.CourierFilters):
+    # строки читаются серверным курсором порциями, без загрузки всей таблицы в память
+    try:
+        for courier_id, name in db.execute(select_couriers(filters).execution_options(yield_per=1000)):
+            yield courier_ndjson(courier_id, name)
+    finally:
+        db.close()
 
 
-def get_courier(db: Session, id: str):
+def load_courier(db: Session, id: str) -> dict | None:
+    # курьер и его активный заказ читаются одним запросом (LEFT OUTER JOIN orders)
     try:
-        db_courier = db.query(models.Courier).filter(models.Courier.id == id).first()
+        db_courier = db.execute(select(models.Courier)
+                                .options(joinedload(models.Courier.active_order))
+                                .where(models.Courier.id == id)).scalar()
     except Exception:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='`id` parameter must be of the `uuid` format')
 
@@ -74,48 +276,152 @@ def get_courier(db: Session, id: str):
         return None
 
     schema_order = None
-    db_active_order = get_active_order_by_courier(db, db_courier)
+    db_active_order = db_courier.active_order
 
     if db_active_order is not None:
-        schema_order = schemas.OrderOut(order_id=db_active_order.id, order_name=db_active_order.name)
+        schema_order = {"order_id": str(db_active_order.id), "order_name": db_active_order.name}
 
-    courier = schemas.Courier(id=db_courier.id,
-                              name=db_courier.name,
-                              avg_order_complete_time=db_courier.avg_order_complete_time,
-                              avg_day_orders=db_courier.avg_day_orders,
-                              active_order=schema_order)
-    return courier
+    return {"id": str(db_courier.id),
+            "name": db_courier.name,
+            "avg_order_complete_time": db_courier.avg_order_complete_time,
+            "avg_day_orders": db_courier.avg_day_orders,
+            "active_order": schema_order}
 
 
-def create_order(db: Session, order: schemas.OrderIn) -> schemas.OrderCreated:
-    district = get_district(db, order.district)
-    try:
-        couriers = district.district_couriers
-    except Exception:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No suitable courier found')
-    list_couriers: list[models.Courier] = []
+def get_courier(db: Session, id: str) -> schemas.Courier | None:
+    courier = cache.get_or_load(courier_key(id), lambda: load_courier(db, id))
+    if courier is None:
+        return None
 
-    for courier in couriers:
-        if get_active_order_by_courier(db, courier) is None:
-            list_couriers.append(courier)
+    return schemas.Courier(**courier)
 
-    if not list_couriers:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No suitable courier found')
 
-    # courier = min(list_couriers, key=lambda x: x.avg_day_orders)  # выбираем курьера, который выполняет больше заказов за день
-    courier = min(list_couriers, key=lambda x: x.avg_order_complete_time)  # выбираем курьера, который выполняет заказы быстрее
+def create_order(db: Session, order: schemas.OrderIn) -> schemas.OrderCreated:
+    index = get_dispatch_index(db)
+    district_id = get_district_id(db, order.district)
+    if district_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No suitable courier found')
 
+    # выбираем свободного курьера района по стратегии района (по умолчанию - самого быстрого)
+    strategy = strategy_selector.for_district(order.district)
     order_id = uuid.uuid4()
-    db_order = models.Order(id=order_id, name=order.name, district_id=district.id, courier_id=courier.id,
-                            status=Status.IN_PROGRESS)
-    db.add(db_order)
-    db.commit()
-
-    order_created = schemas.OrderCreated(order_id=order_id, courier_id=courier.id)
+    while True:
+        if index is None:
+            courier_id = lock_idle_courier(db, district_id, order.latitude, order.longitude, strategy)
+        else:
+            courier_id = pick_courier(index, district_id, strategy, order.latitude, order.longitude)
+        rechecked = False
+        if courier_id is None and ORDER_QUEUE_ENABLED:
+            # под блокировкой очереди района проверяем еще раз: курьер мог освободиться после первой проверки
+            # и не увидеть в очереди этот заказ; в режиме index состояние берется из БД, индекс обновится позже
+            lock_district_queues(db, [district_id])
+            courier_id = lock_idle_courier(db, district_id, order.latitude, order.longitude, strategy)
+            rechecked = courier_id is not None
+        if courier_id is None:
+            if not ORDER_QUEUE_ENABLED:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No suitable courier found')
+            # свободных курьеров нет - заказ ждет в очереди района, его получит первый освободившийся курьер
+            db.add(models.Order(id=order_id, name=order.name, district_id=district_id, status=Status.PENDING,
+                                latitude=order.latitude, longitude=order.longitude))
+            publish_on_commit(db, "order_pending", order_id, status=Status.PENDING)
+            db.commit()
+            return schemas.OrderCreated(order_id=order_id, courier_id=None, status=Status.PENDING)
+
+        db_order = models.Order(id=order_id, name=order.name, district_id=district_id, courier_id=courier_id,
+                                status=Status.IN_PROGRESS, date_assignment=func.now(),
+                                latitude=order.latitude, longitude=order.longitude)
+        db.add(db_order)
+        invalidate_on_commit(db, courier_key(courier_id))
+        publish_on_commit(db, "order_assigned", order_id, courier_id, Status.IN_PROGRESS)
+        try:
+            db.commit()
+            if index is not None:
+                if rechecked:
+                    index.discard(courier_id)
+                undo_on_rollback(db, partial(index.release, courier_id))
+            break
+        except IntegrityError as e:
+            db.rollback()
+            if ACTIVE_ORDER_INDEX not in str(e.orig):
+                if index is not None:
+                    index.release(courier_id)
+                raise
+            # курьер уже получил заказ в другой транзакции (устаревший индекс или снимок запроса) - берем следующего
+        except Exception:
+            db.rollback()
+            if index is not None:
+                index.release(courier_id)  # заказ не сохранен - курьер остается свободным
+            raise
+
+    order_created = schemas.OrderCreated(order_id=order_id, courier_id=courier_id)
 
     return order_created
 
 
+def create_orders(db: Session, orders: list[schemas.OrderIn]) -> list[schemas.OrderBatchResult]:
+    index = get_dispatch_index(db)
+    district_ids = get_district_ids(db, (order.district for order in orders))
+    results = [schemas.OrderBatchResult(index=i) for i in range(len(orders))]
+    positions = [i for i, order in enumerate(orders) if order.district.lower() in district_ids]
+    targets = [district_ids[orders[i].district.lower()] for i in positions]
+    for i in set(range(len(orders))) - set(positions):
+        results[i].reason = 'District not found'
+
+    for attempt in range(2):
+        # курьеры подбираются сразу на весь пакет с минимальным суммарным временем выполнения
+        couriers = lock_idle_couriers(db, targets) if index is None else index.pop_batch(targets)
+        assigned, pending = [], []
+        for i, district_id, courier_id in zip(positions, targets, couriers):
+            row = {"id": uuid.uuid4(), "name": orders[i].name, "district_id": district_id,
+                   "latitude": orders[i].latitude, "longitude": orders[i].longitude}
+            if courier_id is not None:
+                assigned.append(row | {"courier_id": courier_id, "status": Status.IN_PROGRESS})
+            elif ORDER_QUEUE_ENABLED:
+                pending.append(row | {"courier_id": None, "status": Status.PENDING})
+            results[i].order_id = row["id"] if courier_id is not None or ORDER_QUEUE_ENABLED else None
+            results[i].courier_id = courier_id
+
+        woken = {}
+        try:
+            if assigned:
+                db.execute(insert(models.Order).values(date_assignment=func.now()), assigned)
+            if pending:
+                db.execute(insert(models.Order), pending)
+                woken = assign_queued_orders(db, pending)
+            invalidate_on_commit(db, *(courier_key(row["courier_id"]) for row in assigned))
+            for row in assigned:
+                publish_on_commit(db, "order_assigned", row["id"], row["courier_id"], Status.IN_PROGRESS)
+            for row in pending:
+                if row["id"] not in woken:
+                    publish_on_commit(db, "order_pending", row["id"], status=Status.PENDING)
+            db.commit()
+            break
+        except Exception as e:
+            db.rollback()
+            if index is not None:
+                for courier_id in couriers:
+                    if courier_id is not None:
+                        index.release(courier_id)
+            if attempt or not (isinstance(e, IntegrityError) and ACTIVE_ORDER_INDEX in str(e.orig)):
+                raise
+            # кто-то из курьеров уже получил заказ в другой транзакции - перечитываем индекс и подбираем заново
+            if index is not None:
+                load_dispatch_index(db)
+
+    for i in positions:
+        if results[i].order_id in woken:
+            results[i].courier_id = woken[results[i].order_id]
+            if index is not None:
+                index.discard(results[i].courier_id)
+        if results[i].courier_id is not None:
+            results[i].status = Status.IN_PROGRESS
+        elif ORDER_QUEUE_ENABLED:
+            results[i].status = Status.PENDING
+        else:
+            results[i].reason = 'No suitable courier found'
+    return results
+
+
 def get_order(db: Session, order_id: uuid.UUID):
     try:
         db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
@@ -128,44 +434,280 @@ def get_order(db: Session, order_id: uuid.UUID):
     return db_order
 
 
-def complete_order(db: Session, order_id: uuid.UUID):
-    db_order = get_order(db, order_id)
-    if db_order is None:
+def load_order_info(db: Session, order_id: uuid.UUID) -> dict | None:
+    # для ответа нужны только курьер и статус - читаем два столбца вместо всей строки заказа
+    row = db.execute(select(models.Order.courier_id, models.Order.status).where(models.Order.id == order_id)).first()
+    if row is None:  # старые завершенные заказы перенесены в архив
+        row = db.execute(select(models.OrderArchive.courier_id, models.OrderArchive.status)
+                         .where(models.OrderArchive.id == order_id)).first()
+    if row is None:
         return None
 
-    if db_order.status == Status.COMPLETED:
-        return None
+    return {"courier_id": str(row.courier_id) if row.courier_id else None, "status": row.status}
 
-    db_order.status = Status.COMPLETED
-    db_order.date_completion = datetime.datetime.now()
-    db.commit()
 
-    db_courier = db.query(models.Courier).filter(models.Courier.id == db_order.courier_id).first()
-    courier_orders = db_courier.orders
+def get_order_info(db: Session, order_id: uuid.UUID) -> schemas.OrderInfo | None:
+    order = cache.get_or_load(order_key(order_id), lambda: load_order_info(db, order_id))
+    if order is None:
+        return None
 
-    list_completed_orders: list[models.Order] = []
-    avg_order_complete_time = 0
-    count_orders = {}
+    return schemas.OrderInfo(**order)
+
+
+def lock_district_queues(db: Session, district_ids) -> None:
+    """
+    Блокирует очереди районов до конца транзакции. Заказ ставится в очередь, а освободившийся курьер
+    выбирает заказ из очереди только под этой блокировкой, поэтому они не могут разминуться:
+    либо курьер увидит новый заказ, либо заказ - свободного курьера.
+    """
+    # ключи берутся в одном порядке во всех транзакциях, чтобы не было взаимных блокировок
+    keys = sorted({district_id.int >> 65 for district_id in district_ids})
+    if keys:
+        db.execute(text("SELECT pg_advisory_xact_lock(key) FROM unnest(CAST(:keys AS bigint[])) AS key"),
+                   {"keys": keys})
+
+
+def assign_queued_orders(db: Session, rows: list[dict]) -> dict[uuid.UUID, uuid.UUID]:
+    # только что добавленные в очередь заказы отдаются курьерам, освободившимся после подбора пакета
+    lock_district_queues(db, (row["district_id"] for row in rows))
+    couriers = lock_idle_couriers(db, [row["district_id"] for row in rows])
+    woken = {row["id"]: courier_id for row, courier_id in zip(rows, couriers) if courier_id is not None}
+    if woken:
+        woken_orders = values(column("id", UUID), column("courier_id", UUID), name="woken_orders").data(
+            list(woken.items()))
+        db.execute(update(models.Order)
+                   .where(models.Order.id == woken_orders.c.id)
+                   .values(courier_id=woken_orders.c.courier_id, status=Status.IN_PROGRESS,
+                           date_assignment=func.now()))
+        invalidate_on_commit(db, *(courier_key(courier_id) for courier_id in woken.values()))
+        for order_id, courier_id in woken.items():
+            publish_on_commit(db, "order_assigned", order_id, courier_id, Status.IN_PROGRESS)
+    return woken
+
+
+def assign_pending_order(db: Session, courier_id: uuid.UUID) -> uuid.UUID | None:
+    # самый старый заказ из очередей районов курьера; параллельные транзакции пропускают уже выбранные заказы
+    pending_order = (select(models.Order)
+                     .join(models.CourierDistrict, models.CourierDistrict.district_id == models.Order.district_id)
+                     .where(models.CourierDistrict.courier_id == courier_id, models.Order.status == Status.PENDING)
+                     .order_by(models.Order.date_publication, models.Order.id)
+                     .limit(1)
+                     .with_for_update(of=models.Order, skip_locked=True))
+    db_order = db.execute(pending_order).scalar()
+    if db_order is None:
+        return None
 
-    for order in courier_orders:
-        if order.status == Status.COMPLETED:
-            list_completed_orders.append(order)
-            time = order.date_completion - order.date_publication
-            avg_order_complete_time += time.seconds
+    db_order.courier_id = courier_id
+    db_order.status = Status.IN_PROGRESS
+    db_order.date_assignment = func.now()
+    db.flush()
+    invalidate_on_commit(db, order_key(db_order.id), courier_key(courier_id))
+    publish_on_commit(db, "order_assigned", db_order.id, courier_id, Status.IN_PROGRESS)
+    return db_order.id
+
+
+def get_pending_orders(db: Session) -> list[schemas.PendingOrders]:
+    query = (db.query(models.District.name,
+                      func.count(models.Order.id),
+                      func.extract("epoch", func.now() - func.min(models.Order.date_publication)))
+             .join(models.Order, models.Order.district_id == models.District.id)
+             .filter(models.Order.status == Status.PENDING)
+             .group_by(models.District.name)
+             .order_by(models.District.name))
+    return [schemas.PendingOrders(district=name, pending_orders=count, max_wait_time=max(wait_time, 0))
+            for name, count, wait_time in query]
+
+
+def upsert_daily_stats(model, key_column: str, rows: list[dict]):
+    # строку за день создает первый завершенный заказ, следующие увеличивают счетчики;
+    # ключ (key_column, day) должен встречаться в `rows` один раз
+    stmt = insert(model).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[key_column, "day"],
+        set_={"orders_count": model.orders_count + stmt.excluded.orders_count,
+              "total_seconds": model.total_seconds + stmt.excluded.total_seconds,
+              "min_seconds": func.least(model.min_seconds, stmt.excluded.min_seconds),
+              "max_seconds": func.greatest(model.max_seconds, stmt.excluded.max_seconds)},
+    )
+
+
+def aggregate_daily_stats(completed, key) -> dict[tuple, dict]:
+    # завершенные заказы -> строки дневной статистики по (ключ, день публикации)
+    days = {}
+    for row in completed:
+        day_key = (key(row), row.date_publication.date())
+        stats = days.get(day_key)
+        if stats is None:
+            days[day_key] = {"orders_count": 1, "total_seconds": row.seconds,
+                             "min_seconds": row.seconds, "max_seconds": row.seconds}
+        else:
+            stats["orders_count"] += 1
+            stats["total_seconds"] += row.seconds
+            stats["min_seconds"] = min(stats["min_seconds"], row.seconds)
+            stats["max_seconds"] = max(stats["max_seconds"], row.seconds)
+    return days
+
+
+def complete_orders(db: Session, order_ids: list[uuid.UUID]) -> list[schemas.OrderCompleteResult]:
+    """
+    Завершает заказы в работе одной транзакцией: статусы меняются одним UPDATE ... RETURNING,
+    дневная статистика и средние показатели курьеров обновляются одним запросом на таблицу.
+    Возвращает результат для каждого id в порядке запроса.
+    """
+    index = get_dispatch_index(db)
+    date_completion = datetime.datetime.now()
+    # параллельное завершение того же заказа ждет блокировки строки и затем не проходит условие по статусу
+    completed = db.execute(
+        update(models.Order)
+        .where(models.Order.id.in_(set(order_ids)), models.Order.status == Status.IN_PROGRESS)
+        .values(status=Status.COMPLETED, date_completion=date_completion)
+        .returning(models.Order.id, models.Order.courier_id, models.Order.district_id,
+                   models.Order.date_publication,
+                   # время выполнения считается с момента назначения курьера (заказ мог ждать в очереди)
+                   func.extract("epoch", date_completion - func.coalesce(models.Order.date_assignment,
+                                                                         models.Order.date_publication))
+                   .cast(Float).label("seconds"))
+    ).all()
+
+    courier_ids, busy = [], set()
+    if completed:
+        for row in completed:
+            invalidate_on_commit(db, order_key(row.id), courier_key(row.courier_id))
+            publish_on_commit(db, "order_completed", row.id, row.courier_id, Status.COMPLETED)
+
+        couriers_days = aggregate_daily_stats(completed, lambda row: row.courier_id)
+        day_orders = db.execute(upsert_daily_stats(
+            models.CourierDailyStats, "courier_id",
+            # строки отсортированы: параллельные пакеты блокируют общие строки в одном порядке
+            [{"courier_id": courier_id, "day": day, **stats}
+             for (courier_id, day), stats in sorted(couriers_days.items())],
+        ).returning(models.CourierDailyStats.courier_id, models.CourierDailyStats.day,
+                    models.CourierDailyStats.orders_count))
+        # день новый для курьера, если до этого пакета в нем не было завершенных заказов
+        new_work_days = {}
+        for courier_id, day, orders_count in day_orders:
+            new = orders_count == couriers_days[courier_id, day]["orders_count"]
+            new_work_days[courier_id] = new_work_days.get(courier_id, 0) + new
+        districts_days = aggregate_daily_stats(completed, lambda row: row.district_id)
+        db.execute(upsert_daily_stats(
+            models.DistrictDailyStats, "district_id",
+            [{"district_id": district_id, "day": day, **stats}
+             for (district_id, day), stats in sorted(districts_days.items())],
+        ))
+
+        totals = {}
+        for row in completed:
+            orders, seconds = totals.get(row.courier_id, (0, 0.0))
+            totals[row.courier_id] = (orders + 1, seconds + row.seconds)
+        courier_totals = values(column("id", UUID), column("orders", Integer), column("seconds", Float),
+                                column("new_days", Integer), name="courier_totals").data(
+            [(courier_id, orders, seconds, new_work_days[courier_id])
+             for courier_id, (orders, seconds) in sorted(totals.items())])
+        # в SET используются значения до обновления, поэтому средние считаются по новым суммам
+        completed_orders = models.Courier.completed_orders + courier_totals.c.orders
+        total_complete_time = models.Courier.total_complete_time + courier_totals.c.seconds
+        work_days = models.Courier.work_days + courier_totals.c.new_days
+        averages = {courier_id: (avg_time, day_orders) for courier_id, avg_time, day_orders in db.execute(
+            update(models.Courier)
+            .where(models.Courier.id == courier_totals.c.id)
+            .values(completed_orders=completed_orders,
+                    total_complete_time=total_complete_time,
+                    work_days=work_days,
+                    avg_order_complete_time=total_complete_time / completed_orders,
+                    avg_day_orders=completed_orders // work_days)
+            .returning(models.Courier.id, models.Courier.avg_order_complete_time, models.Courier.avg_day_orders)
+        )}
+
+        courier_ids = list(totals)
+        if ORDER_QUEUE_ENABLED:
+            lock_district_queues(db, db.execute(select(models.CourierDistrict.district_id)
+                                                .where(models.CourierDistrict.courier_id.in_(courier_ids)))
+                                 .scalars())
+            busy = {courier_id for courier_id in courier_ids if assign_pending_order(db, courier_id) is not None}
 
-    for order in list_completed_orders:
-        order_publication_date = order.date_publication.date()
-        if order_publication_date in count_orders:
-            count_orders[order_publication_date] += 1
+    db.commit()
+    if index is not None:
+        for courier_id in courier_ids:
+            # у курьера один заказ в работе, поэтому сумма в totals - время этого заказа;
+            # курьер, получивший заказ из очереди, остается занятым, но с новыми показателями
+            avg_time, day_orders = averages[courier_id]
+            index.release(courier_id, avg_time, day_orders, completion_seconds=totals[courier_id][1])
+            if courier_id in busy:
+                index.discard(courier_id)
+
+    done = {row.id for row in completed}
+    statuses = {}
+    if len(done) < len(set(order_ids)):
+        # причины отказа читаются отдельным запросом только для незавершенных id
+        rest = set(order_ids) - done
+        statuses = dict(db.execute(
+            select(models.Order.id, models.Order.status).where(models.Order.id.in_(rest))
+            .union_all(select(models.OrderArchive.id, models.OrderArchive.status)
+                       .where(models.OrderArchive.id.in_(rest)))).all())
+    results = []
+    for order_id in order_ids:
+        if order_id in done:
+            results.append(schemas.OrderCompleteResult(order_id=order_id, completed=True))
+        elif order_id not in statuses:
+            results.append(schemas.OrderCompleteResult(order_id=order_id, reason="Order does not exist"))
+        elif statuses[order_id] == Status.PENDING:
+            results.append(schemas.OrderCompleteResult(order_id=order_id, reason="Order has no courier yet"))
         else:
-            count_orders[order_publication_date] = 1
+            results.append(schemas.OrderCompleteResult(order_id=order_id, reason="Order has already been completed"))
+    return results
 
-    avg_order_complete_time = avg_order_complete_time / len(list_completed_orders)
-    avg_day_orders = floor(sum(count_orders.values()) / len(count_orders))
 
-    db_courier.avg_order_complete_time = avg_order_complete_time
-    db_courier.avg_day_orders = avg_day_orders
+def complete_order(db: Session, order_id: uuid.UUID):
+    return True if complete_orders(db, [order_id])[0].completed else None
+
+
+def get_daily_stats(db: Session, model, key_column, key, date_from: datetime.date | None,
+                    date_to: datetime.date | None) -> schemas.StatsReport:
+    # отчеты читают только таблицы дневной статистики, таблица заказов не затрагивается
+    query = select(model).where(key_column == key)
+    if date_from is not None:
+        query = query.where(model.day >= date_from)
+    if date_to is not None:
+        query = query.where(model.day <= date_to)
+    return stats_report(db.execute(query.order_by(model.day)).scalars(), date_from, date_to)
+
+
+def stats_report(rows, date_from: datetime.date | None, date_to: datetime.date | None) -> schemas.StatsReport:
+    # rows - строки дневной статистики по возрастанию day (модели БД или записи MemoryRepository)
+    days = [schemas.DailyStats(day=row.day,
+                               orders_count=row.orders_count,
+                               total_complete_time=row.total_seconds or 0,
+                               avg_complete_time=(row.total_seconds or 0) / row.orders_count if row.orders_count else None,
+                               min_complete_time=row.min_seconds,
+                               max_complete_time=row.max_seconds)
+            for row in rows]
+
+    orders_count = sum(d.orders_count for d in days)
+    mins = [d.min_complete_time for d in days if d.min_complete_time is not None]
+    maxs = [d.max_complete_time for d in days if d.max_complete_time is not None]
+    return schemas.StatsReport(date_from=date_from, date_to=date_to,
+                               orders_count=orders_count,
+                               work_days=len(days),
+                               avg_complete_time=sum(d.total_complete_time for d in days) / orders_count
+                               if orders_count else None,
+                               min_complete_time=min(mins, default=None),
+                               max_complete_time=max(maxs, default=None),
+                               avg_day_orders=orders_count / len(days) if days else None,
+                               days=days)
+
+
+def get_courier_stats(db: Session, courier_id: uuid.UUID, date_from: datetime.date | None = None,
+                      date_to: datetime.date | None = None) -> schemas.StatsReport | None:
+    if db.get(models.Courier, courier_id) is None:
+        return None
+    return get_daily_stats(db, models.CourierDailyStats, models.CourierDailyStats.courier_id, courier_id,
+                           date_from, date_to)
 
-    db.commit()
 
-    return True
+def get_district_stats(db: Session, district_name: str, date_from: datetime.date | None = None,
+                       date_to: datetime.date | None = None) -> schemas.StatsReport | None:
+    district_id = get_district_id(db, district_name)
+    if district_id is None:
+        return None
+    return get_daily_stats(db, models.DistrictDailyStats, models.DistrictDailyStats.district_id, district_id,
+                           date_from, date_to)
@@ -0,0 +1,82 @@
+import datetime
+import uuid
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, schemas
+
+# Асинхронные версии функций crud. Логика выполняется через AsyncSession.run_sync:
+# тот же код, что и в синхронном режиме, но запросы идут через asyncpg без пула потоков.
+
+
+async def load_dispatch_index(db: AsyncSession) -> None:
+    await db.run_sync(crud.load_dispatch_index)
+
+
+async def load_district_registry(db: AsyncSession) -> None:
+    await db.run_sync(crud.load_district_registry)
+
+
+async def create_courier(db: AsyncSession, courier: schemas.CourierIn):
+    return await db.run_sync(crud.create_courier, courier)
+
+
+async def create_couriers(db: AsyncSession, couriers: list[schemas.CourierIn]) -> list[schemas.CourierBase]:
+    return await db.run_sync(crud.create_couriers, couriers)
+
+
+async def get_couriers(db: AsyncSession, filters: schemas.CourierFilters = schemas.CourierFilters(),
+                       after: uuid.UUID | None = None, limit: int | None = None):
+    return await db.run_sync(crud.get_couriers, filters, after, limit)
+
+
+async def stream_couriers(db: AsyncSession, filters: schemas.CourierFilters):
+    # генератор живет дольше run_sync, поэтому строки читаются напрямую серверным курсором asyncpg
+    try:
+        result = await db.stream(crud.select_couriers(filters).execution_options(yield_per=1000))
+        async for courier_id, name in result:
+            yield crud.courier_ndjson(courier_id, name)
+    finally:
+        await db.close()
+
+
+async def get_courier(db: AsyncSession, id: str):
+    return await db.run_sync(crud.get_courier, id)
+
+
+async def create_order(db: AsyncSession, order: schemas.OrderIn) -> schemas.OrderCreated:
+    return await db.run_sync(crud.create_order, order)
+
+
+async def create_orders(db: AsyncSession, orders: list[schemas.OrderIn]) -> list[schemas.OrderBatchResult]:
+    return await db.run_sync(crud.create_orders, orders)
+
+
+async def get_order(db: AsyncSession, order_id: uuid.UUID):
+    return await db.run_sync(crud.get_order, order_id)
+
+
+async def get_order_info(db: AsyncSession, order_id: uuid.UUID) -> schemas.OrderInfo | None:
+    return await db.run_sync(crud.get_order_info, order_id)
+
+
+async def complete_order(db: AsyncSession, order_id: uuid.UUID):
+    return await db.run_sync(crud.complete_order, order_id)
+
+
+async def complete_orders(db: AsyncSession, order_ids: list[uuid.UUID]) -> list[schemas.OrderCompleteResult]:
+    return await db.run_sync(crud.complete_orders, order_ids)
+
+
+async def get_pending_orders(db: AsyncSession) -> list[schemas.PendingOrders]:
+    return await db.run_sync(crud.get_pending_orders)
+
+
+async def get_courier_stats(db: AsyncSession, courier_id: uuid.UUID, date_from: datetime.date | None = None,
+                            date_to: datetime.date | None = None) -> schemas.StatsReport | None:
+    return await db.run_sync(crud.get_courier_stats, courier_id, date_from, date_to)
+
+
+async def get_district_stats(db: AsyncSession, district_name: str, date_from: datetime.date | None = None,
+                             date_to: datetime.date | None = None) -> schemas.StatsReport | None:
+    return await db.run_sync(crud.get_district_stats, district_name, date_from, date_to)
@@ -1,32 +1,199 @@
-from sqlalchemy import create_engine
+import threading
+import time
+
+from sqlalchemy import create_engine, event, Engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.pool import NullPool, QueuePool, AsyncAdaptedQueuePool
 from .config import DB_HOST, DB_PORT, DB_USER, DB_NAME, DB_PASS
 from .config import DB_HOST_TEST, DB_PORT_TEST, DB_USER_TEST, DB_NAME_TEST, DB_PASS_TEST
+from .config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+from .config import DB_STATEMENT_TIMEOUT, DB_POOL_WARM
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 SQLALCHEMY_DATABASE_URL_TEST = f"postgresql://{DB_USER_TEST}:{DB_PASS_TEST}@{DB_HOST_TEST}:{DB_PORT_TEST}/{DB_NAME_TEST}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+SQLALCHEMY_ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+SQLALCHEMY_ASYNC_DATABASE_URL_TEST = f"postgresql+asyncpg://{DB_USER_TEST}:{DB_PASS_TEST}@{DB_HOST_TEST}:{DB_PORT_TEST}/{DB_NAME_TEST}"
+
+
+class TimedPoolMixin:
+    """Учитывает, сколько запросы ждут свободного соединения из пула."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            wait_time = time.perf_counter() - start
+            with self._stats_lock:
+                self.wait_count += 1
+                self.wait_time += wait_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+POOL_OPTIONS = dict(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+                    pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=DB_POOL_PRE_PING)
+
+# один движок и одна фабрика сессий на процесс для каждого режима ('dev', 'test')
+engines: dict[str, Engine] = {}
+session_factories: dict[str, sessionmaker] = {}
+async_engines: dict[str, AsyncEngine] = {}
+async_session_factories: dict[str, async_sessionmaker] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(mode: str = 'dev') -> Engine:
+    # движок создается при первом обращении: при STORAGE_BACKEND=memory настройки БД не нужны
+    if mode not in engines:
+        with _engines_lock:
+            if mode not in engines:
+                url = SQLALCHEMY_DATABASE_URL if mode == 'dev' else SQLALCHEMY_DATABASE_URL_TEST
+                connect_args = {}
+                if DB_STATEMENT_TIMEOUT:
+                    connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"
+                engines[mode] = create_engine(url, poolclass=TimedQueuePool, connect_args=connect_args,
+                                              **POOL_OPTIONS)
+    return engines[mode]
 
 
 def get_session(mode: str = 'dev') -> Session:
-    if mode == 'dev':
-        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    else:
-        engine_test = create_engine(SQLALCHEMY_DATABASE_URL_TEST)
-        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine_test)
+    if mode not in session_factories:
+        session_factories[mode] = sessionmaker(autocommit=False, autoflush=False, bind=get_engine(mode))
+    return session_factories[mode]()
+
+
+# Сессия с этим ключом в info работает внутри чужой транзакции: ее коммиты - точки сохранения (SAVEPOINT).
+# Обработчики after_commit (кэш, события, реестр районов) в такой сессии ничего не делают, а накопленное
+# передается внешней сессии через adopt_deferred и выполняется после ее коммита.
+DEFERRED_COMMIT = "deferred_commit"
+
+
+def savepoint_session(db: Session) -> Session:
+    """Сессия на соединении и в транзакции `db`: ее commit и rollback затрагивают только SAVEPOINT."""
+    return Session(bind=db.connection(), autoflush=False, join_transaction_mode="create_savepoint",
+                   info={DEFERRED_COMMIT: True})
+
+
+def undo_on_rollback(db: Session, action) -> None:
+    # изменения состояния процесса после коммита точки сохранения отменяются, если внешняя транзакция откатится
+    if db.info.get(DEFERRED_COMMIT):
+        db.info.setdefault("rollback_actions", []).append(action)
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_undo_after_commit(session: Session) -> None:
+    if not session.info.get(DEFERRED_COMMIT):
+        session.info.pop("rollback_actions", None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _undo_after_rollback(session: Session) -> None:
+    # откат точки сохранения не отменяет уже зафиксированные в ней изменения
+    if not session.info.get(DEFERRED_COMMIT):
+        for action in session.info.pop("rollback_actions", ()):
+            action()
+
+
+def adopt_deferred(inner: Session, outer: Session) -> None:
+    # списки событий, множества ключей кэша и словари районов объединяются с уже накопленными во внешней сессии
+    for key, value in inner.info.items():
+        if key == DEFERRED_COMMIT:
+            continue
+        if key not in outer.info:
+            outer.info[key] = value
+        elif isinstance(value, list):
+            outer.info[key].extend(value)
+        else:
+            outer.info[key].update(value)
+    inner.info.clear()
+    inner.info[DEFERRED_COMMIT] = True
+
+
+def get_async_engine(mode: str = 'dev') -> AsyncEngine:
+    # движок создается при первом обращении, чтобы синхронный режим не требовал asyncpg
+    if mode not in async_engines:
+        with _engines_lock:
+            if mode not in async_engines:
+                connect_args = {}
+                if DB_STATEMENT_TIMEOUT:
+                    connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT)}
+                if mode == 'dev':
+                    async_engines[mode] = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL,
+                                                              poolclass=TimedAsyncAdaptedQueuePool,
+                                                              connect_args=connect_args, **POOL_OPTIONS)
+                else:
+                    # соединения asyncpg привязаны к event loop, а тестовый клиент может менять loop между запросами
+                    async_engines[mode] = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL_TEST, poolclass=NullPool,
+                                                              connect_args=connect_args)
+    return async_engines[mode]
+
+
+def get_async_session(mode: str = 'dev') -> AsyncSession:
+    if mode not in async_session_factories:
+        async_session_factories[mode] = async_sessionmaker(autoflush=False, bind=get_async_engine(mode))
+    return async_session_factories[mode]()
+
+
+def warm_pool(size: int = DB_POOL_WARM, mode: str = 'dev') -> None:
+    # соединения открываются при старте воркера, а не на первых запросах; больше размера пула не удержать
+    connections = [get_engine(mode).connect() for _ in range(min(size, DB_POOL_SIZE))]
+    for connection in connections:
+        connection.close()
+
+
+async def warm_async_pool(size: int = DB_POOL_WARM, mode: str = 'dev') -> None:
+    connections = [await get_async_engine(mode).connect() for _ in range(min(size, DB_POOL_SIZE))]
+    for connection in connections:
+        await connection.close()
+
 
-    return SessionLocal()
+def pool_status() -> dict:
+    status = {}
+    for kind, mode_engines in (("sync", engines), ("async", async_engines)):
+        for mode, mode_engine in list(mode_engines.items()):
+            pool = mode_engine.pool
+            info = {"pool": type(pool).__name__}
+            if isinstance(pool, QueuePool):
+                info.update(size=pool.size(), checked_out=pool.checkedout(), idle=pool.checkedin(),
+                            overflow=max(pool.overflow(), 0), max_overflow=pool._max_overflow)
+            if isinstance(pool, TimedPoolMixin):
+                info.update(wait_count=pool.wait_count,
+                            wait_time_total=round(pool.wait_time, 6),
+                            wait_time_avg=round(pool.wait_time / pool.wait_count, 6) if pool.wait_count else 0.0,
+                            wait_time_max=round(pool.max_wait_time, 6),
+                            timeouts=pool.timeouts)
+            status[f"{kind}:{mode}"] = info
+    return status
 
 
 Base = declarative_base()
 
 
 def drop_test_table() -> None:
-    engine_test = create_engine(SQLALCHEMY_DATABASE_URL_TEST)
-    Base.metadata.drop_all(bind=engine_test)
+    Base.metadata.drop_all(bind=get_engine('test'))
 
 
 def create_test_table() -> None:
-    engine_test = create_engine(SQLALCHEMY_DATABASE_URL_TEST)
-    Base.metadata.create_all(bind=engine_test)
+    Base.metadata.create_all(bind=get_engine('test'))
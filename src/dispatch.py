@@ -0,0 +1,308 @@
+import datetime
+import heapq
+import itertools
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from .config import COURIER_SPEED_KMH, DISPATCH_EWMA_ALPHA, GEO_MAX_RADIUS_KM
+from .geo import GridIndex, courier_grid, distance_km
+from .matching import assign
+from .strategies import Candidates, DispatchStrategy
+
+DIRECT_SCAN = 64  # до стольких свободных курьеров района pop_nearest оценивает их без обхода сетки
+
+
+class DispatchIndex:
+    """
+    Индекс свободных курьеров по районам.
+
+    Для каждого района хранится куча (avg_order_complete_time, seq, courier_id).
+    Занятые курьеры удаляются из кучи лениво: запись считается актуальной,
+    только если её (metric, seq) совпадает с текущей меткой курьера в `_idle`.
+
+    Для остальных стратегий признаки курьеров хранятся в массивах NumPy (позиция курьера - `_slots`),
+    а кандидаты района оцениваются одной векторной операцией.
+    """
+
+    def __init__(self, clock=time.monotonic, today=datetime.date.today):
+        # часы задаются снаружи, чтобы симулятор (benchmarks.simulate) вел индекс в модельном времени
+        self._clock = clock
+        self._today = today
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._loaded = False
+        self._heaps: dict[uuid.UUID, list] = {}
+        self._idle: dict[uuid.UUID, tuple] = {}
+        self._metrics: dict[uuid.UUID, int] = {}
+        self._districts: dict[uuid.UUID, tuple[uuid.UUID, ...]] = {}
+        self._stale = 0
+        self._reset_features()
+
+    def _reset_features(self) -> None:
+        self._slots: dict[uuid.UUID, int] = {}
+        self._courier_ids: list[uuid.UUID] = []
+        self._features = {name: np.zeros(0) for name in Candidates._fields}
+        self._idle_mask = np.zeros(0, dtype=bool)
+        self._members: dict[uuid.UUID, list[int]] = {}  # позиции курьеров района
+        self._member_arrays: dict[uuid.UUID, np.ndarray] = {}
+        self._day = self._today()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self, couriers, busy_courier_ids, avg_day_orders: dict | None = None,
+             orders_today: dict | None = None) -> None:
+        """
+        `couriers` - итерируемый набор (courier_id, metric, district_ids);
+        `avg_day_orders` и `orders_today` - признаки для стратегий (courier_id -> значение).
+        """
+        busy = set(busy_courier_ids)
+        avg_day_orders = avg_day_orders or {}
+        orders_today = orders_today or {}
+        with self._lock:
+            self._heaps = {}
+            self._idle = {}
+            self._metrics = {}
+            self._districts = {}
+            self._stale = 0
+            self._reset_features()
+            for courier_id, metric, district_ids in couriers:
+                self._set_courier(courier_id, metric, district_ids)
+                slot = self._slots[courier_id]
+                self._features["avg_day_orders"][slot] = avg_day_orders.get(courier_id) or 0
+                self._features["orders_today"][slot] = orders_today.get(courier_id, 0)
+                if courier_id not in busy:
+                    self._push(courier_id)
+            self._loaded = True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._heaps = {}
+            self._idle = {}
+            self._metrics = {}
+            self._districts = {}
+            self._stale = 0
+            self._reset_features()
+            self._loaded = False
+
+    def add_courier(self, courier_id: uuid.UUID, metric: int | None, district_ids, idle: bool = True) -> None:
+        with self._lock:
+            if courier_id in self._idle:
+                self._drop(courier_id)
+            self._set_courier(courier_id, metric, district_ids)
+            if idle:
+                self._push(courier_id)
+
+    def pop(self, district_id: uuid.UUID) -> uuid.UUID | None:
+        """Забирает самого быстрого свободного курьера района, помечая его занятым."""
+        with self._lock:
+            return self._pop(district_id)
+
+    def pop_scored(self, district_id: uuid.UUID, strategy: DispatchStrategy) -> uuid.UUID | None:
+        """Забирает свободного курьера района с минимальной оценкой `strategy`, помечая его занятым."""
+        with self._lock:
+            self._roll_day()
+            slots = self._idle_slots(district_id)
+            if not len(slots):
+                return None
+            best = slots[np.argmin(strategy.score(self._candidates(slots)))]
+            courier_id = self._courier_ids[best]
+            self._take(courier_id)
+            return courier_id
+
+    def _idle_slots(self, district_id) -> np.ndarray:
+        slots = self._member_arrays.get(district_id)
+        if slots is None:
+            slots = self._member_arrays[district_id] = np.array(self._members.get(district_id, ()), dtype=np.intp)
+        return slots[self._idle_mask[slots]]
+
+    def _candidates(self, slots: np.ndarray) -> Candidates:
+        features = {name: values[slots] for name, values in self._features.items()}
+        # в массиве хранится момент освобождения, стратегиям передается длительность простоя
+        features["idle_seconds"] = self._clock() - features["idle_seconds"]
+        return Candidates(**features)
+
+    def pop_nearest(self, district_id: uuid.UUID, grid: GridIndex, latitude: float, longitude: float,
+                    max_radius_km: float, score) -> uuid.UUID | None:
+        """
+        Забирает свободного курьера района не дальше `max_radius_km` от заказа с минимальной оценкой
+        `score(distance_km, metric)`; оценка должна расти с расстоянием и метрикой.
+        Если рядом с заказом нет свободных курьеров района, курьер выбирается как в `pop`.
+        """
+        with self._lock:
+            idle = self._idle_slots(district_id)
+            if not len(idle):
+                return None
+            best = None
+            if len(idle) <= DIRECT_SCAN:
+                # свободных курьеров района мало - дешевле оценить их всех, чем обходить кольца со всеми курьерами
+                for slot in idle:
+                    courier_id = self._courier_ids[slot]
+                    position = grid.position(courier_id)
+                    if position is not None:
+                        distance = distance_km(latitude, longitude, *position)
+                        value = score(distance, self._metrics[courier_id])
+                        if distance <= max_radius_km and (best is None or value < best[0]):
+                            best = (value, courier_id)
+            else:
+                for candidates, reach_km in grid.rings(latitude, longitude, max_radius_km):
+                    for courier_id, distance in candidates:
+                        if courier_id in self._idle and district_id in self._districts[courier_id]:
+                            value = score(distance, self._metrics[courier_id])
+                            if best is None or value < best[0]:
+                                best = (value, courier_id)
+                    # курьеры в непройденных кольцах дальше reach_km, их оценка не меньше score(reach_km, 0)
+                    if best is not None and best[0] <= score(reach_km, 0):
+                        break
+            if best is None:
+                return self._pop(district_id)
+            self._take(best[1])  # записи курьера в кучах районов станут неактуальными
+            return best[1]
+
+    def _pop(self, district_id: uuid.UUID) -> uuid.UUID | None:
+        heap = self._heaps.get(district_id)
+        while heap:
+            metric, seq, courier_id = heapq.heappop(heap)
+            if self._idle.get(courier_id) == (metric, seq):
+                self._stale -= 1  # запись этой кучи уже извлечена
+                self._take(courier_id)
+                return courier_id
+            self._stale -= 1
+        return None
+
+    def pop_batch(self, district_ids: list[uuid.UUID]) -> list[uuid.UUID | None]:
+        """
+        Назначает курьеров сразу на несколько заказов (по району заказа) с минимальным суммарным
+        avg_order_complete_time. Выбранные курьеры помечаются занятыми.
+        """
+        with self._lock:
+            # в оптимальном решении в каждом районе участвуют только len(district_ids) самых быстрых курьеров
+            candidates: dict[uuid.UUID, int] = {}
+            for district_id in set(district_ids):
+                valid = (entry for entry in self._heaps.get(district_id, ()) if self._idle.get(entry[2]) == entry[:2])
+                for metric, _, courier_id in heapq.nsmallest(len(district_ids), valid):
+                    candidates[courier_id] = metric
+
+            couriers = list(candidates)
+            costs = [[candidates[c] if d in self._districts[c] else None for c in couriers] for d in district_ids]
+            assigned = [None if col is None else couriers[col] for col in assign(costs)]
+            for courier_id in assigned:
+                if courier_id is not None:
+                    self._take(courier_id)
+            return assigned
+
+    def release(self, courier_id: uuid.UUID, metric: int | None = None, avg_day_orders: int | None = None,
+                completion_seconds: float | None = None) -> None:
+        """
+        Возвращает курьера в число свободных, при необходимости обновляя метрику.
+        `completion_seconds` - время выполнения только что завершенного заказа (для признаков стратегий).
+        """
+        with self._lock:
+            if courier_id not in self._districts:
+                return
+            slot = self._slots[courier_id]
+            if metric is not None:
+                self._metrics[courier_id] = metric
+                self._features["avg_complete_time"][slot] = metric
+            if avg_day_orders is not None:
+                self._features["avg_day_orders"][slot] = avg_day_orders
+            if completion_seconds is not None:
+                self._roll_day()
+                ewma = self._features["ewma_complete_time"]
+                ewma[slot] += DISPATCH_EWMA_ALPHA * (completion_seconds - ewma[slot])
+                self._features["orders_today"][slot] += 1
+            if courier_id in self._idle:
+                self._drop(courier_id)
+            self._push(courier_id)
+
+    def discard(self, courier_id: uuid.UUID) -> None:
+        """Помечает курьера занятым (например, если заказ назначен в обход индекса)."""
+        with self._lock:
+            if courier_id in self._idle:
+                self._take(courier_id)
+
+    def is_idle(self, courier_id: uuid.UUID) -> bool:
+        return courier_id in self._idle
+
+    def has_courier(self, courier_id: uuid.UUID) -> bool:
+        return courier_id in self._districts
+
+    def _set_courier(self, courier_id: uuid.UUID, metric: int | None, district_ids) -> None:
+        metric = metric or 0
+        slot = self._slots.get(courier_id)
+        if slot is None:
+            slot = self._slots[courier_id] = len(self._courier_ids)
+            self._courier_ids.append(courier_id)
+            if slot == len(self._idle_mask):
+                self._grow(max(2 * slot, 1024))
+            self._features["ewma_complete_time"][slot] = metric
+        for district_id in self._districts.get(courier_id, ()):
+            self._members[district_id].remove(slot)
+            self._member_arrays.pop(district_id, None)
+        self._districts[courier_id] = tuple(district_ids)
+        for district_id in self._districts[courier_id]:
+            self._members.setdefault(district_id, []).append(slot)
+            self._member_arrays.pop(district_id, None)
+        self._metrics[courier_id] = metric
+        self._features["avg_complete_time"][slot] = metric
+
+    def _grow(self, capacity: int) -> None:
+        size = len(self._idle_mask)
+        self._features = {name: np.concatenate([values, np.zeros(capacity - size)])
+                          for name, values in self._features.items()}
+        self._idle_mask = np.concatenate([self._idle_mask, np.zeros(capacity - size, dtype=bool)])
+
+    def _roll_day(self) -> None:
+        today = self._today()
+        if today != self._day:
+            self._features["orders_today"][:] = 0
+            self._day = today
+
+    def _push(self, courier_id: uuid.UUID) -> None:
+        token = (self._metrics[courier_id], next(self._seq))
+        self._idle[courier_id] = token
+        slot = self._slots[courier_id]
+        self._idle_mask[slot] = True
+        self._features["idle_seconds"][slot] = self._clock()  # момент освобождения
+        for district_id in self._districts[courier_id]:
+            heapq.heappush(self._heaps.setdefault(district_id, []), (*token, courier_id))
+
+    def _take(self, courier_id: uuid.UUID) -> None:
+        # курьер получил заказ
+        self._drop(courier_id)
+        self._features["assigned_at"][self._slots[courier_id]] = self._clock()
+
+    def _drop(self, courier_id: uuid.UUID) -> None:
+        del self._idle[courier_id]
+        self._idle_mask[self._slots[courier_id]] = False
+        self._stale += len(self._districts[courier_id])
+        if self._stale > 2 * len(self._idle) + 1024:
+            self._compact()
+
+    def _compact(self) -> None:
+        for district_id, heap in self._heaps.items():
+            heap[:] = [entry for entry in heap if self._idle.get(entry[2]) == entry[:2]]
+            heapq.heapify(heap)
+        self._stale = 0
+
+
+def travel_score(distance_km: float, metric: int) -> float:
+    # оценка курьера для заказа с координатами: время в пути до заказа плюс среднее время выполнения, сек.
+    return distance_km / COURIER_SPEED_KMH * 3600 + metric
+
+
+def pick_courier(index: DispatchIndex, district_id, strategy: DispatchStrategy, latitude: float | None = None,
+                 longitude: float | None = None, grid: GridIndex = courier_grid):
+    """Забирает из индекса курьера для заказа: общий выбор для crud.create_order и симулятора."""
+    if latitude is not None:
+        return index.pop_nearest(district_id, grid, latitude, longitude, GEO_MAX_RADIUS_KM, travel_score)
+    if strategy.by_metric:
+        return index.pop(district_id)
+    return index.pop_scored(district_id, strategy)
+
+
+dispatch_index = DispatchIndex()
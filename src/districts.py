@@ -0,0 +1,85 @@
+import sys
+import threading
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .database import DEFERRED_COMMIT
+
+
+def normalize(name: str) -> str:
+    # имена районов хранятся в нижнем регистре; интернирование экономит память на повторяющихся строках
+    return sys.intern(name.lower())
+
+
+class DistrictRegistry:
+    """
+    Районы в памяти процесса: нормализованное имя -> id.
+    Районов немного и они не удаляются, поэтому запись однажды найденного района не устаревает.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._ids: dict[str, uuid.UUID] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self, districts) -> None:
+        """`districts` - итерируемый набор (name, id)."""
+        ids = {normalize(name): district_id for name, district_id in districts}
+        with self._lock:
+            self._ids = ids
+            self._loaded = True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids = {}
+            self._loaded = False
+
+    def get(self, name: str) -> uuid.UUID | None:
+        return self._ids.get(normalize(name))
+
+    def resolve(self, names) -> tuple[dict[str, uuid.UUID], list[str]]:
+        """Возвращает найденные районы (нормализованное имя -> id) и список ненайденных имен без повторов."""
+        found, missing = {}, []
+        for name in {normalize(name) for name in names}:
+            district_id = self._ids.get(name)
+            if district_id is None:
+                missing.append(name)
+            else:
+                found[name] = district_id
+        return found, missing
+
+    def update(self, districts: dict[str, uuid.UUID]) -> None:
+        with self._lock:
+            for name, district_id in districts.items():
+                self._ids[normalize(name)] = district_id
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+def register_on_commit(db: Session, districts: dict[str, uuid.UUID]) -> None:
+    # районы, созданные в транзакции, попадают в реестр только после коммита
+    db.info.setdefault("districts", {}).update(districts)
+
+
+@event.listens_for(Session, "after_commit")
+def _register_after_commit(session: Session) -> None:
+    if session.info.get(DEFERRED_COMMIT):
+        return  # коммит точки сохранения, см. database.DEFERRED_COMMIT
+    districts = session.info.pop("districts", None)
+    if districts:
+        district_registry.update(districts)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session: Session) -> None:
+    session.info.pop("districts", None)
+
+
+district_registry = DistrictRegistry()
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import threading
+from contextlib import asynccontextmanager
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from .config import EVENTS_NOTIFY, EVENTS_QUEUE_SIZE
+from .database import DEFERRED_COMMIT, SQLALCHEMY_DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "dispatch_events"
+
+
+class Broker:
+    """
+    Рассылка событий подписчикам процесса. У каждого подписчика своя очередь в его event loop;
+    `publish` можно вызывать из любого потока (обработчики в пуле потоков, run_sync в greenlet).
+    """
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers: dict[str, set[tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    @asynccontextmanager
+    async def subscribe(self, topic: str):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(self.queue_size))
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                subscribers = self._subscribers[topic]
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    def publish(self, topic: str, message: dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_put, queue, message)
+            except RuntimeError:  # цикл подписчика уже закрыт
+                pass
+
+    def subscribers(self, topic: str) -> int:
+        return len(self._subscribers.get(topic, ()))
+
+
+def _put(queue: asyncio.Queue, message: dict) -> None:
+    # медленный подписчик теряет самые старые события, а не блокирует рассылку
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+def courier_topic(courier_id) -> str:
+    return f"courier:{courier_id}"
+
+
+def order_topic(order_id) -> str:
+    return f"order:{order_id}"
+
+
+def _messages(name: str, order_id, courier_id, status: int | None) -> list[tuple[str, dict]]:
+    message = {"event": name, "order_id": str(order_id),
+               "courier_id": str(courier_id) if courier_id else None, "status": status}
+    topics = [order_topic(order_id)] + ([courier_topic(courier_id)] if courier_id else [])
+    return [(topic, message) for topic in topics]
+
+
+def publish_on_commit(db: Session, name: str, order_id, courier_id=None, status: int | None = None) -> None:
+    # события рассылаются только после успешного коммита; при откате они забываются
+    db.info.setdefault("events", []).extend(_messages(name, order_id, courier_id, status))
+
+
+def publish(name: str, order_id, courier_id=None, status: int | None = None) -> None:
+    # без транзакции (STORAGE_BACKEND=memory) событие рассылается сразу подписчикам процесса
+    for topic, message in _messages(name, order_id, courier_id, status):
+        broker.publish(topic, message)
+
+
+@event.listens_for(Session, "before_commit")
+def _notify_before_commit(session: Session) -> None:
+    # NOTIFY транзакционный: события получат все воркеры (и этот тоже) только после коммита
+    events = session.info.get("events")
+    if EVENTS_NOTIFY and events:
+        session.execute(text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+                        {"channel": NOTIFY_CHANNEL,
+                         "payloads": [json.dumps({"topic": topic, "message": message}) for topic, message in events]})
+        session.info.pop("events")
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_after_commit(session: Session) -> None:
+    if session.info.get(DEFERRED_COMMIT):
+        return  # коммит точки сохранения, см. database.DEFERRED_COMMIT
+    for topic, message in session.info.pop("events", ()):
+        broker.publish(topic, message)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session: Session) -> None:
+    session.info.pop("events", None)
+
+
+async def run_notify_bridge(dsn: str = SQLALCHEMY_DATABASE_URL, retry_interval: float = 1) -> None:
+    """
+    Слушает канал NOTIFY_CHANNEL и передает события подписчикам этого процесса.
+    При потере соединения переподключается; события, отправленные за это время, теряются.
+    """
+    import asyncpg
+
+    def on_notify(connection, pid, channel, payload):
+        data = json.loads(payload)
+        broker.publish(data["topic"], data["message"])
+
+    while True:
+        try:
+            connection = await asyncpg.connect(dsn)
+        except (OSError, asyncpg.PostgresError):
+            logger.exception("Event bridge cannot connect to the database")
+            await asyncio.sleep(retry_interval)
+            continue
+        closed = asyncio.Event()
+        connection.add_termination_listener(lambda _: closed.set())
+        try:
+            await connection.add_listener(NOTIFY_CHANNEL, on_notify)
+            await closed.wait()
+        finally:
+            await connection.close()
+        await asyncio.sleep(retry_interval)
+
+
+broker = Broker()
@@ -0,0 +1,99 @@
+import math
+import threading
+import uuid
+
+from .config import GEO_CELL_KM
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    # равнопромежуточная проекция: на расстояниях в пределах города погрешность меньше 0.1%
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_KM * math.hypot(x, y)
+
+
+class GridIndex:
+    """
+    Положения курьеров в сетке ячеек `cell_km` x `cell_km` (по широте; по долготе ячейки уже в cos(широты) раз).
+    Обновление положения - O(1); поиск ближайших идет кольцами ячеек от точки заказа.
+    """
+
+    def __init__(self, cell_km: float = GEO_CELL_KM):
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self._lock = threading.Lock()
+        self._cells: dict[tuple[int, int], set[uuid.UUID]] = {}
+        self._positions: dict[uuid.UUID, tuple[float, float, tuple[int, int]]] = {}
+
+    def _cell(self, latitude: float, longitude: float) -> tuple[int, int]:
+        return math.floor(latitude / self.cell_deg), math.floor(longitude / self.cell_deg)
+
+    def load(self, positions) -> None:
+        """`positions` - итерируемый набор (courier_id, latitude, longitude)."""
+        with self._lock:
+            self._cells = {}
+            self._positions = {}
+            for courier_id, latitude, longitude in positions:
+                self._update(courier_id, latitude, longitude)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cells = {}
+            self._positions = {}
+
+    def update(self, courier_id: uuid.UUID, latitude: float, longitude: float) -> None:
+        with self._lock:
+            self._update(courier_id, latitude, longitude)
+
+    def _update(self, courier_id: uuid.UUID, latitude: float, longitude: float) -> None:
+        cell = self._cell(latitude, longitude)
+        previous = self._positions.get(courier_id)
+        if previous is not None and previous[2] != cell:
+            couriers = self._cells[previous[2]]
+            couriers.discard(courier_id)
+            if not couriers:
+                del self._cells[previous[2]]
+        self._cells.setdefault(cell, set()).add(courier_id)
+        self._positions[courier_id] = (latitude, longitude, cell)
+
+    def position(self, courier_id: uuid.UUID) -> tuple[float, float] | None:
+        position = self._positions.get(courier_id)
+        return None if position is None else position[:2]
+
+    def rings(self, latitude: float, longitude: float, max_radius_km: float):
+        """
+        Обходит кольца ячеек вокруг точки. Для каждого кольца возвращает курьеров кольца с расстояниями
+        (не дальше `max_radius_km`) и `reach_km` - все курьеры, не попавшие в уже пройденные кольца, дальше него.
+        """
+        ci, cj = self._cell(latitude, longitude)
+        ring = 0
+        while True:
+            if ring == 0:
+                cells = [(ci, cj)]
+            else:
+                cells = [(ci + di, cj + dj) for di in range(-ring, ring + 1) for dj in (-ring, ring)]
+                cells += [(ci + di, cj + dj) for di in (-ring, ring) for dj in range(-ring + 1, ring)]
+            found = []
+            with self._lock:
+                for cell in cells:
+                    for courier_id in self._cells.get(cell, ()):
+                        found.append((courier_id, self._positions[courier_id]))
+            candidates = [(courier_id, distance)
+                          for courier_id, (lat, lon, _) in found
+                          if (distance := distance_km(latitude, longitude, lat, lon)) <= max_radius_km]
+            # точка может лежать у края своей ячейки, поэтому до непройденных ячеек не меньше `ring` ячеек;
+            # ширина ячейки по долготе минимальна на самой дальней от экватора широте пройденных колец
+            edge_latitude = min(abs(latitude) + (ring + 1) * self.cell_deg, 89.0)
+            reach_km = ring * self.cell_deg * KM_PER_DEGREE * math.cos(math.radians(edge_latitude))
+            yield candidates, reach_km
+            if reach_km >= max_radius_km:
+                return
+            ring += 1
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+
+courier_grid = GridIndex()
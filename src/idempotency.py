@@ -0,0 +1,191 @@
+import datetime
+import hashlib
+import json
+import threading
+import time
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import IDEMPOTENCY_TTL
+from .database import DEFERRED_COMMIT, adopt_deferred, get_session, savepoint_session
+
+# Ответ на запрос с заголовком Idempotency-Key сохраняется в idempotency_keys. Ключ захватывается в транзакции
+# запроса, и ответ фиксируется тем же коммитом, что и изменения запроса: строка ключа остается заблокированной
+# до коммита, поэтому повтор, пришедший во время обработки первого запроса (в любой воркер), ждет его завершения
+# и получает тот же ответ, а при сбое до коммита откатываются и ключ, и изменения.
+
+
+def request_hash(*parts) -> str:
+    return hashlib.sha256(json.dumps(jsonable_encoder(parts), sort_keys=True).encode()).hexdigest()
+
+
+def claim(db: Session, key: str, fingerprint: str) -> tuple[int, object] | None:
+    """
+    Захватывает ключ и возвращает `None` - запрос нужно выполнить и сохранить ответ через `store`.
+    Если по ключу уже есть ответ, возвращает его код и тело.
+    """
+    expires_at = func.now() + datetime.timedelta(seconds=IDEMPOTENCY_TTL)
+    stmt = insert(models.IdempotencyKey).values(key=key, request_hash=fingerprint, expires_at=expires_at)
+    # истекший ключ можно использовать повторно; если ключ захвачен другой транзакцией, запрос ждет ее завершения
+    claimed = db.execute(stmt.on_conflict_do_update(
+        index_elements=[models.IdempotencyKey.key],
+        set_={"request_hash": fingerprint, "status_code": None, "response": None, "expires_at": expires_at},
+        where=models.IdempotencyKey.expires_at < func.now(),
+    ).returning(models.IdempotencyKey.key)).first()
+    if claimed is not None:
+        return None
+
+    stored_hash, status_code, response = db.execute(
+        select(models.IdempotencyKey.request_hash, models.IdempotencyKey.status_code, models.IdempotencyKey.response)
+        .where(models.IdempotencyKey.key == key)
+    ).one()
+    db.rollback()
+    if stored_hash != fingerprint:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail='Idempotency-Key has already been used for a different request')
+    return status_code, json.loads(response)
+
+
+def store(db: Session, key: str, status_code: int, body) -> None:
+    db.execute(update(models.IdempotencyKey)
+               .where(models.IdempotencyKey.key == key)
+               .values(status_code=status_code, response=json.dumps(jsonable_encoder(body))))
+    db.commit()
+
+
+def purge_expired(db: Session) -> int:
+    result = db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at < func.now()))
+    db.commit()
+    return result.rowcount
+
+
+def _error_outcome(e: HTTPException) -> tuple[int, dict]:
+    # ошибки клиента (404 и т.п.) - тоже результат запроса и сохраняются; при 5xx ключ освобождается
+    if e.status_code >= 500:
+        raise e
+    return e.status_code, {"detail": e.detail}
+
+
+def _response(status_code: int, body, replayed: bool) -> JSONResponse:
+    return JSONResponse(jsonable_encoder(body), status_code=status_code,
+                        headers={"Idempotent-Replayed": "true"} if replayed else None)
+
+
+def respond(db: Session, key: str, fingerprint: str, call) -> JSONResponse:
+    """
+    `call(session)` выполняет запрос в переданной сессии и возвращает код и тело ответа; `db` - сессия запроса.
+    Сессия для `call` работает на соединении `db` внутри его транзакции, поэтому запросу нужно одно соединение пула.
+    """
+    try:
+        stored = claim(db, key, fingerprint)
+        if stored is not None:
+            return _response(*stored, replayed=True)
+        work = savepoint_session(db)
+        try:
+            status_code, body = call(work)
+        except HTTPException as e:
+            status_code, body = _error_outcome(e)
+        finally:
+            work.close()
+        adopt_deferred(work, db)
+        store(db, key, status_code, body)
+        return _response(status_code, body, replayed=False)
+    except Exception:
+        db.rollback()  # ответ не сохранен - ключ освобождается вместе с изменениями запроса
+        raise
+
+
+async def respond_async(db: AsyncSession, key: str, fingerprint: str, call) -> JSONResponse:
+    """То же для асинхронного режима; `call(session)` - корутина."""
+    try:
+        stored = await db.run_sync(claim, key, fingerprint)
+        if stored is not None:
+            return _response(*stored, replayed=True)
+        work = AsyncSession(bind=await db.connection(), autoflush=False, join_transaction_mode="create_savepoint",
+                            info={DEFERRED_COMMIT: True})
+        try:
+            status_code, body = await call(work)
+        except HTTPException as e:
+            status_code, body = _error_outcome(e)
+        finally:
+            await work.close()
+        adopt_deferred(work.sync_session, db.sync_session)
+        await db.run_sync(store, key, status_code, body)
+        return _response(status_code, body, replayed=False)
+    except Exception:
+        await db.rollback()
+        raise
+
+
+class KeyStore:
+    """
+    Ответы по Idempotency-Key в памяти процесса (STORAGE_BACKEND=memory). Повтор, пришедший во время
+    обработки первого запроса, ждет его завершения на блокировке ключа, как на строке idempotency_keys.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._claimed: dict[str, list] = {}  # ключ -> [блокировка, число ожидающих запросов]
+        # порядок вставки совпадает с порядком истечения: TTL у всех ключей один
+        self._responses: dict[str, tuple[str, int, object, float]] = {}
+
+    def respond(self, key: str, fingerprint: str, call) -> JSONResponse:
+        with self._lock:
+            claim = self._claimed.setdefault(key, [threading.Lock(), 0])
+            claim[1] += 1
+        try:
+            with claim[0]:
+                return self._respond(key, fingerprint, call)
+        finally:
+            with self._lock:
+                claim[1] -= 1
+                if not claim[1]:
+                    del self._claimed[key]
+
+    def _respond(self, key: str, fingerprint: str, call) -> JSONResponse:
+        with self._lock:
+            stored = self._responses.get(key)
+        if stored is not None and stored[3] > self._clock():
+            stored_hash, status_code, body, _ = stored
+            if stored_hash != fingerprint:
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                    detail='Idempotency-Key has already been used for a different request')
+            return _response(status_code, body, replayed=True)
+        try:
+            status_code, body = call()
+        except HTTPException as e:
+            status_code, body = _error_outcome(e)
+        body = jsonable_encoder(body)
+        with self._lock:
+            self._purge_expired()
+            self._responses.pop(key, None)
+            self._responses[key] = (fingerprint, status_code, body, self._clock() + self.ttl)
+        return _response(status_code, body, replayed=False)
+
+    def _purge_expired(self) -> None:
+        now = self._clock()
+        while self._responses:
+            key = next(iter(self._responses))
+            if self._responses[key][3] > now:
+                break
+            del self._responses[key]
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+
+if __name__ == "__main__":
+    session = get_session()
+    try:
+        print(f"Expired idempotency keys removed: {purge_expired(session)}")
+    finally:
+        session.close()
@@ -0,0 +1,107 @@
+import asyncio
+import datetime
+import logging
+import threading
+import uuid
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Float, UUID, DateTime, column, exists, select, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import DB_ASYNC, DISPATCH_MODE
+from .database import get_session, get_async_session
+from .geo import courier_grid
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = 5000
+
+
+class LocationBuffer:
+    """
+    Последние положения курьеров, еще не записанные в БД. Повторное обновление курьера до записи
+    заменяет предыдущее, поэтому объем записи ограничен числом курьеров, а не частотой обновлений.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: dict[uuid.UUID, tuple[float, float, datetime.datetime]] = {}
+
+    def add(self, courier_id: uuid.UUID, latitude: float, longitude: float) -> None:
+        with self._lock:
+            self._pending[courier_id] = (latitude, longitude, datetime.datetime.now())
+
+    def take(self) -> dict[uuid.UUID, tuple[float, float, datetime.datetime]]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def restore(self, pending: dict) -> None:
+        # положения, которые не удалось записать, возвращаются в буфер, если курьер с тех пор не обновился
+        with self._lock:
+            self._pending = pending | self._pending
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+
+def update_location(courier_id: uuid.UUID, latitude: float, longitude: float) -> None:
+    if DISPATCH_MODE != "locking":  # в режиме locking расстояния считает запрос к БД, сетка не нужна
+        courier_grid.update(courier_id, latitude, longitude)
+    location_buffer.add(courier_id, latitude, longitude)
+
+
+def flush_locations(db: Session) -> int:
+    """Записывает накопленные положения пачками INSERT ... ON CONFLICT; неизвестные курьеры пропускаются."""
+    pending = location_buffer.take()
+    rows = [(courier_id, *location) for courier_id, location in pending.items()]
+    try:
+        for start in range(0, len(rows), FLUSH_BATCH_SIZE):
+            batch = values(column("courier_id", UUID), column("latitude", Float), column("longitude", Float),
+                           column("updated_at", DateTime), name="batch").data(rows[start:start + FLUSH_BATCH_SIZE])
+            stmt = insert(models.CourierLocation).from_select(
+                ["courier_id", "latitude", "longitude", "updated_at"],
+                select(batch).where(exists().where(models.Courier.id == batch.c.courier_id)),
+            )
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[models.CourierLocation.courier_id],
+                set_={"latitude": stmt.excluded.latitude, "longitude": stmt.excluded.longitude,
+                      "updated_at": stmt.excluded.updated_at},
+            ))
+        db.commit()
+    except Exception:
+        db.rollback()
+        location_buffer.restore(pending)
+        raise
+    return len(rows)
+
+
+async def flush_pending() -> None:
+    if DB_ASYNC:
+        async with get_async_session() as db:
+            await db.run_sync(flush_locations)
+    else:
+        await run_in_threadpool(_flush_locations)
+
+
+async def run_location_flusher(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        if len(location_buffer):
+            try:
+                await flush_pending()
+            except Exception:
+                logger.exception("Courier locations flush failed")
+
+
+def _flush_locations() -> int:
+    db = get_session()
+    try:
+        return flush_locations(db)
+    finally:
+        db.close()
+
+
+location_buffer = LocationBuffer()
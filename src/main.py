@@ -1,22 +1,89 @@
+import asyncio
+import datetime
+import inspect
 import uuid
 import uvicorn
+from contextlib import asynccontextmanager
 from enum import Enum
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, APIRouter, Body, Depends, Header, HTTPException, Query, Request, Response, WebSocket, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from src import crud, schemas
-from src.database import get_session
-
-app = FastAPI()
+from src import crud, crud_async, idempotency, schemas
+from src.metrics import MetricsMiddleware, registry
+from src.archive import run_archiver
+from src.config import (ARCHIVE_INTERVAL, DB_ASYNC, DISPATCH_MODE, COURIERS_PAGE_SIZE, EVENTS_NOTIFY,
+                        LOCATIONS_FLUSH_INTERVAL, STORAGE_BACKEND)
+from src.cache import cache
+from src.database import get_session, get_async_session, pool_status, warm_pool, warm_async_pool
+from src.events import broker, courier_topic, order_topic, run_notify_bridge
+from src.locations import flush_pending, location_buffer, run_location_flusher
+from src.repository import Repository, SqlRepository, memory_repository
+from src.strategies import strategy_selector
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    strategy_selector.validate()
+    # при STORAGE_BACKEND=memory загружать нечего, а фоновые задачи работают с БД
+    tasks = []
+    if STORAGE_BACKEND == "sql":
+        # загружаем реестр районов и строим индекс свободных курьеров по районам
+        # (в режиме locking курьеры выбираются запросом к БД), заранее открываем соединения пула
+        if DB_ASYNC:
+            async with get_async_session() as db:
+                await crud_async.load_district_registry(db)
+                if DISPATCH_MODE != "locking":
+                    await crud_async.load_dispatch_index(db)
+            await warm_async_pool()
+        else:
+            db = get_session()
+            try:
+                crud.load_district_registry(db)
+                if DISPATCH_MODE != "locking":
+                    crud.load_dispatch_index(db)
+            finally:
+                db.close()
+            warm_pool()
+        # фоновый перенос завершенных заказов в архив
+        if ARCHIVE_INTERVAL:
+            tasks.append(asyncio.create_task(run_archiver(ARCHIVE_INTERVAL)))
+        # события других воркеров приходят через LISTEN
+        if EVENTS_NOTIFY:
+            tasks.append(asyncio.create_task(run_notify_bridge()))
+        # положения курьеров пишутся в БД пачками
+        tasks.append(asyncio.create_task(run_location_flusher(LOCATIONS_FLUSH_INTERVAL)))
+    app.state.ready = True
+    yield
+    app.state.ready = False
+    for task in tasks:
+        task.cancel()
+    if len(location_buffer):
+        await flush_pending()
+
+
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False  # GET /internal/ready отвечает 200 после загрузки индексов и прогрева пула
+app.add_middleware(MetricsMiddleware)  # время запросов и число SQL-запросов по маршрутам для GET /metrics
+router = APIRouter()  # синхронные обработчики (psycopg2, пул потоков Starlette)
+async_router = APIRouter()  # асинхронные обработчики (asyncpg), включаются при DB_ASYNC
 
 
 class Tags(Enum):
     couriers = "Couriers"
     orders = "Orders"
+    analytics = "Analytics"
+    internal = "Internal"
 
 
 def get_db():
+    if STORAGE_BACKEND == "memory":
+        yield None  # данные в памяти процесса, настройки БД не нужны
+        return
     db = get_session()
     try:
         yield db
@@ -24,8 +91,29 @@ def get_db():
         db.close()
 
 
-@app.post("/courier", tags=[Tags.couriers], summary="Регистрация нового курьера")
-def create_courier(courier: schemas.CourierIn, db: Session = Depends(get_db)):
+async def get_async_db():
+    async with get_async_session() as db:
+        yield db
+
+
+def get_repository(db: Session = Depends(get_db)) -> Repository:
+    return memory_repository if STORAGE_BACKEND == "memory" else SqlRepository(db)
+
+
+async def get_location_repository() -> Repository:
+    # положения курьеров хранятся в памяти процесса и сессии не требуют: обработчик остается в event loop
+    return memory_repository if STORAGE_BACKEND == "memory" else SqlRepository(None)
+
+
+async def known_couriers(repository: Repository, courier_ids) -> set[uuid.UUID]:
+    # в режиме locking курьеры проверяются запросом к БД, он выполняется вне event loop
+    if isinstance(repository, SqlRepository) and DISPATCH_MODE == "locking":
+        return await run_in_threadpool(repository.known_couriers, courier_ids)
+    return repository.known_couriers(courier_ids)
+
+
+@router.post("/courier", tags=[Tags.couriers], summary="Регистрация нового курьера")
+def create_courier(courier: schemas.CourierIn, repository: Repository = Depends(get_repository)):
     """
     ### Регистрация нового курьера в системе
 
@@ -35,24 +123,151 @@ def create_courier(courier: schemas.CourierIn, db: Session = Depends(get_db)):
     districts = list(set(d.lower() for d in courier.districts))  # избавляемся от дубликатов районов
     db_courier = courier
     db_courier.districts = districts  # передаем в модель курьера массив районов без дубликатов
-    db_courier = crud.create_courier(db, db_courier)  # добавляем курьера в БД
+    db_courier = repository.create_courier(db_courier)  # добавляем курьера в БД
     return {"message": f"Courier '{db_courier.name}' is registered"}
 
 
-@app.get("/courier", response_model=list[schemas.CourierBase], tags=[Tags.couriers], summary="Получение информации о всех курьерах")
-def get_couriers(db: Session = Depends(get_db)):
+async def read_ndjson(request: Request):
+    # тело читается по частям, каждая непустая строка - отдельный JSON-объект
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+# тело читается из Request вручную, поэтому схема запроса описывается явно
+COURIERS_BULK_BODY = {"requestBody": {"required": True, "content": {
+    "application/json": {"schema": {"type": "array", "items": {"$ref": "#/components/schemas/CourierIn"}}},
+    "application/x-ndjson": {"schema": {"type": "string"}},
+}}}
+
+
+@router.post("/couriers/bulk", response_model=list[schemas.CourierBulkResult], tags=[Tags.couriers],
+             summary="Массовая регистрация курьеров", openapi_extra=COURIERS_BULK_BODY)
+async def create_couriers_bulk(request: Request, repository: Repository = Depends(get_repository)):
+    """
+    ### Регистрация множества курьеров одним запросом
+
+    Принимает массив курьеров в формате `application/json` или поток `application/x-ndjson` (один курьер на строку).
+    Каждый элемент содержит те же поля, что и при регистрации одного курьера:
+    - **name**: `str` - имя курьера
+    - **districts**: `list[str]` - массив районов, в которых курьер имеет возможность принимать заказ
+
+    Все корректные курьеры и их районы добавляются в одной транзакции. Для каждого элемента возвращается результат:
+    - **index**: `int` - номер элемента в запросе
+    - **status**: `str` - `created` или `invalid`
+    - **id**: `uuid` - идентификатор зарегистрированного курьера
+    - **name**: `str` - имя курьера
+    - **errors**: `list[str]` - ошибки валидации элемента
+    """
+    results, couriers = await read_couriers(request)
+    created = iter(await run_in_threadpool(repository.create_couriers, couriers))  # добавляем курьеров в БД одной транзакцией
+    for result in results:
+        if result.status == "created":
+            result.id = next(created).id
+    return results
+
+
+async def read_couriers(request: Request) -> tuple[list[schemas.CourierBulkResult], list[schemas.CourierIn]]:
+    # результаты по всем элементам запроса и корректные курьеры для добавления в БД
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        rows = [line async for line in read_ndjson(request)]
+    else:
+        try:
+            rows = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Invalid JSON body')
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Expected an array of couriers')
+
+    results: list[schemas.CourierBulkResult] = []
+    couriers: list[schemas.CourierIn] = []
+    for i, row in enumerate(rows):
+        try:
+            courier = schemas.CourierIn.model_validate_json(row) if isinstance(row, bytes) \
+                else schemas.CourierIn.model_validate(row)
+        except ValidationError as e:
+            errors = [f"{'.'.join(map(str, error['loc'])) or 'body'}: {error['msg']}" for error in e.errors()]
+            results.append(schemas.CourierBulkResult(index=i, status="invalid", errors=errors))
+            continue
+        results.append(schemas.CourierBulkResult(index=i, status="created", name=courier.name))
+        couriers.append(courier)
+    return results, couriers
+
+
+@router.get("/courier", response_model=list[schemas.CourierBase], tags=[Tags.couriers], summary="Получение информации о всех курьерах")
+def get_couriers(response: Response, filters: schemas.CourierFilters = Depends(), after: uuid.UUID | None = None,
+                 limit: int = Query(COURIERS_PAGE_SIZE, ge=1, le=1000), repository: Repository = Depends(get_repository)):
     """
     ### Получение информации о всех курьерах в системе
 
+    Курьеры возвращаются страницами в порядке **id**. Параметры запроса:
+    - **after**: `uuid` - вернуть курьеров, следующих за курьером с этим **id** (курсор)
+    - **limit**: `int` - размер страницы
+    - **district**: `str` - только курьеры указанного района
+    - **state**: `str` - `idle` - только свободные курьеры, `busy` - только курьеры с активным заказом
+
+    Если есть следующая страница, ее курсор возвращается в заголовке `X-Next-Cursor`.
+
     Возвращает массив элементов со следующими полями:
     - **id**: `uuid` - уникальный идентификатор курьера
     - **name**: `str` - имя курьера
     """
-    return crud.get_couriers(db) # получаем из БД и возвращаем информацию по всем курьерам
+    couriers = repository.get_couriers(filters, after, limit)  # получаем из БД страницу курьеров
+    if len(couriers) == limit:
+        response.headers["X-Next-Cursor"] = str(couriers[-1].id)
+    return couriers
 
 
-@app.get("/courier/{id}", response_model=schemas.Courier, tags=[Tags.couriers], summary="Получение информации о курьере")
-def get_courier(id: uuid.UUID, db: Session = Depends(get_db)):
+@router.get("/couriers/stream", tags=[Tags.couriers], summary="Выгрузка курьеров потоком NDJSON",
+            response_class=StreamingResponse)
+def stream_couriers(filters: schemas.CourierFilters = Depends(), repository: Repository = Depends(get_repository)):
+    """
+    ### Выгрузка всех курьеров в формате `application/x-ndjson`
+
+    Каждая строка ответа - JSON-объект с полями **id** и **name**. Поддерживает те же фильтры **district** и **state**,
+    что и `GET /courier`. Курьеры читаются из БД серверным курсором, поэтому ответ начинает отдаваться сразу.
+    """
+    return StreamingResponse(repository.stream_couriers(filters), media_type="application/x-ndjson")
+
+
+@app.put("/courier/{id}/location", status_code=status.HTTP_204_NO_CONTENT, tags=[Tags.couriers],
+         summary="Обновление положения курьера")
+async def update_courier_location(id: uuid.UUID, location: schemas.Location,
+                                  repository: Repository = Depends(get_location_repository)):
+    """
+    ### Обновление текущего положения курьера
+
+    Принимает **latitude** и **longitude**: `float` - координаты курьера. Положение сразу учитывается при назначении
+    заказов с координатами и записывается в БД фоновой задачей раз в `LOCATIONS_FLUSH_INTERVAL` секунд.
+    """
+    if id not in await known_couriers(repository, [id]):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Courier does not exist')
+    repository.update_location(id, location.latitude, location.longitude)
+
+
+@app.post("/couriers/locations", status_code=status.HTTP_204_NO_CONTENT, tags=[Tags.couriers],
+          summary="Пакетное обновление положений курьеров")
+async def update_courier_locations(locations: list[schemas.CourierLocation] = Body(max_length=10000),
+                                   repository: Repository = Depends(get_location_repository)):
+    """
+    ### Обновление положений нескольких курьеров одним запросом
+
+    Принимает список объектов с полями **courier_id**, **latitude** и **longitude**. Неизвестные курьеры пропускаются.
+    """
+    known = await known_couriers(repository, {location.courier_id for location in locations})
+    for location in locations:
+        if location.courier_id in known:
+            repository.update_location(location.courier_id, location.latitude, location.longitude)
+
+
+@router.get("/courier/{id}", response_model=schemas.Courier, tags=[Tags.couriers], summary="Получение информации о курьере")
+def get_courier(id: uuid.UUID, repository: Repository = Depends(get_repository)):
     """
     ### Получение подробной информации о курьере
 
@@ -67,14 +282,15 @@ def get_courier(id: uuid.UUID, db: Session = Depends(get_db)):
     - **avg_order_complete_time**: `datetime` - среднее время выполнения заказа
     - **avg_day_orders**: `int` - среднее количество выполненных заказов за день работы
     """
-    db_courier = crud.get_courier(db, id)  # попытка получения курьера из БД
+    db_courier = repository.get_courier(id)  # попытка получения курьера из БД
     if db_courier is not None:
         return db_courier  # курьер найден - возвращаем курьера
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Courier does not exist')  # курьер не найден - возвращаем ошибку
 
 
-@app.post("/order", response_model=schemas.OrderCreated, tags=[Tags.orders], summary="Публикация заказа")
-def create_order(order: schemas.OrderIn, db: Session = Depends(get_db)):
+@router.post("/order", response_model=schemas.OrderCreated, tags=[Tags.orders], summary="Публикация заказа")
+def create_order(order: schemas.OrderIn, response: Response, repository: Repository = Depends(get_repository),
+                 idempotency_key: str | None = Header(None, max_length=255)):
     """
     ### Публикация заказа в системе
 
@@ -85,46 +301,390 @@ def create_order(order: schemas.OrderIn, db: Session = Depends(get_db)):
     Если в базе есть курьер, который работает в указанном районе и не имеет активного заказа, заказ публикуется, для заказа назначается свободный курьер. Запрос возвращает поля:
     - **order_id**: `uuid` - уникальный идентификатор заказа
     - **courier_id**: `uuid` - уникальный идентификатор назначенного курьера
+    - **status**: `int` - статус заказа
+
+    Если подходящий курьер не найден, запрос возвращает ошибку. Если включена очередь заказов (`ORDER_QUEUE_ENABLED`),
+    заказ вместо этого сохраняется со статусом 0 (ожидает курьера) и **courier_id** = `None`, запрос возвращает код 202.
+    Курьер будет назначен, когда освободится; назначение можно отслеживать через `GET /order/{id}`
+
+    Если передан заголовок `Idempotency-Key`, ответ сохраняется на `IDEMPOTENCY_TTL` секунд: повторный запрос
+    с тем же ключом не публикует заказ заново, а получает сохраненный ответ (с заголовком `Idempotent-Replayed`).
+    Повтор, пришедший во время обработки первого запроса, ждет его завершения.
+    """
+    def publish():
+        created = repository.create_order(order)  # попытка создать заказ. Если заказ создан - возвращаем информацию по нему
+        # без курьера заказ ждет в очереди района
+        return status.HTTP_202_ACCEPTED if created.courier_id is None else status.HTTP_200_OK, created
+
+    if idempotency_key is not None:
+        return repository.respond(idempotency_key, idempotency.request_hash("POST /order", order), publish)
+    response.status_code, created = publish()
+    return created
+
+
+@router.post("/orders/batch", response_model=list[schemas.OrderBatchResult], tags=[Tags.orders],
+             summary="Публикация пакета заказов")
+def create_orders_batch(orders: list[schemas.OrderIn] = Body(min_length=1, max_length=1000),
+                        repository: Repository = Depends(get_repository)):
+    """
+    ### Публикация нескольких заказов одним запросом
+
+    Принимает массив заказов с полями:
+    - **name**: `str` - имя заказа
+    - **district**: `str` - район заказа
+
+    Свободные курьеры подбираются сразу на весь пакет так, чтобы назначить как можно больше заказов
+    с минимальным суммарным средним временем выполнения. Все заказы сохраняются в одной транзакции.
+    Для каждого заказа возвращается:
+    - **index**: `int` - номер заказа в запросе
+    - **order_id**: `uuid` - уникальный идентификатор заказа
+    - **courier_id**: `uuid` - уникальный идентификатор назначенного курьера
+    - **status**: `int` - статус заказа
+    - **reason**: `str` - причина, по которой заказ не опубликован или курьер не назначен
+    """
+    return repository.create_orders(orders)
 
-    Если подходящий курьер не найден, запрос возвращает ошибку
+
+@router.post("/orders/complete", response_model=list[schemas.OrderCompleteResult], tags=[Tags.orders],
+             summary="Завершение пакета заказов")
+def complete_orders_batch(order_ids: list[uuid.UUID] = Body(min_length=1, max_length=1000),
+                          repository: Repository = Depends(get_repository)):
+    """
+    ### Завершение нескольких заказов одним запросом
+
+    Принимает массив **id** заказов (например, выполненных курьером без связи). Все заказы в работе
+    завершаются в одной транзакции, статистика курьеров пересчитывается один раз на курьера.
+    Для каждого id в порядке запроса возвращается:
+    - **order_id**: `uuid` - идентификатор заказа
+    - **completed**: `bool` - заказ завершен этим запросом
+    - **reason**: `str` - причина, по которой заказ не завершен (не существует, уже завершен, ждет курьера)
     """
-    order = crud.create_order(db, order) # попытка создать заказ. Если заказ создан - возвращаем информацию по нему
-    return order
+    return repository.complete_orders(order_ids)
 
 
-@app.get("/order/{id}", response_model=schemas.OrderInfo, tags=[Tags.orders], summary="Получение информации о заказе")
-def get_order(id: uuid.UUID, db: Session = Depends(get_db)):
+@router.get("/order/{id}", response_model=schemas.OrderInfo, tags=[Tags.orders], summary="Получение информации о заказе")
+def get_order(id: uuid.UUID, repository: Repository = Depends(get_repository)):
     """
     ### Получение информации о конкретном заказе
 
     Для получения информации нужно передать в запросе **id**: `uuid` - уникальный идентификатор заказа
 
     Если такой заказ существует, запрос вернёт следующие поля:
-    - **courier_id**: `uuid` - идентификатор курьера, назначенного для этого заказа
-    - **status**: `int` - статус заказа; 1 - заказ в работе, 2 - заказ завершен
+    - **courier_id**: `uuid` - идентификатор курьера, назначенного для этого заказа (`None`, пока заказ ждет курьера)
+    - **status**: `int` - статус заказа; 0 - заказ ждет курьера, 1 - заказ в работе, 2 - заказ завершен
     """
-    order = crud.get_order(db, id)  # пробуем получить заказ из БД
+    order = repository.get_order_info(id)  # пробуем получить заказ из кэша или БД
     if order is not None:
         return order  # заказ существует, возвращаем информацию
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Order does not exist')  # заказ не существует, возвращаем ошибку
 
 
-@app.post("/order/{id}", tags=[Tags.orders], summary="Завершение заказа")
-def complete_order(id: uuid.UUID, db: Session = Depends(get_db)):
+@router.post("/order/{id}", tags=[Tags.orders], summary="Завершение заказа")
+def complete_order(id: uuid.UUID, repository: Repository = Depends(get_repository),
+                   idempotency_key: str | None = Header(None, max_length=255)):
     """
     ### Завершение заказа
 
     Запрос меняет статус заказа на 'Завершен'. В запросе нужно передать **id**: `uuid` - идентификатор заказа.
     Если заказ не существует или уже завершен, запрос вернёт ошибку
+
+    Поддерживает заголовок `Idempotency-Key` так же, как `POST /order`: повтор получает ответ первого запроса
+    """
+    def complete():
+        result = repository.complete_order(id)  # пробуем завершить заказ, если завершение заказа прошло успешно, функция вернет True
+        if result:
+            return status.HTTP_200_OK, {"message": "OK"}
+        # заказ не найден или уже завершен - возвращаем ошибку
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail='The order does not exist or has already been completed')
+
+    if idempotency_key is not None:
+        return repository.respond(idempotency_key, idempotency.request_hash("POST /order/{id}", id), complete)
+    return complete()[1]
+
+
+@router.get("/courier/{id}/stats", response_model=schemas.StatsReport, tags=[Tags.analytics],
+            summary="Статистика курьера по дням")
+def get_courier_stats(id: uuid.UUID, date_from: datetime.date | None = None, date_to: datetime.date | None = None,
+                      repository: Repository = Depends(get_repository)):
+    """
+    ### Статистика выполненных заказов курьера за период
+
+    - **date_from**, **date_to**: `date` - границы периода включительно (по дате публикации заказа), необязательные
+
+    Возвращает итоги за период и массив **days** с теми же показателями по дням:
+    - **orders_count**: `int` - выполнено заказов
+    - **work_days**: `int` - дней, в которые курьер выполнял заказы
+    - **avg_complete_time**, **min_complete_time**, **max_complete_time**: `float` - время выполнения заказа, сек.
+    - **avg_day_orders**: `float` - среднее число заказов за рабочий день
+    """
+    stats = repository.get_courier_stats(id, date_from, date_to)
+    if stats is not None:
+        return stats
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Courier does not exist')
+
+
+@router.get("/district/{name}/stats", response_model=schemas.StatsReport, tags=[Tags.analytics],
+            summary="Статистика района по дням")
+def get_district_stats(name: str, date_from: datetime.date | None = None, date_to: datetime.date | None = None,
+                       repository: Repository = Depends(get_repository)):
+    """
+    ### Статистика выполненных заказов района за период
+
+    Параметры и поля ответа те же, что у `GET /courier/{id}/stats`; **work_days** - дни, в которые в районе
+    выполнялись заказы.
     """
-    result = crud.complete_order(db, id)  # пробуем завершить заказ, если завершение заказа прошло успешно, функция вернет True
-    if result:
-        return {"message": "OK"}
+    stats = repository.get_district_stats(name, date_from, date_to)
+    if stats is not None:
+        return stats
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='District does not exist')
 
-    if not result:  # заказ не найден или уже завершен - возвращаем ошибку
+
+@router.get("/orders/pending", response_model=list[schemas.PendingOrders], tags=[Tags.orders],
+            summary="Очереди заказов, ожидающих курьера")
+def get_pending_orders(repository: Repository = Depends(get_repository)):
+    """
+    ### Глубина очередей заказов по районам
+
+    Для каждого района, в котором есть заказы без курьера, возвращает:
+    - **district**: `str` - район
+    - **pending_orders**: `int` - количество заказов в очереди
+    - **max_wait_time**: `float` - сколько секунд ждет самый старый заказ
+    """
+    return repository.get_pending_orders()
+
+
+async def push_events(websocket: WebSocket, topic: str):
+    # подписка оформляется до accept, поэтому события после подключения клиента не теряются
+    async with broker.subscribe(topic) as events:
+        await websocket.accept()
+
+        async def forward():
+            try:
+                while True:
+                    await websocket.send_json(await events.get())
+            except Exception:  # клиент отключился
+                return
+
+        sender = asyncio.create_task(forward())
+        try:
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass  # сообщения клиента не используются
+        finally:
+            sender.cancel()
+
+
+@app.websocket("/ws/courier/{id}")
+async def courier_events(websocket: WebSocket, id: uuid.UUID):
+    """
+    ### События курьера
+
+    Сообщения - JSON-объекты с полями **event** (`order_assigned`, `order_completed`), **order_id**,
+    **courier_id** и **status**. Заменяет периодический опрос `GET /courier/{id}`.
+    """
+    await push_events(websocket, courier_topic(id))
+
+
+@app.websocket("/ws/order/{id}")
+async def order_events(websocket: WebSocket, id: uuid.UUID):
+    """
+    ### События заказа
+
+    Сообщения те же, что у `/ws/courier/{id}`, плюс `order_pending` для заказа, поставленного в очередь.
+    Заменяет периодический опрос `GET /order/{id}`.
+    """
+    await push_events(websocket, order_topic(id))
+
+
+@app.get("/internal/ready", tags=[Tags.internal], summary="Готовность воркера к приему запросов")
+async def get_readiness(response: Response):
+    """
+    ### Проверка готовности (readiness probe)
+
+    Возвращает `200` после того, как воркер загрузил районы и индекс курьеров и открыл соединения с БД,
+    и `503` до этого и во время остановки.
+    """
+    if not app.state.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "not ready"}
+    return {"status": "ready"}
+
+
+@app.get("/internal/pool", tags=[Tags.internal], summary="Состояние пула соединений с БД")
+async def get_pool_status():
+    """
+    ### Состояние пулов соединений с БД текущего процесса
+
+    Для каждого движка (`sync:dev`, `async:dev`, ...) возвращает:
+    - **size**, **max_overflow**: `int` - настройки пула
+    - **checked_out**: `int` - соединений выдано запросам
+    - **idle**: `int` - свободных соединений в пуле
+    - **overflow**: `int` - соединений открыто сверх **size**
+    - **wait_count**, **wait_time_total**, **wait_time_avg**, **wait_time_max**: время ожидания соединения из пула, сек.
+    - **timeouts**: `int` - сколько раз соединение не было получено за `DB_POOL_TIMEOUT`
+    """
+    return pool_status()
+
+
+@app.get("/internal/cache", tags=[Tags.internal], summary="Статистика кэша")
+async def get_cache_stats():
+    """
+    ### Статистика кэша `GET /courier/{id}` и `GET /order/{id}` текущего процесса
+
+    - **enabled**: `bool` - включен ли кэш
+    - **shared**: `str` - общий бэкенд кэша, если задан
+    - **size**: `int` - записей в кэше процесса
+    - **hits**, **misses**: `int` - попадания и промахи
+    - **evictions**: `int` - записи, вытесненные из кэша процесса по размеру или времени жизни
+    - **invalidations**: `int` - записи, сброшенные после изменения заказов и курьеров
+    """
+    return cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=[Tags.internal], summary="Метрики Prometheus")
+async def get_metrics():
+    """
+    ### Метрики текущего процесса в текстовом формате Prometheus
+
+    По каждому маршруту (`method`, `route`):
+    - **http_requests_total** - число запросов с разбивкой по коду ответа
+    - **http_request_duration_seconds** - гистограмма времени обработки запроса
+    - **db_statements_per_request** - гистограмма числа SQL-запросов на один HTTP-запрос
+    - **db_time_seconds_total** - суммарное время выполнения SQL-запросов
+    - **db_rows_total** - строк выбрано или изменено SQL-запросами
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@async_router.post("/courier", tags=[Tags.couriers], summary="Регистрация нового курьера",
+                   description=inspect.cleandoc(create_courier.__doc__))
+async def create_courier_async(courier: schemas.CourierIn, db: AsyncSession = Depends(get_async_db)):
+    courier.districts = list(set(d.lower() for d in courier.districts))
+    db_courier = await crud_async.create_courier(db, courier)
+    return {"message": f"Courier '{db_courier.name}' is registered"}
+
+
+@async_router.post("/couriers/bulk", response_model=list[schemas.CourierBulkResult], tags=[Tags.couriers],
+                   summary="Массовая регистрация курьеров", openapi_extra=COURIERS_BULK_BODY,
+                   description=inspect.cleandoc(create_couriers_bulk.__doc__))
+async def create_couriers_bulk_async(request: Request, db: AsyncSession = Depends(get_async_db)):
+    results, couriers = await read_couriers(request)
+    created = iter(await crud_async.create_couriers(db, couriers))
+    for result in results:
+        if result.status == "created":
+            result.id = next(created).id
+    return results
+
+
+@async_router.get("/courier", response_model=list[schemas.CourierBase], tags=[Tags.couriers],
+                  summary="Получение информации о всех курьерах", description=inspect.cleandoc(get_couriers.__doc__))
+async def get_couriers_async(response: Response, filters: schemas.CourierFilters = Depends(),
+                             after: uuid.UUID | None = None, limit: int = Query(COURIERS_PAGE_SIZE, ge=1, le=1000),
+                             db: AsyncSession = Depends(get_async_db)):
+    couriers = await crud_async.get_couriers(db, filters, after, limit)
+    if len(couriers) == limit:
+        response.headers["X-Next-Cursor"] = str(couriers[-1].id)
+    return couriers
+
+
+@async_router.get("/couriers/stream", tags=[Tags.couriers], summary="Выгрузка курьеров потоком NDJSON",
+                  response_class=StreamingResponse, description=inspect.cleandoc(stream_couriers.__doc__))
+async def stream_couriers_async(filters: schemas.CourierFilters = Depends(), db: AsyncSession = Depends(get_async_db)):
+    return StreamingResponse(crud_async.stream_couriers(db, filters), media_type="application/x-ndjson")
+
+
+@async_router.get("/courier/{id}", response_model=schemas.Courier, tags=[Tags.couriers],
+                  summary="Получение информации о курьере", description=inspect.cleandoc(get_courier.__doc__))
+async def get_courier_async(id: uuid.UUID, db: AsyncSession = Depends(get_async_db)):
+    db_courier = await crud_async.get_courier(db, id)
+    if db_courier is not None:
+        return db_courier
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Courier does not exist')
+
+
+@async_router.post("/order", response_model=schemas.OrderCreated, tags=[Tags.orders], summary="Публикация заказа",
+                   description=inspect.cleandoc(create_order.__doc__))
+async def create_order_async(order: schemas.OrderIn, response: Response, db: AsyncSession = Depends(get_async_db),
+                             idempotency_key: str | None = Header(None, max_length=255)):
+    async def publish(session: AsyncSession):
+        created = await crud_async.create_order(session, order)
+        return status.HTTP_202_ACCEPTED if created.courier_id is None else status.HTTP_200_OK, created
+
+    if idempotency_key is not None:
+        return await idempotency.respond_async(db, idempotency_key, idempotency.request_hash("POST /order", order),
+                                               publish)
+    response.status_code, created = await publish(db)
+    return created
+
+
+@async_router.post("/orders/batch", response_model=list[schemas.OrderBatchResult], tags=[Tags.orders],
+                   summary="Публикация пакета заказов", description=inspect.cleandoc(create_orders_batch.__doc__))
+async def create_orders_batch_async(orders: list[schemas.OrderIn] = Body(min_length=1, max_length=1000),
+                                    db: AsyncSession = Depends(get_async_db)):
+    return await crud_async.create_orders(db, orders)
+
+
+@async_router.post("/orders/complete", response_model=list[schemas.OrderCompleteResult], tags=[Tags.orders],
+                   summary="Завершение пакета заказов", description=inspect.cleandoc(complete_orders_batch.__doc__))
+async def complete_orders_batch_async(order_ids: list[uuid.UUID] = Body(min_length=1, max_length=1000),
+                                      db: AsyncSession = Depends(get_async_db)):
+    return await crud_async.complete_orders(db, order_ids)
+
+
+@async_router.get("/order/{id}", response_model=schemas.OrderInfo, tags=[Tags.orders],
+                  summary="Получение информации о заказе", description=inspect.cleandoc(get_order.__doc__))
+async def get_order_async(id: uuid.UUID, db: AsyncSession = Depends(get_async_db)):
+    order = await crud_async.get_order_info(db, id)
+    if order is not None:
+        return order
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Order does not exist')
+
+
+@async_router.post("/order/{id}", tags=[Tags.orders], summary="Завершение заказа",
+                   description=inspect.cleandoc(complete_order.__doc__))
+async def complete_order_async(id: uuid.UUID, db: AsyncSession = Depends(get_async_db),
+                               idempotency_key: str | None = Header(None, max_length=255)):
+    async def complete(session: AsyncSession):
+        if await crud_async.complete_order(session, id):
+            return status.HTTP_200_OK, {"message": "OK"}
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail='The order does not exist or has already been completed')
 
+    if idempotency_key is not None:
+        return await idempotency.respond_async(db, idempotency_key, idempotency.request_hash("POST /order/{id}", id),
+                                               complete)
+    return (await complete(db))[1]
+
+
+@async_router.get("/courier/{id}/stats", response_model=schemas.StatsReport, tags=[Tags.analytics],
+                  summary="Статистика курьера по дням", description=inspect.cleandoc(get_courier_stats.__doc__))
+async def get_courier_stats_async(id: uuid.UUID, date_from: datetime.date | None = None,
+                                  date_to: datetime.date | None = None, db: AsyncSession = Depends(get_async_db)):
+    stats = await crud_async.get_courier_stats(db, id, date_from, date_to)
+    if stats is not None:
+        return stats
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Courier does not exist')
+
+
+@async_router.get("/district/{name}/stats", response_model=schemas.StatsReport, tags=[Tags.analytics],
+                  summary="Статистика района по дням", description=inspect.cleandoc(get_district_stats.__doc__))
+async def get_district_stats_async(name: str, date_from: datetime.date | None = None,
+                                   date_to: datetime.date | None = None, db: AsyncSession = Depends(get_async_db)):
+    stats = await crud_async.get_district_stats(db, name, date_from, date_to)
+    if stats is not None:
+        return stats
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='District does not exist')
+
+
+@async_router.get("/orders/pending", response_model=list[schemas.PendingOrders], tags=[Tags.orders],
+                  summary="Очереди заказов, ожидающих курьера", description=inspect.cleandoc(get_pending_orders.__doc__))
+async def get_pending_orders_async(db: AsyncSession = Depends(get_async_db)):
+    return await crud_async.get_pending_orders(db)
+
+
+# режим работы с БД выбирается настройкой DB_ASYNC; данные в памяти обслуживают синхронные обработчики
+app.include_router(async_router if DB_ASYNC and STORAGE_BACKEND == "sql" else router)
+
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
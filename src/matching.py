@@ -0,0 +1,80 @@
+import math
+
+
+def assign(costs: list[list[float | None]]) -> list[int | None]:
+    """
+    Назначение строк (заказов) столбцам (курьерам) с минимальной суммарной стоимостью.
+
+    `costs[i][j]` - стоимость назначения курьера j на заказ i или `None`, если назначение невозможно.
+    В первую очередь максимизируется число назначенных заказов, затем минимизируется суммарная стоимость.
+    Возвращает номер столбца для каждой строки или `None`, если строка осталась без назначения.
+    """
+    rows = len(costs)
+    cols = len(costs[0]) if rows else 0
+    if not rows or not cols:
+        return [None] * rows
+
+    finite = [c for row in costs for c in row if c is not None]
+    # штраф за недопустимую пару больше любой разницы в стоимости, поэтому лишнее назначение всегда выгоднее
+    infeasible = (max(finite, default=0) + 1) * (min(rows, cols) + 1)
+    matrix = [[infeasible if c is None else c for c in row] for row in costs]
+
+    if rows <= cols:
+        assignment = _hungarian(matrix)
+    else:
+        transposed = _hungarian([list(column) for column in zip(*matrix)])
+        assignment = [None] * rows
+        for col, row in enumerate(transposed):
+            assignment[row] = col
+
+    return [col if col is not None and costs[row][col] is not None else None
+            for row, col in enumerate(assignment)]
+
+
+def _hungarian(matrix: list[list[float]]) -> list[int]:
+    # венгерский алгоритм с потенциалами, O(n^2 * m) для n <= m
+    n, m = len(matrix), len(matrix[0])
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    match = [0] * (m + 1)  # match[j] - строка (с 1), назначенная столбцу j
+    way = [0] * (m + 1)
+
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        minv = [math.inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            row = matrix[i0 - 1]
+            delta = math.inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+
+    assignment = [0] * n
+    for j in range(1, m + 1):
+        if match[j]:
+            assignment[match[j] - 1] = j - 1
+    return assignment
@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .config import METRICS_ENABLED, SLOW_REQUEST_MS, SLOW_REQUEST_STATEMENTS
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestStats:
+    """Счетчики SQL текущего запроса; хранятся в contextvar и доступны потоку, в котором выполняется обработчик."""
+
+    __slots__ = ("statements", "db_time", "rows", "captured")
+
+    def __init__(self, capture: bool = False):
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.captured: list[tuple[float, str]] | None = [] if capture else None
+
+
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_request.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request.get()
+    if stats is None or not conn.info.get("query_start"):
+        return
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats.statements += 1
+    stats.db_time += elapsed
+    # для SELECT psycopg2 и asyncpg возвращают число выбранных строк, для DML - число измененных
+    stats.rows += max(cursor.rowcount or 0, 0)
+    if stats.captured is not None and len(stats.captured) < SLOW_REQUEST_STATEMENTS:
+        stats.captured.append((elapsed, " ".join(statement.split())))
+
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя ячейка - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Метрики запросов по маршрутам в памяти процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: dict[tuple, int] = {}  # (method, route, status) -> число запросов
+        self.latency: dict[tuple, Histogram] = {}  # (method, route) -> длительность запроса
+        self.statements: dict[tuple, Histogram] = {}  # (method, route) -> SQL-запросов на один запрос
+        self.db_time: dict[tuple, float] = {}
+        self.rows: dict[tuple, int] = {}
+
+    def observe(self, method: str, route: str, status: int, duration: float, stats: RequestStats) -> None:
+        key = (method, route)
+        with self._lock:
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(duration)
+            self.statements.setdefault(key, Histogram(STATEMENT_BUCKETS)).observe(stats.statements)
+            self.db_time[key] = self.db_time.get(key, 0.0) + stats.db_time
+            self.rows[key] = self.rows.get(key, 0) + stats.rows
+
+    def clear(self) -> None:
+        with self._lock:
+            for values in (self.requests, self.latency, self.statements, self.db_time, self.rows):
+                values.clear()
+
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus."""
+        lines = []
+        with self._lock:
+            lines += ["# HELP http_requests_total Number of HTTP requests.",
+                      "# TYPE http_requests_total counter"]
+            for (method, route, status), value in self.requests.items():
+                lines.append(f'http_requests_total{{{_labels(method, route)},status="{status}"}} {value}')
+            _render_histograms(lines, "http_request_duration_seconds", "HTTP request latency.", self.latency)
+            _render_histograms(lines, "db_statements_per_request", "SQL statements issued per HTTP request.",
+                               self.statements)
+            lines += ["# HELP db_time_seconds_total Time spent executing SQL statements.",
+                      "# TYPE db_time_seconds_total counter"]
+            for (method, route), value in self.db_time.items():
+                lines.append(f"db_time_seconds_total{{{_labels(method, route)}}} {value:.6f}")
+            lines += ["# HELP db_rows_total Rows returned or affected by SQL statements.",
+                      "# TYPE db_rows_total counter"]
+            for (method, route), value in self.rows.items():
+                lines.append(f"db_rows_total{{{_labels(method, route)}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(method: str, route: str) -> str:
+    route = route.replace("\\", "\\\\").replace('"', '\\"')
+    return f'method="{method}",route="{route}"'
+
+
+def _render_histograms(lines: list, name: str, help: str, histograms: dict) -> None:
+    lines += [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+    for (method, route), histogram in histograms.items():
+        labels = _labels(method, route)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+
+registry = Registry()
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: считает длительность запроса и SQL-запросы, выполненные при его обработке.
+    Маршрут берется из шаблона пути FastAPI (`/courier/{id}`), поэтому число меток не зависит от id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(capture=SLOW_REQUEST_MS > 0)
+        token = current_request.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            current_request.reset(token)
+            route = getattr(scope.get("route"), "path", "<unmatched>")
+            registry.observe(scope["method"], route, status_code, duration, stats)
+            if SLOW_REQUEST_MS and duration * 1000 >= SLOW_REQUEST_MS:
+                log_slow_request(scope["method"], scope["path"], status_code, duration, stats)
+
+
+def log_slow_request(method: str, path: str, status: int, duration: float, stats: RequestStats) -> None:
+    statements = "".join(f"\n  {elapsed * 1000:.1f} ms: {statement}" for elapsed, statement in stats.captured or ())
+    logger.warning("Slow request %s %s -> %s: %.1f ms, %d SQL statements, %.1f ms in DB, %d rows%s",
+                   method, path, status, duration * 1000, stats.statements, stats.db_time * 1000, stats.rows,
+                   statements)
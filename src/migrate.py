@@ -0,0 +1,74 @@
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.pool import NullPool
+
+from .database import SQLALCHEMY_DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_LOCK = 0x6d69677261746521  # ключ advisory-блокировки: миграции выполняет одна реплика за раз
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+
+
+class SchemaOutdated(RuntimeError):
+    pass
+
+
+def alembic_config() -> Config:
+    config = Config(str(ALEMBIC_INI))
+    config.set_main_option("script_location", str(ALEMBIC_INI.parent / "alembic"))
+    return config
+
+
+def ensure_schema(upgrade: bool = True, url: str = SQLALCHEMY_DATABASE_URL) -> tuple[str, ...]:
+    """
+    Сверяет версию схемы БД с последней миграцией и, если `upgrade`, применяет недостающие миграции.
+    Реплики, стартующие одновременно, ждут друг друга на advisory-блокировке, поэтому миграции
+    выполняются один раз. Новые миграции не генерируются. Возвращает версию схемы после проверки.
+    """
+    config = alembic_config()
+    heads = set(ScriptDirectory.from_config(config).get_heads())
+    engine = create_engine(url, poolclass=NullPool)
+    try:
+        with engine.connect() as connection:
+            connection.execute(select(func.pg_advisory_lock(MIGRATION_LOCK)))
+            connection.commit()  # блокировка уровня сессии сохраняется до закрытия соединения
+            current = set(MigrationContext.configure(connection).get_current_heads())
+            # чтение версии начинает транзакцию; миграции управляют транзакциями сами
+            # (CREATE INDEX CONCURRENTLY выполняется в autocommit_block), поэтому ее нужно закрыть
+            connection.commit()
+            if current != heads:
+                if not upgrade:
+                    raise SchemaOutdated(f"Database schema is at {sorted(current) or 'base'}, "
+                                         f"expected {sorted(heads)}; run `python -m src.migrate`")
+                logger.info("Upgrading database schema from %s to %s", sorted(current) or "base", sorted(heads))
+                config.attributes["connection"] = connection
+                command.upgrade(config, "heads")
+                current = set(MigrationContext.configure(connection).get_current_heads())
+            connection.execute(select(func.pg_advisory_unlock(MIGRATION_LOCK)))
+            connection.commit()
+    finally:
+        engine.dispose()
+    return tuple(sorted(current))
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m src.migrate", description="Проверка и обновление схемы БД")
+    parser.add_argument("--check", action="store_true", help="только проверить версию схемы, не применяя миграции")
+    args = parser.parse_args(argv)
+    try:
+        print(f"Database schema is up to date: {', '.join(ensure_schema(upgrade=not args.check))}")
+    except SchemaOutdated as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, UUID, String, DateTime, Float, ForeignKey
+from sqlalchemy import Column, Integer, UUID, String, Text, DateTime, Date, Float, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.functions import now
 
@@ -12,8 +12,14 @@ class Courier(Base):
     name = Column(String)
     avg_order_complete_time = Column(Integer, default=0)
     avg_day_orders = Column(Integer, default=0)
+    completed_orders = Column(Integer, default=0)
+    total_complete_time = Column(Float, default=0)
+    work_days = Column(Integer, default=0)
 
     orders = relationship("Order", back_populates="courier")
+    # заказ в работе (status = 1); уникальный индекс ix_orders_active_courier гарантирует не больше одного
+    active_order = relationship("Order", primaryjoin="and_(Courier.id == foreign(Order.courier_id), Order.status == 1)",
+                                uselist=False, viewonly=True)
     courier_districts = relationship("District", back_populates="district_couriers", secondary="couriers_districts")
 
 
@@ -37,13 +43,91 @@ class Order(Base):
     status = Column(Integer)
     date_publication = Column(DateTime, default=now())
     date_completion = Column(DateTime, default=None)
+    date_assignment = Column(DateTime, default=None)
+    latitude = Column(Float)  # координаты адреса заказа, необязательные
+    longitude = Column(Float)
 
     district = relationship("District", back_populates="orders")
     courier = relationship("Courier", back_populates="orders")
 
+    __table_args__ = (
+        # не больше одного заказа в работе (status = 1) у курьера; индекс же обслуживает поиск активного заказа
+        Index("ix_orders_active_courier", courier_id, unique=True, postgresql_where=(status == 1)),
+        Index("ix_orders_district_id_status", district_id, status),
+        # очередь заказов, ожидающих курьера (status = 0), по району в порядке публикации
+        Index("ix_orders_pending", district_id, date_publication, postgresql_where=(status == 0)),
+        # поиск завершенных заказов для переноса в архив
+        Index("ix_orders_completed", date_completion, postgresql_where=(status == 2)),
+    )
+
+
+class OrderArchive(Base):
+    """Завершенные заказы, перенесенные из orders, чтобы рабочая таблица оставалась небольшой."""
+    __tablename__ = "orders_archive"
+
+    id = Column(UUID, primary_key=True)
+    name = Column(String)
+    district_id = Column(UUID, ForeignKey("districts.id"))
+    courier_id = Column(UUID, ForeignKey("couriers.id"))
+    status = Column(Integer)
+    date_publication = Column(DateTime)
+    date_completion = Column(DateTime)
+    date_assignment = Column(DateTime)
+    latitude = Column(Float)
+    longitude = Column(Float)
+
 
 class CourierDistrict(Base):
     __tablename__ = "couriers_districts"
 
     courier_id = Column(UUID, ForeignKey("couriers.id"), primary_key=True)
     district_id = Column(UUID, ForeignKey("districts.id"), primary_key=True)
+
+    __table_args__ = (
+        Index("ix_couriers_districts_district_id", district_id, courier_id),
+    )
+
+
+class CourierLocation(Base):
+    __tablename__ = "courier_locations"
+
+    courier_id = Column(UUID, ForeignKey("couriers.id"), primary_key=True)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    updated_at = Column(DateTime)
+
+
+class CourierDailyStats(Base):
+    __tablename__ = "courier_daily_stats"
+
+    courier_id = Column(UUID, ForeignKey("couriers.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    orders_count = Column(Integer, default=0)
+    total_seconds = Column(Float, default=0)  # суммарное время выполнения заказов за день
+    min_seconds = Column(Float)
+    max_seconds = Column(Float)
+
+
+class DistrictDailyStats(Base):
+    __tablename__ = "district_daily_stats"
+
+    district_id = Column(UUID, ForeignKey("districts.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    orders_count = Column(Integer, default=0)
+    total_seconds = Column(Float, default=0)
+    min_seconds = Column(Float)
+    max_seconds = Column(Float)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    request_hash = Column(String)  # запрос, для которого сохранен ответ
+    status_code = Column(Integer)
+    response = Column(Text)  # тело ответа в JSON
+    expires_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_idempotency_keys_expires_at", expires_at),
+    )
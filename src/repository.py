@@ -0,0 +1,476 @@
+import bisect
+import datetime
+import json
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+
+from . import crud, idempotency, locations, schemas
+from .config import DISPATCH_MODE, ORDER_QUEUE_ENABLED
+from .crud import Status
+from .database import get_session
+from .dispatch import DispatchIndex, dispatch_index, pick_courier
+from .districts import normalize
+from .events import publish
+from .geo import GridIndex
+from .strategies import StrategySelector, strategy_selector
+
+STREAM_PAGE_SIZE = 1000
+
+
+class Repository(ABC):
+    """
+    Операции над курьерами, заказами и статистикой, которые вызывают обработчики main.py.
+    Реализация выбирается настройкой STORAGE_BACKEND: `SqlRepository` (PostgreSQL) или `MemoryRepository`.
+    """
+
+    @abstractmethod
+    def create_couriers(self, couriers: list[schemas.CourierIn]) -> list[schemas.CourierBase]:
+        """Регистрирует курьеров и их районы, возвращает их в порядке запроса."""
+
+    def create_courier(self, courier: schemas.CourierIn) -> schemas.CourierBase:
+        return self.create_couriers([courier])[0]
+
+    @abstractmethod
+    def get_couriers(self, filters: schemas.CourierFilters = schemas.CourierFilters(),
+                     after: uuid.UUID | None = None, limit: int | None = None) -> list:
+        """Страница курьеров после `after`: элементы с полями id и name, порядок - по id."""
+
+    @abstractmethod
+    def stream_couriers(self, filters: schemas.CourierFilters):
+        """Строки NDJSON с полями id и name всех курьеров, подходящих под фильтры."""
+
+    @abstractmethod
+    def get_courier(self, id: uuid.UUID) -> schemas.Courier | None:
+        """Курьер с активным заказом и средними показателями; None - курьер не найден."""
+
+    @abstractmethod
+    def known_couriers(self, courier_ids) -> set[uuid.UUID]:
+        """Зарегистрированные курьеры из переданных id."""
+
+    @abstractmethod
+    def update_location(self, courier_id: uuid.UUID, latitude: float, longitude: float) -> None:
+        """Запоминает последние координаты курьера."""
+
+    @abstractmethod
+    def create_order(self, order: schemas.OrderIn) -> schemas.OrderCreated:
+        """Создает заказ и назначает свободного курьера района (или ставит заказ в очередь)."""
+
+    @abstractmethod
+    def create_orders(self, orders: list[schemas.OrderIn]) -> list[schemas.OrderBatchResult]:
+        """Создает заказы пакетом, возвращает результат для каждого заказа в порядке запроса."""
+
+    @abstractmethod
+    def get_order_info(self, order_id: uuid.UUID) -> schemas.OrderInfo | None:
+        """Статус и курьер заказа; None - заказ не найден."""
+
+    @abstractmethod
+    def complete_orders(self, order_ids: list[uuid.UUID]) -> list[schemas.OrderCompleteResult]:
+        """Завершает заказы и освобождает курьеров, возвращает результат для каждого id в порядке запроса."""
+
+    def complete_order(self, order_id: uuid.UUID):
+        return True if self.complete_orders([order_id])[0].completed else None
+
+    @abstractmethod
+    def get_pending_orders(self) -> list[schemas.PendingOrders]:
+        """Число заказов, ожидающих курьера, и наибольшее время ожидания по районам."""
+
+    @abstractmethod
+    def get_courier_stats(self, courier_id: uuid.UUID, date_from: datetime.date | None = None,
+                          date_to: datetime.date | None = None) -> schemas.StatsReport | None:
+        """Статистика курьера за период по дневным агрегатам; None - курьер не найден."""
+
+    @abstractmethod
+    def get_district_stats(self, district_name: str, date_from: datetime.date | None = None,
+                           date_to: datetime.date | None = None) -> schemas.StatsReport | None:
+        """Статистика района за период по дневным агрегатам; None - район не найден."""
+
+    @abstractmethod
+    def respond(self, key: str, fingerprint: str, call) -> JSONResponse:
+        """Ответ на запрос с заголовком Idempotency-Key, см. idempotency.respond."""
+
+
+class SqlRepository(Repository):
+    """Функции crud в рамках сессии запроса; без сессии доступны только положения курьеров."""
+
+    def __init__(self, db: Session | None):
+        self.db = db
+
+    def create_couriers(self, couriers: list[schemas.CourierIn]) -> list[schemas.CourierBase]:
+        return crud.create_couriers(self.db, couriers)
+
+    def get_couriers(self, filters: schemas.CourierFilters = schemas.CourierFilters(),
+                     after: uuid.UUID | None = None, limit: int | None = None) -> list:
+        return crud.get_couriers(self.db, filters, after, limit)
+
+    def stream_couriers(self, filters: schemas.CourierFilters):
+        return crud.stream_couriers(self.db, filters)
+
+    def get_courier(self, id: uuid.UUID) -> schemas.Courier | None:
+        return crud.get_courier(self.db, id)
+
+    def known_couriers(self, courier_ids) -> set[uuid.UUID]:
+        if DISPATCH_MODE != "locking":
+            return {courier_id for courier_id in courier_ids if dispatch_index.has_courier(courier_id)}
+        # в режиме locking индекса курьеров нет - проверяем одним запросом к БД
+        db = self.db if self.db is not None else get_session()
+        try:
+            return crud.get_existing_couriers(db, courier_ids)
+        finally:
+            if db is not self.db:
+                db.close()
+
+    def update_location(self, courier_id: uuid.UUID, latitude: float, longitude: float) -> None:
+        locations.update_location(courier_id, latitude, longitude)
+
+    def create_order(self, order: schemas.OrderIn) -> schemas.OrderCreated:
+        return crud.create_order(self.db, order)
+
+    def create_orders(self, orders: list[schemas.OrderIn]) -> list[schemas.OrderBatchResult]:
+        return crud.create_orders(self.db, orders)
+
+    def get_order_info(self, order_id: uuid.UUID) -> schemas.OrderInfo | None:
+        return crud.get_order_info(self.db, order_id)
+
+    def complete_orders(self, order_ids: list[uuid.UUID]) -> list[schemas.OrderCompleteResult]:
+        return crud.complete_orders(self.db, order_ids)
+
+    def complete_order(self, order_id: uuid.UUID):
+        return crud.complete_order(self.db, order_id)
+
+    def get_pending_orders(self) -> list[schemas.PendingOrders]:
+        return crud.get_pending_orders(self.db)
+
+    def get_courier_stats(self, courier_id: uuid.UUID, date_from: datetime.date | None = None,
+                          date_to: datetime.date | None = None) -> schemas.StatsReport | None:
+        return crud.get_courier_stats(self.db, courier_id, date_from, date_to)
+
+    def get_district_stats(self, district_name: str, date_from: datetime.date | None = None,
+                           date_to: datetime.date | None = None) -> schemas.StatsReport | None:
+        return crud.get_district_stats(self.db, district_name, date_from, date_to)
+
+    def respond(self, key: str, fingerprint: str, call) -> JSONResponse:
+        def call_in(db: Session):
+            # операции репозитория выполняются в транзакции захвата ключа, ее коммитит idempotency.respond
+            request_db, self.db = self.db, db
+            try:
+                return call()
+            finally:
+                self.db = request_db
+
+        return idempotency.respond(self.db, key, fingerprint, call_in)
+
+
+@dataclass(slots=True)
+class OrderRecord:
+    id: uuid.UUID
+    name: str
+    district_id: uuid.UUID
+    date_publication: datetime.datetime
+    courier_id: uuid.UUID | None = None
+    status: int = Status.PENDING
+    date_assignment: datetime.datetime | None = None
+    date_completion: datetime.datetime | None = None
+    latitude: float | None = None
+    longitude: float | None = None
+
+
+@dataclass(slots=True)
+class CourierRecord:
+    id: uuid.UUID
+    name: str
+    district_ids: tuple[uuid.UUID, ...]
+    avg_order_complete_time: int = 0
+    avg_day_orders: int = 0
+    completed_orders: int = 0
+    total_complete_time: float = 0.0
+    work_days: int = 0
+    active_order: OrderRecord | None = None
+
+
+@dataclass(slots=True)
+class DailyStatsRecord:
+    day: datetime.date
+    orders_count: int = 0
+    total_seconds: float = 0.0
+    min_seconds: float | None = None
+    max_seconds: float | None = None
+
+    def add(self, seconds: float) -> None:
+        self.orders_count += 1
+        self.total_seconds += seconds
+        self.min_seconds = seconds if self.min_seconds is None else min(self.min_seconds, seconds)
+        self.max_seconds = seconds if self.max_seconds is None else max(self.max_seconds, seconds)
+
+
+class MemoryRepository(Repository):
+    """
+    Данные в памяти процесса, без БД. Записи - классы со `__slots__`, доступ по словарям:
+    курьеры и заказы по id, районы по имени, курьеры района и все курьеры - отсортированными списками id
+    (постраничная выдача по курсору), очереди заказов - по районам.
+
+    Поведение совпадает с SqlRepository в режиме DISPATCH_MODE=index: тот же `DispatchIndex` и стратегии
+    выбора курьера, один заказ в работе на курьера, районы без дубликатов, та же дневная статистика
+    и средние показатели курьеров. Кэш и архив не нужны; события рассылаются сразу подписчикам процесса.
+    Операции выполняются под одной блокировкой, поэтому каждая атомарна, как транзакция.
+    """
+
+    def __init__(self, queue: bool = ORDER_QUEUE_ENABLED, selector: StrategySelector = strategy_selector,
+                 clock=datetime.datetime.now):
+        self.queue = queue
+        self.selector = selector
+        self._clock = clock
+        self._lock = threading.RLock()
+        self.index = DispatchIndex()
+        self.grid = GridIndex()
+        self.keys = idempotency.KeyStore()
+        self._district_ids: dict[str, uuid.UUID] = {}
+        self._district_names: dict[uuid.UUID, str] = {}
+        self._couriers: dict[uuid.UUID, CourierRecord] = {}
+        self._courier_ids: list[uuid.UUID] = []
+        self._district_couriers: dict[uuid.UUID, list[uuid.UUID]] = {}
+        self._orders: dict[uuid.UUID, OrderRecord] = {}
+        self._pending: dict[uuid.UUID, deque[OrderRecord]] = {}  # очередь района по времени публикации
+        self._courier_stats: dict[uuid.UUID, dict[datetime.date, DailyStatsRecord]] = {}
+        self._district_stats: dict[uuid.UUID, dict[datetime.date, DailyStatsRecord]] = {}
+
+    def create_couriers(self, couriers: list[schemas.CourierIn]) -> list[schemas.CourierBase]:
+        with self._lock:
+            created, touched = [], set()
+            for courier_in in couriers:
+                district_ids = tuple(sorted({self._get_or_create_district(name) for name in courier_in.districts}))
+                courier = CourierRecord(id=uuid.uuid4(), name=courier_in.name, district_ids=district_ids)
+                self._couriers[courier.id] = courier
+                self._courier_ids.append(courier.id)
+                for district_id in district_ids:
+                    self._district_couriers.setdefault(district_id, []).append(courier.id)
+                touched.update(district_ids)
+                # новые курьеры сразу разбирают очереди своих районов
+                busy = self.queue and self._assign_pending(courier)
+                self.index.add_courier(courier.id, 0, district_ids, idle=not busy)
+                created.append(schemas.CourierBase(id=courier.id, name=courier.name))
+            if created:
+                # новые id добавлены в конец; сортировка почти упорядоченного списка линейна
+                self._courier_ids.sort()
+                for district_id in touched:
+                    self._district_couriers[district_id].sort()
+            return created
+
+    def get_couriers(self, filters: schemas.CourierFilters = schemas.CourierFilters(),
+                     after: uuid.UUID | None = None, limit: int | None = None) -> list[schemas.CourierBase]:
+        with self._lock:
+            if filters.district is not None:
+                ids = self._district_couriers.get(self._district_ids.get(normalize(filters.district)), [])
+            else:
+                ids = self._courier_ids
+            busy = filters.state == schemas.CourierState.busy
+            result = []
+            for position in range(bisect.bisect_right(ids, after) if after is not None else 0, len(ids)):
+                courier = self._couriers[ids[position]]
+                if filters.state is None or (courier.active_order is not None) == busy:
+                    result.append(schemas.CourierBase(id=courier.id, name=courier.name))
+                    if len(result) == limit:
+                        break
+            return result
+
+    def stream_couriers(self, filters: schemas.CourierFilters):
+        # страницами по курсору: блокировка не удерживается, пока клиент читает ответ
+        after = None
+        while True:
+            page = self.get_couriers(filters, after, STREAM_PAGE_SIZE)
+            for courier in page:
+                yield json.dumps({"id": str(courier.id), "name": courier.name}, ensure_ascii=False) + "\n"
+            if len(page) < STREAM_PAGE_SIZE:
+                return
+            after = page[-1].id
+
+    def get_courier(self, id: uuid.UUID) -> schemas.Courier | None:
+        courier = self._couriers.get(id)
+        if courier is None:
+            return None
+        active_order = courier.active_order
+        return schemas.Courier(id=courier.id, name=courier.name,
+                               avg_order_complete_time=courier.avg_order_complete_time,
+                               avg_day_orders=courier.avg_day_orders,
+                               active_order={"order_id": active_order.id, "order_name": active_order.name}
+                               if active_order is not None else None)
+
+    def known_couriers(self, courier_ids) -> set[uuid.UUID]:
+        return {courier_id for courier_id in courier_ids if courier_id in self._couriers}
+
+    def update_location(self, courier_id: uuid.UUID, latitude: float, longitude: float) -> None:
+        self.grid.update(courier_id, latitude, longitude)
+
+    def create_order(self, order: schemas.OrderIn) -> schemas.OrderCreated:
+        with self._lock:
+            district_id = self._district_ids.get(normalize(order.district))
+            if district_id is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No suitable courier found')
+            strategy = self.selector.for_district(order.district)
+            courier_id = pick_courier(self.index, district_id, strategy, order.latitude, order.longitude, self.grid)
+            if courier_id is None and not self.queue:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No suitable courier found')
+            db_order = self._add_order(order, district_id, courier_id)
+            return schemas.OrderCreated(order_id=db_order.id, courier_id=courier_id, status=db_order.status)
+
+    def create_orders(self, orders: list[schemas.OrderIn]) -> list[schemas.OrderBatchResult]:
+        with self._lock:
+            results = [schemas.OrderBatchResult(index=i) for i in range(len(orders))]
+            positions, targets = [], []
+            for i, order in enumerate(orders):
+                district_id = self._district_ids.get(normalize(order.district))
+                if district_id is None:
+                    results[i].reason = 'District not found'
+                else:
+                    positions.append(i)
+                    targets.append(district_id)
+
+            # курьеры подбираются сразу на весь пакет с минимальным суммарным временем выполнения
+            for i, district_id, courier_id in zip(positions, targets, self.index.pop_batch(targets)):
+                if courier_id is None and not self.queue:
+                    results[i].reason = 'No suitable courier found'
+                    continue
+                db_order = self._add_order(orders[i], district_id, courier_id)
+                results[i].order_id, results[i].courier_id, results[i].status = db_order.id, courier_id, db_order.status
+            return results
+
+    def get_order_info(self, order_id: uuid.UUID) -> schemas.OrderInfo | None:
+        order = self._orders.get(order_id)
+        if order is None:
+            return None
+        return schemas.OrderInfo(courier_id=order.courier_id, status=order.status)
+
+    def complete_orders(self, order_ids: list[uuid.UUID]) -> list[schemas.OrderCompleteResult]:
+        with self._lock:
+            date_completion = self._clock()
+            done, results = set(), []
+            for order_id in order_ids:
+                order = self._orders.get(order_id)
+                if order_id in done:
+                    results.append(schemas.OrderCompleteResult(order_id=order_id, completed=True))
+                elif order is None:
+                    results.append(schemas.OrderCompleteResult(order_id=order_id, reason="Order does not exist"))
+                elif order.status == Status.PENDING:
+                    results.append(schemas.OrderCompleteResult(order_id=order_id, reason="Order has no courier yet"))
+                elif order.status == Status.COMPLETED:
+                    results.append(schemas.OrderCompleteResult(order_id=order_id,
+                                                               reason="Order has already been completed"))
+                else:
+                    self._complete(order, date_completion)
+                    done.add(order_id)
+                    results.append(schemas.OrderCompleteResult(order_id=order_id, completed=True))
+            return results
+
+    def get_pending_orders(self) -> list[schemas.PendingOrders]:
+        with self._lock:
+            now = self._clock()
+            return sorted((schemas.PendingOrders(district=self._district_names[district_id],
+                                                 pending_orders=len(pending),
+                                                 max_wait_time=max((now - pending[0].date_publication).total_seconds(),
+                                                                   0))
+                           for district_id, pending in self._pending.items() if pending),
+                          key=lambda row: row.district)
+
+    def get_courier_stats(self, courier_id: uuid.UUID, date_from: datetime.date | None = None,
+                          date_to: datetime.date | None = None) -> schemas.StatsReport | None:
+        with self._lock:
+            if courier_id not in self._couriers:
+                return None
+            return _stats_report(self._courier_stats.get(courier_id, {}), date_from, date_to)
+
+    def get_district_stats(self, district_name: str, date_from: datetime.date | None = None,
+                           date_to: datetime.date | None = None) -> schemas.StatsReport | None:
+        with self._lock:
+            district_id = self._district_ids.get(normalize(district_name))
+            if district_id is None:
+                return None
+            return _stats_report(self._district_stats.get(district_id, {}), date_from, date_to)
+
+    def respond(self, key: str, fingerprint: str, call) -> JSONResponse:
+        return self.keys.respond(key, fingerprint, call)
+
+    def _get_or_create_district(self, name: str) -> uuid.UUID:
+        name = normalize(name)
+        district_id = self._district_ids.get(name)
+        if district_id is None:
+            district_id = self._district_ids[name] = uuid.uuid4()
+            self._district_names[district_id] = name
+        return district_id
+
+    def _add_order(self, order: schemas.OrderIn, district_id: uuid.UUID, courier_id: uuid.UUID | None) -> OrderRecord:
+        db_order = OrderRecord(id=uuid.uuid4(), name=order.name, district_id=district_id,
+                               date_publication=self._clock(), latitude=order.latitude, longitude=order.longitude)
+        self._orders[db_order.id] = db_order
+        if courier_id is None:
+            # свободных курьеров нет - заказ ждет в очереди района, его получит первый освободившийся курьер
+            self._pending.setdefault(district_id, deque()).append(db_order)
+            publish("order_pending", db_order.id, status=Status.PENDING)
+        else:
+            self._assign(db_order, self._couriers[courier_id])
+        return db_order
+
+    def _assign(self, order: OrderRecord, courier: CourierRecord) -> None:
+        order.courier_id = courier.id
+        order.status = Status.IN_PROGRESS
+        order.date_assignment = self._clock()
+        courier.active_order = order
+        publish("order_assigned", order.id, courier.id, Status.IN_PROGRESS)
+
+    def _assign_pending(self, courier: CourierRecord) -> bool:
+        # самый старый заказ из очередей районов курьера
+        oldest = None
+        for district_id in courier.district_ids:
+            pending = self._pending.get(district_id)
+            if pending and (oldest is None or (pending[0].date_publication, pending[0].id)
+                            < (oldest[0].date_publication, oldest[0].id)):
+                oldest = pending
+        if oldest is None:
+            return False
+        self._assign(oldest.popleft(), courier)
+        return True
+
+    def _complete(self, order: OrderRecord, date_completion: datetime.datetime) -> None:
+        order.status = Status.COMPLETED
+        order.date_completion = date_completion
+        # время выполнения считается с момента назначения курьера (заказ мог ждать в очереди)
+        seconds = (date_completion - (order.date_assignment or order.date_publication)).total_seconds()
+        day = order.date_publication.date()
+
+        courier = self._couriers[order.courier_id]
+        courier.active_order = None
+        courier_days = self._courier_stats.setdefault(courier.id, {})
+        if day not in courier_days:
+            courier_days[day] = DailyStatsRecord(day)
+            courier.work_days += 1
+        courier_days[day].add(seconds)
+        district_days = self._district_stats.setdefault(order.district_id, {})
+        district_days.setdefault(day, DailyStatsRecord(day)).add(seconds)
+
+        courier.completed_orders += 1
+        courier.total_complete_time += seconds
+        courier.avg_order_complete_time = round(courier.total_complete_time / courier.completed_orders)
+        courier.avg_day_orders = courier.completed_orders // courier.work_days
+        publish("order_completed", order.id, courier.id, Status.COMPLETED)
+
+        # курьер, получивший заказ из очереди, остается занятым, но с новыми показателями
+        self.index.release(courier.id, courier.avg_order_complete_time, courier.avg_day_orders,
+                           completion_seconds=seconds)
+        if self.queue and self._assign_pending(courier):
+            self.index.discard(courier.id)
+
+
+def _stats_report(days: dict[datetime.date, DailyStatsRecord], date_from: datetime.date | None,
+                  date_to: datetime.date | None) -> schemas.StatsReport:
+    rows = sorted((row for day, row in days.items()
+                   if (date_from is None or day >= date_from) and (date_to is None or day <= date_to)),
+                  key=lambda row: row.day)
+    return crud.stats_report(rows, date_from, date_to)
+
+
+memory_repository = MemoryRepository()
@@ -1,7 +1,8 @@
 import uuid
-from datetime import timedelta
+from datetime import date, timedelta
+from enum import Enum
 
-from pydantic import BaseModel, UUID4, Field, field_validator
+from pydantic import BaseModel, UUID4, Field, field_validator, model_validator
 
 
 class DistrictBase(BaseModel):
@@ -17,12 +18,29 @@ class OrderBase(BaseModel):
 
 
 class OrderInfo(BaseModel):
-    courier_id: uuid.UUID
+    courier_id: uuid.UUID | None
     status: int
 
 
+class Location(BaseModel):
+    latitude: float = Field(examples=[55.7558], ge=-90, le=90)
+    longitude: float = Field(examples=[37.6173], ge=-180, le=180)
+
+
+class CourierLocation(Location):
+    courier_id: uuid.UUID
+
+
 class OrderIn(OrderBase):
     district: str = Field(examples=["district"], min_length=1)
+    latitude: float | None = Field(None, ge=-90, le=90)
+    longitude: float | None = Field(None, ge=-180, le=180)
+
+    @model_validator(mode="after")
+    def validate_coordinates(self):
+        if (self.latitude is None) != (self.longitude is None):
+            raise ValueError("latitude and longitude must be passed together")
+        return self
 
 
 class OrderOut(BaseModel):
@@ -32,7 +50,28 @@ class OrderOut(BaseModel):
 
 class OrderCreated(BaseModel):
     order_id: uuid.UUID
-    courier_id: uuid.UUID
+    courier_id: uuid.UUID | None
+    status: int = 1
+
+
+class OrderBatchResult(BaseModel):
+    index: int
+    order_id: uuid.UUID | None = None
+    courier_id: uuid.UUID | None = None
+    status: int | None = None
+    reason: str | None = None
+
+
+class OrderCompleteResult(BaseModel):
+    order_id: uuid.UUID
+    completed: bool = False
+    reason: str | None = None
+
+
+class PendingOrders(BaseModel):
+    district: str
+    pending_orders: int
+    max_wait_time: float
 
 
 class CourierBase(BaseModel):
@@ -40,11 +79,29 @@ class CourierBase(BaseModel):
     name: str
 
 
+class CourierState(str, Enum):
+    idle = "idle"
+    busy = "busy"
+
+
+class CourierFilters(BaseModel):
+    district: str | None = None
+    state: CourierState | None = None
+
+
 class CourierIn(BaseModel):
     name: str = Field(examples=["Courier Name"], min_length=1)
     districts: list[str] = Field(examples=[["district name one", "district name two", "district name three"]], min_length=1)
 
 
+class CourierBulkResult(BaseModel):
+    index: int
+    status: str
+    id: uuid.UUID | None = None
+    name: str | None = None
+    errors: list[str] | None = None
+
+
 class Courier(CourierBase):
     active_order: OrderOut | None = None
     avg_order_complete_time: timedelta | None
@@ -53,3 +110,24 @@ class Courier(CourierBase):
     @field_validator("avg_order_complete_time")
     def validate_avg_order_complete_time(cls, v):
         return str(v)
+
+
+class DailyStats(BaseModel):
+    day: date
+    orders_count: int
+    total_complete_time: float
+    avg_complete_time: float | None
+    min_complete_time: float | None
+    max_complete_time: float | None
+
+
+class StatsReport(BaseModel):
+    date_from: date | None
+    date_to: date | None
+    orders_count: int
+    work_days: int
+    avg_complete_time: float | None
+    min_complete_time: float | None
+    max_complete_time: float | None
+    avg_day_orders: float | None
+    days: list[DailyStats]
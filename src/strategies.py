@@ -0,0 +1,142 @@
+from abc import ABC, abstractmethod
+from typing import NamedTuple
+
+import numpy as np
+
+from .config import DISPATCH_STRATEGY, DISPATCH_STRATEGY_DISTRICTS, DISPATCH_WEIGHTS
+from .districts import normalize
+
+
+class Candidates(NamedTuple):
+    """Свободные курьеры района: признаки выровнены по позиции курьера."""
+    avg_complete_time: np.ndarray  # avg_order_complete_time, сек.
+    avg_day_orders: np.ndarray
+    ewma_complete_time: np.ndarray  # экспоненциальное среднее времени выполнения последних заказов, сек.
+    orders_today: np.ndarray  # заказов завершено за сегодня
+    assigned_at: np.ndarray  # время последнего назначения по часам индекса, 0 - не назначался
+    idle_seconds: np.ndarray  # сколько секунд курьер свободен
+
+
+class DispatchStrategy(ABC):
+    """
+    Правило выбора свободного курьера района. `score` оценивает всех кандидатов сразу
+    (операциями над массивами), выбирается курьер с минимальной оценкой.
+    """
+
+    name = ""
+    # выбор совпадает с порядком по avg_order_complete_time: индекс берет курьера из кучи без подсчета оценок
+    by_metric = False
+
+    @abstractmethod
+    def score(self, candidates: Candidates) -> np.ndarray:
+        """Оценки кандидатов: массив той же длины, что и признаки `candidates`, выбирается минимальная."""
+
+    def order_by(self) -> tuple | None:
+        # порядок курьеров в запросе режима locking; None - признаки есть только в памяти процесса,
+        # и курьер выбирается по avg_order_complete_time
+        return None
+
+
+STRATEGIES: dict[str, type[DispatchStrategy]] = {}
+
+
+def register_strategy(cls: type[DispatchStrategy]) -> type[DispatchStrategy]:
+    STRATEGIES[cls.name] = cls
+    return cls
+
+
+@register_strategy
+class Fastest(DispatchStrategy):
+    """Минимальное среднее время выполнения заказа."""
+
+    name = "fastest"
+    by_metric = True
+
+    def score(self, candidates: Candidates) -> np.ndarray:
+        return candidates.avg_complete_time
+
+    def order_by(self) -> tuple:
+        from .models import Courier  # модели импортируются при вызове: симулятор использует стратегии без БД
+        return (Courier.avg_order_complete_time,)
+
+
+@register_strategy
+class MostProductive(DispatchStrategy):
+    """Максимальное среднее число заказов за рабочий день."""
+
+    name = "productive"
+
+    def score(self, candidates: Candidates) -> np.ndarray:
+        return -candidates.avg_day_orders
+
+    def order_by(self) -> tuple:
+        from .models import Courier
+        return Courier.avg_day_orders.desc(), Courier.avg_order_complete_time
+
+
+@register_strategy
+class LeastRecentlyAssigned(DispatchStrategy):
+    """Курьер, дольше всех не получавший заказ в этом процессе: заказы распределяются по кругу."""
+
+    name = "least_recent"
+
+    def score(self, candidates: Candidates) -> np.ndarray:
+        return candidates.assigned_at
+
+
+def _scale(values: np.ndarray) -> np.ndarray:
+    # приведение к [0, 1] среди кандидатов, чтобы веса признаков в разных единицах были сопоставимы
+    low = values.min()
+    spread = values.max() - low
+    return (values - low) / spread if spread > 0 else np.zeros_like(values)
+
+
+@register_strategy
+class Weighted(DispatchStrategy):
+    """
+    Взвешенная сумма: недавнее время выполнения (EWMA) и число заказов за день увеличивают оценку,
+    время простоя уменьшает. Веса задает DISPATCH_WEIGHTS.
+    """
+
+    name = "weighted"
+
+    def __init__(self, time: float = DISPATCH_WEIGHTS.get("time", 1.0), load: float = DISPATCH_WEIGHTS.get("load", 1.0),
+                 idle: float = DISPATCH_WEIGHTS.get("idle", 1.0)):
+        self.time = time
+        self.load = load
+        self.idle = idle
+
+    def score(self, candidates: Candidates) -> np.ndarray:
+        return (self.time * _scale(candidates.ewma_complete_time)
+                + self.load * _scale(candidates.orders_today)
+                - self.idle * _scale(candidates.idle_seconds))
+
+
+class StrategySelector:
+    """Стратегия по умолчанию (DISPATCH_STRATEGY) и стратегии отдельных районов (DISPATCH_STRATEGY_DISTRICTS)."""
+
+    def __init__(self, default: str = DISPATCH_STRATEGY, districts: dict[str, str] = DISPATCH_STRATEGY_DISTRICTS):
+        self.default = default
+        self.districts = {normalize(name): strategy for name, strategy in districts.items()}
+        self._instances: dict[str, DispatchStrategy] = {}
+
+    def get(self, name: str) -> DispatchStrategy:
+        # экземпляры создаются при первом обращении, поэтому стратегии, зарегистрированные
+        # через register_strategy до первого заказа, можно указывать в настройках
+        strategy = self._instances.get(name)
+        if strategy is None:
+            if name not in STRATEGIES:
+                raise ValueError(f"Unknown dispatch strategy {name!r}, expected one of {sorted(STRATEGIES)}")
+            strategy = self._instances[name] = STRATEGIES[name]()
+        return strategy
+
+    def for_district(self, district: str) -> DispatchStrategy:
+        return self.get(self.districts.get(normalize(district), self.default))
+
+    def validate(self) -> None:
+        # опечатка в настройках обнаруживается при запуске воркера, а не ошибкой каждого POST /order
+        for name in {self.default, *self.districts.values()}:
+            self.get(name)
+
+
+strategy_selector = StrategySelector()
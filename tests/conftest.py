@@ -0,0 +1,30 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@pytest.fixture
+def max_statements():
+    """
+    Проверка числа SQL-запросов в блоке `with max_statements(n):` - защита от N+1.
+    Считаются запросы всех движков из любых потоков, поэтому блок должен содержать только проверяемый вызов.
+    """
+
+    @contextmanager
+    def check(limit: int):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(" ".join(statement.split()))
+
+        event.listen(Engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(Engine, "before_cursor_execute", record)
+        assert len(statements) <= limit, f"{len(statements)} statements, expected at most {limit}:\n" + \
+            "\n".join(statements)
+
+    return check
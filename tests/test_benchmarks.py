@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from benchmarks.load import Sample
+from benchmarks.report import build_report, compare, percentile
+from benchmarks.simulate import (SimCourier, SimOrder, Simulator, read_couriers, read_orders, synthetic_couriers,
+                                 synthetic_orders)
+from src.strategies import StrategySelector
+
+
+def test_percentile_nearest_rank():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([7.0], 99) == 7
+    assert percentile([], 50) is None
+
+
+def test_report_and_compare():
+    sample = Sample()
+    for latency in (0.01, 0.02, 0.03):
+        sample.add(latency, 200)
+    sample.add(0.5, 500)
+    sample.add(0.1, None)
+    report = build_report({"get_courier": sample}, elapsed=2, params={})
+
+    row = report["endpoints"]["get_courier"]
+    assert row["requests"] == 5
+    assert row["errors"] == 2
+    assert row["throughput"] == 1.5
+    assert row["statuses"] == {"200": 3, "500": 1}
+    assert row["latency_ms"]["p50"] == 20
+    assert report["total"]["requests"] == 5
+
+    slower = build_report({"get_courier": Sample(latencies=[0.02, 0.04, 0.06])}, elapsed=2, params={})
+    _, regression = compare(report, slower)
+    assert regression
+    _, regression = compare(report, report)
+    assert not regression
+
+
+def test_simulator_queues_orders_without_idle_courier():
+    couriers = [SimCourier(districts=("a",)), SimCourier(districts=("a",), speed=2)]
+    orders = [SimOrder(0, "a", 100), SimOrder(0, "a", 100), SimOrder(10, "a", 100)]
+    report = Simulator(couriers).run(orders)
+    assert report["orders"] == {"published": 3, "assigned": 3, "queued": 1, "rejected": 0, "unserved": 0}
+    # третий заказ ждет первого освободившегося курьера (speed=1, t=100)
+    assert report["queue_delay_s"]["max"] == 90
+    assert report["order_duration_s"]["max"] == 200
+    assert report["simulator"]["events"] == 6
+
+
+def test_simulator_rejects_without_queue():
+    report = Simulator([SimCourier(districts=("a",))], queue=False).run(
+        [SimOrder(0, "a", 100), SimOrder(1, "a", 100), SimOrder(2, "b", 100)])
+    assert report["orders"]["assigned"] == 1
+    assert report["orders"]["rejected"] == 2
+
+
+def test_simulator_requires_sorted_orders():
+    with pytest.raises(ValueError):
+        Simulator([SimCourier(districts=("a",))]).run([SimOrder(10, "a", 1), SimOrder(5, "a", 1)])
+
+
+def test_simulator_synthetic_run_is_deterministic():
+    def run(seed):
+        rng = random.Random(seed)
+        couriers = synthetic_couriers(50, 5, 2, rng, area=(55.75, 37.62, 0.1))
+        orders = synthetic_orders(2000, 5, 300, 600, rng, area=(55.75, 37.62, 0.1))
+        report = Simulator(couriers, StrategySelector("weighted", {})).run(orders)
+        return {name: value for name, value in report.items()
+                if name not in ("simulator", "assignment_latency_us")}
+
+    first = run(1)
+    assert first["orders"]["published"] == first["orders"]["assigned"] == 2000
+    assert first == run(1)
+
+
+def test_read_history_csv(tmp_path):
+    orders = tmp_path / "orders.csv"
+    orders.write_text("published_at,district,duration,latitude,longitude\n"
+                      "2024-01-01T10:00:00,Центральный,600,55.7,37.6\n"
+                      "2024-01-01T10:01:30,Центральный,300,,\n")
+    couriers = tmp_path / "couriers.csv"
+    couriers.write_text("districts,speed,latitude,longitude\nЦентральный;Заречный,1.5,,\n")
+    assert list(read_orders(orders)) == [SimOrder(0, "центральный", 600, 55.7, 37.6),
+                                         SimOrder(90, "центральный", 300)]
+    assert read_couriers(couriers) == [SimCourier(districts=("центральный", "заречный"), speed=1.5)]
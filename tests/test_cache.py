@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src import cache as cache_module
+from src.cache import Cache, LocalCache, MemoryBackend, create_cache
+
+
+def test_local_cache_evicts_least_recently_used():
+    local = LocalCache(maxsize=2, ttl=60)
+    local.set("a", 1)
+    local.set("b", 2)
+    assert local.get("a") == 1
+    local.set("c", 3)
+
+    assert local.get("b") is None
+    assert local.get("a") == 1 and local.get("c") == 3
+    assert local.evictions == 1
+
+
+def test_local_cache_expires_entries():
+    local = LocalCache(maxsize=10, ttl=0.01)
+    local.set("a", 1)
+    time.sleep(0.02)
+    assert local.get("a") is None
+    assert local.evictions == 1
+
+
+def test_cache_reads_through_shared_backend():
+    shared = MemoryBackend(ttl=60)
+    first = Cache(local=LocalCache(maxsize=10, ttl=60), shared=shared)
+    second = Cache(local=LocalCache(maxsize=10, ttl=60), shared=shared)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return {"status": 1}
+
+    assert first.get_or_load("order:1", load) == {"status": 1}
+    assert second.get_or_load("order:1", load) == {"status": 1}  # значение уже есть в общем бэкенде
+    assert len(loads) == 1
+    assert (first.misses, second.hits) == (1, 1)
+
+    first.invalidate("order:1")
+    second.local.delete("order:1")
+    assert second.get_or_load("order:1", lambda: {"status": 2}) == {"status": 2}
+
+
+def test_cache_does_not_store_missing_values():
+    cache = Cache(local=LocalCache(maxsize=10, ttl=60))
+    assert cache.get_or_load("courier:1", lambda: None) is None
+    assert cache.get_or_load("courier:1", lambda: {"id": "1"}) == {"id": "1"}
+    assert cache.stats()["misses"] == 2
+
+
+def test_cache_drops_value_loaded_before_invalidation():
+    shared = MemoryBackend(ttl=60)
+    cache = Cache(local=LocalCache(maxsize=10, ttl=60), shared=shared)
+
+    def stale_load():
+        # коммит и сброс ключа происходят, пока загрузка еще не записала значение
+        cache.invalidate("order:1")
+        return {"status": 1}
+
+    assert cache.get_or_load("order:1", stale_load) == {"status": 1}
+    assert cache.local.get("order:1") is None and shared.get("order:1") is None
+    assert cache.get_or_load("order:1", lambda: {"status": 2}) == {"status": 2}
+    assert cache.get_or_load("order:1", lambda: {"status": 3}) == {"status": 2}
+    assert not cache._loading
+
+
+def test_cache_counters_are_thread_safe():
+    cache = Cache(local=LocalCache(maxsize=10, ttl=60))
+    cache.get_or_load("courier:1", lambda: {"id": "1"})
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: cache.get_or_load("courier:1", lambda: None), range(10000)))
+    assert (cache.hits, cache.misses) == (10000, 1)
+
+
+def test_local_layer_disabled_with_several_workers(monkeypatch):
+    monkeypatch.setattr(cache_module, "CACHE_TTL", 5)
+    monkeypatch.setattr(cache_module, "CACHE_REDIS_URL", None)
+    assert create_cache().local is not None
+    monkeypatch.setattr(cache_module, "WEB_CONCURRENCY", 2)
+    assert not create_cache().enabled  # без общего бэкенда кэш не используется
+
+
+def test_local_layer_disabled_with_shared_backend(monkeypatch):
+    # несколько реплик по одному воркеру: сброс на одной реплике не дошел бы до кэша процесса на других
+    monkeypatch.setattr(cache_module, "CACHE_TTL", 5)
+    monkeypatch.setattr(cache_module, "CACHE_REDIS_URL", "redis://redis:6379/0")
+    monkeypatch.setattr(cache_module, "RedisBackend", lambda url, ttl: MemoryBackend(ttl))
+    cache = create_cache()
+    assert cache.local is None and cache.shared is not None
@@ -0,0 +1,79 @@
+import uuid
+
+import pytest
+
+from src import dispatch
+from src.dispatch import DispatchIndex
+from src.geo import GridIndex
+
+
+def make_index():
+    district_a, district_b = uuid.uuid4(), uuid.uuid4()
+    fast, slow, other = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    index = DispatchIndex()
+    index.load([(fast, 100, [district_a, district_b]),
+                (slow, 300, [district_a]),
+                (other, 50, [district_b])],
+               busy_courier_ids=[other])
+    return index, district_a, district_b, fast, slow, other
+
+
+def test_pop_returns_fastest_idle_courier():
+    index, district_a, district_b, fast, slow, other = make_index()
+
+    assert index.pop(district_b) == fast
+    assert index.pop(district_a) == slow  # fast уже занят заказом в другом районе
+    assert index.pop(district_a) is None
+    assert index.pop(district_b) is None
+
+
+def test_release_updates_metric():
+    index, district_a, district_b, fast, slow, other = make_index()
+
+    assert index.pop(district_a) == fast
+    index.release(fast, 500)
+    index.release(other)
+
+    assert index.pop(district_a) == slow
+    assert index.pop(district_b) == other
+    assert index.pop(district_b) == fast
+
+
+def test_add_and_discard_courier():
+    index, district_a, district_b, fast, slow, other = make_index()
+    new = uuid.uuid4()
+    index.add_courier(new, 0, [district_a])
+    index.discard(fast)
+
+    assert index.pop(district_a) == new
+    assert index.pop(district_a) == slow
+    assert not index.is_idle(fast)
+
+
+def test_stale_entries_are_compacted():
+    index, district_a, district_b, fast, slow, other = make_index()
+    for _ in range(5000):
+        index.discard(fast)
+        index.release(fast)
+
+    assert sum(len(heap) for heap in index._heaps.values()) < 3000
+    assert index.pop(district_a) == fast
+
+
+@pytest.mark.parametrize("direct_scan", [0, 64])
+def test_pop_nearest_prefers_close_courier(direct_scan, monkeypatch):
+    monkeypatch.setattr(dispatch, "DIRECT_SCAN", direct_scan)  # 0 - поиск обходом колец сетки
+    index, district_a, district_b, fast, slow, other = make_index()
+    grid = GridIndex(cell_km=1)
+    grid.load([(fast, 55.80, 37.60), (slow, 55.7501, 37.60)])
+
+    def score(distance, metric):
+        return distance * 100 + metric
+
+    # slow рядом с заказом: 300 + ~10 против 100 + ~550 у fast
+    assert index.pop_nearest(district_a, grid, 55.75, 37.60, 20, score) == slow
+    assert index.pop_nearest(district_a, grid, 55.75, 37.60, 20, score) == fast
+    # у other нет положения в сетке - выбирается по метрике
+    index.release(other)
+    assert index.pop_nearest(district_b, grid, 55.75, 37.60, 20, score) == other
+    assert index.pop_nearest(district_b, grid, 55.75, 37.60, 20, score) is None
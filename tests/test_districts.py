@@ -0,0 +1,23 @@
+import uuid
+
+from src.districts import DistrictRegistry
+
+
+def test_registry_resolves_normalized_names():
+    registry = DistrictRegistry()
+    first, second = uuid.uuid4(), uuid.uuid4()
+    registry.load([("центр", first)])
+    assert registry.loaded
+    assert registry.get("Центр") == first
+    assert registry.get("север") is None
+
+    found, missing = registry.resolve(["ЦЕНТР", "центр", "Север", "север"])
+    assert found == {"центр": first}
+    assert missing == ["север"]
+
+    registry.update({"Север": second})
+    assert registry.resolve(["север"]) == ({"север": second}, [])
+    assert len(registry) == 2
+
+    registry.clear()
+    assert not registry.loaded and registry.get("центр") is None
@@ -0,0 +1,42 @@
+import uuid
+
+import pytest
+
+from src.geo import GridIndex, distance_km
+
+
+def test_distance_km():
+    assert distance_km(55.0, 37.0, 56.0, 37.0) == pytest.approx(111.2, abs=0.1)
+    # градус долготы на широте 60° вдвое короче градуса широты
+    assert distance_km(60.0, 37.0, 60.0, 38.0) == pytest.approx(55.6, abs=0.1)
+
+
+def test_rings_find_couriers_by_distance():
+    grid = GridIndex(cell_km=1)
+    near, far, outside = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    grid.load([(near, 55.7560, 37.6180), (far, 55.7800, 37.6173), (outside, 56.7558, 37.6173)])
+
+    found, reaches = {}, []
+    for candidates, reach_km in grid.rings(55.7558, 37.6173, max_radius_km=5):
+        reaches.append(reach_km)
+        for courier_id, distance in candidates:
+            # курьер найден раньше, чем пройдена граница его расстояния
+            assert all(reach <= distance for reach in reaches[:-1])
+            found[courier_id] = distance
+
+    assert set(found) == {near, far}
+    assert found[near] < 0.1
+    assert found[far] == pytest.approx(2.7, abs=0.1)
+    assert reaches == sorted(reaches) and reaches[-1] >= 5
+
+
+def test_update_moves_courier_between_cells():
+    grid = GridIndex(cell_km=1)
+    courier = uuid.uuid4()
+    grid.update(courier, 55.0, 37.0)
+    grid.update(courier, 55.1, 37.0)
+
+    assert grid.position(courier) == (55.1, 37.0)
+    assert len(grid) == 1
+    candidates, _ = next(grid.rings(55.0, 37.0, max_radius_km=1))
+    assert candidates == []
@@ -1,6 +1,28 @@
 from fastapi.testclient import TestClient
 
-from src.database import get_session, drop_test_table, create_test_table
+import datetime
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from alembic import command
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, func, make_url, select, text, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from src import crud, events, idempotency, locations, models, repository, schemas
+from src.archive import ARCHIVE_LOCK, archive_orders
+from src.backfill import backfill_courier_stats
+from src.cache import cache, MemoryBackend
+from src.geo import courier_grid
+from src.database import SQLALCHEMY_DATABASE_URL_TEST, get_session, drop_test_table, create_test_table
+from src.locations import flush_locations
+from src.migrate import SchemaOutdated, alembic_config, ensure_schema
+from src.strategies import strategy_selector
 from src.main import app, get_db
 
 drop_test_table()
@@ -145,3 +167,894 @@ def test_complete_order_incorrect_id():
 def test_complete_order_not_found():
     response = client.post("/order/00000000-0000-0000-0000-000000000000")
     assert response.status_code == 404, response.text
+
+
+def test_create_order_assigns_idle_couriers():
+    couriers = []
+    for name in ("Петров Петр", "Сидоров Сидор"):
+        response = client.post("/courier", json={"name": name, "districts": ["Заречный"]})
+        assert response.status_code == 200, response.text
+
+    response = client.post("/order", json={"name": "Заказ 1", "district": "заречный"})
+    assert response.status_code == 200, response.text
+    first = response.json()
+    couriers.append(first['courier_id'])
+
+    response = client.post("/order", json={"name": "Заказ 2", "district": "Заречный"})
+    assert response.status_code == 200, response.text
+    couriers.append(response.json()['courier_id'])
+    assert couriers[0] != couriers[1]
+
+    response = client.post("/order", json={"name": "Заказ 3", "district": "Заречный"})
+    assert response.status_code == 404, response.text
+
+    response = client.post(f"/order/{first['order_id']}")
+    assert response.status_code == 200, response.text
+
+    response = client.post("/order", json={"name": "Заказ 3", "district": "Заречный"})
+    assert response.status_code == 200, response.text
+    assert response.json()['courier_id'] == first['courier_id']
+
+
+def test_create_order_unknown_district():
+    response = client.post("/order", json={"name": "Заказ", "district": "Несуществующий"})
+    assert response.status_code == 404, response.text
+
+
+def test_complete_order_updates_courier_stats():
+    response = client.post("/courier", json={"name": "Орлов Олег", "districts": ["Луговой"]})
+    assert response.status_code == 200, response.text
+
+    for name in ("Заказ 1", "Заказ 2"):
+        response = client.post("/order", json={"name": name, "district": "Луговой"})
+        assert response.status_code == 200, response.text
+        data = response.json()
+        response = client.post(f"/order/{data['order_id']}")
+        assert response.status_code == 200, response.text
+
+    response = client.get(f"/courier/{data['courier_id']}")
+    assert response.status_code == 200, response.text
+    assert response.json()['avg_day_orders'] == 2
+
+    db = get_session('test')
+    try:
+        courier = db.get(models.Courier, data['courier_id'])
+        assert courier.completed_orders == 2
+        assert courier.work_days == 1
+        stats = [(c.id, c.completed_orders, c.total_complete_time, c.work_days, c.avg_day_orders)
+                 for c in db.query(models.Courier).order_by(models.Courier.id)]
+
+        backfill_courier_stats(db)
+        db.expire_all()
+        recalculated = [(c.id, c.completed_orders, c.total_complete_time, c.work_days, c.avg_day_orders)
+                        for c in db.query(models.Courier).order_by(models.Courier.id)]
+        assert [s[:2] + s[3:] for s in recalculated] == [s[:2] + s[3:] for s in stats]
+        for (_, _, total, _, _), (_, _, expected, _, _) in zip(recalculated, stats):
+            assert abs(total - expected) < 0.01
+    finally:
+        db.close()
+
+
+def test_pool_status():
+    response = client.get("/internal/pool")
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data['sync:test']['checked_out'] == 0, data
+    assert data['sync:test']['wait_count'] > 0, data
+    assert data['sync:test']['idle'] >= 1, data
+
+
+def test_create_order_skips_courier_busy_in_other_process():
+    for name in ("Быстров Борис", "Медведев Максим"):
+        response = client.post("/courier", json={"name": name, "districts": ["Нагорный"]})
+        assert response.status_code == 200, response.text
+
+    db = get_session('test')
+    try:
+        district = crud.get_district(db, "нагорный")
+        couriers = [c.id for c in district.district_couriers]
+        # заказ назначен в обход индекса этого процесса (как если бы его создал другой воркер)
+        db.add(models.Order(id=uuid.uuid4(), name="Чужой заказ", district_id=district.id, courier_id=couriers[0],
+                            status=crud.Status.IN_PROGRESS))
+        db.commit()
+    finally:
+        db.close()
+
+    assigned = []
+    for _ in couriers:
+        response = client.post("/order", json={"name": "Заказ", "district": "Нагорный"})
+        if response.status_code == 200:
+            assigned.append(response.json()['courier_id'])
+    assert assigned == [str(couriers[1])]
+
+
+def test_hot_queries_use_indexes():
+    some_id = uuid.uuid4()
+    queries = {
+        "ix_orders_active_courier": select(models.Order).where(models.Order.status == crud.Status.IN_PROGRESS,
+                                                               models.Order.courier_id == some_id),
+        "ix_orders_district_id_status": select(models.Order).where(models.Order.district_id == some_id,
+                                                                   models.Order.status == crud.Status.COMPLETED),
+        "ix_couriers_districts_district_id": select(models.CourierDistrict.courier_id)
+                                             .where(models.CourierDistrict.district_id == some_id),
+        "ix_orders_pending": select(models.Order).where(models.Order.district_id == some_id,
+                                                        models.Order.status == crud.Status.PENDING)
+                                                 .order_by(models.Order.date_publication).limit(1),
+    }
+
+    db = get_session('test')
+    try:
+        db.execute(text("SET LOCAL enable_seqscan = off"))  # на маленьких тестовых таблицах seq scan дешевле
+        for index_name, query in queries.items():
+            sql = query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+            plan = "\n".join(db.execute(text(f"EXPLAIN {sql}")).scalars())
+            assert index_name in plan, plan
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("dispatch_mode", ["index", "locking"])
+def test_parallel_orders_do_not_share_couriers(dispatch_mode, monkeypatch):
+    monkeypatch.setattr(crud, "DISPATCH_MODE", dispatch_mode)
+    district = f"Стресс {dispatch_mode}"
+    couriers_count, orders_count = 8, 24
+    for i in range(couriers_count):
+        response = client.post("/courier", json={"name": f"Курьер {i}", "districts": [district]})
+        assert response.status_code == 200, response.text
+
+    def publish(i):
+        return client.post("/order", json={"name": f"Заказ {i}", "district": district})
+
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        responses = list(executor.map(publish, range(orders_count)))
+
+    assigned = [r.json()['courier_id'] for r in responses if r.status_code == 200]
+    assert len(assigned) == couriers_count, [r.text for r in responses]
+    assert len(set(assigned)) == couriers_count
+    assert all(r.status_code in (200, 404) for r in responses), [r.text for r in responses]
+
+
+def test_pending_orders_queue(monkeypatch):
+    monkeypatch.setattr(crud, "ORDER_QUEUE_ENABLED", True)
+    response = client.post("/courier", json={"name": "Очередной Курьер", "districts": ["Очередной"]})
+    assert response.status_code == 200, response.text
+
+    response = client.post("/order", json={"name": "Заказ 1", "district": "Очередной"})
+    assert response.status_code == 200, response.text
+    first = response.json()
+
+    pending = []
+    for name in ("Заказ 2", "Заказ 3"):
+        response = client.post("/order", json={"name": name, "district": "Очередной"})
+        assert response.status_code == 202, response.text
+        data = response.json()
+        assert data['courier_id'] is None and data['status'] == 0, data
+        pending.append(data['order_id'])
+
+    response = client.get(f"/order/{pending[0]}")
+    assert response.json() == {"courier_id": None, "status": 0}
+    response = client.post(f"/order/{pending[0]}")
+    assert response.status_code == 404, response.text
+
+    response = client.get("/orders/pending")
+    assert {"district": "очередной", "pending_orders": 2}.items() <= response.json()[0].items()
+
+    response = client.post(f"/order/{first['order_id']}")
+    assert response.status_code == 200, response.text
+    response = client.get(f"/order/{pending[0]}")
+    assert response.json() == {"courier_id": first['courier_id'], "status": 1}
+
+    response = client.post("/courier", json={"name": "Новый Курьер", "districts": ["Очередной"]})
+    assert response.status_code == 200, response.text
+    response = client.get(f"/order/{pending[1]}")
+    data = response.json()
+    assert data['status'] == 1 and data['courier_id'] != first['courier_id'], data
+
+    response = client.get("/orders/pending")
+    assert all(d['district'] != "очередной" for d in response.json())
+
+
+@pytest.mark.parametrize("dispatch_mode", ["index", "locking"])
+def test_queued_order_sees_concurrent_completion(dispatch_mode, monkeypatch):
+    monkeypatch.setattr(crud, "ORDER_QUEUE_ENABLED", True)
+    monkeypatch.setattr(crud, "DISPATCH_MODE", dispatch_mode)
+    district = f"Гонка-{uuid.uuid4().hex[:8]}"
+    assert client.post("/courier", json={"name": "Курьер", "districts": [district]}).status_code == 200
+    first = client.post("/order", json={"name": "Первый", "district": district}).json()
+
+    # завершение заказа еще не зафиксировано, а очередь района уже заблокирована им
+    other = get_session('test')
+    try:
+        other.execute(update(models.Order).where(models.Order.id == first['order_id'])
+                      .values(status=crud.Status.COMPLETED))
+        crud.lock_district_queues(other, [crud.get_district_id(other, district)])
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(client.post, "/order", json={"name": "Второй", "district": district})
+            time.sleep(0.3)
+            other.commit()
+            response = future.result()
+    finally:
+        other.close()
+
+    # заказ не остался в очереди при свободном курьере
+    assert response.status_code == 200, response.text
+    assert response.json()['courier_id'] == first['courier_id']
+
+
+def test_create_couriers_bulk():
+    response = client.post("/couriers/bulk", json=[
+        {"name": "Массовый 1", "districts": ["Оптовый", "ОПТОВЫЙ", "Розничный"]},
+        {"name": "", "districts": ["Оптовый"]},
+        {"name": "Массовый 2", "districts": ["оптовый"]},
+    ])
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert [r['status'] for r in data] == ["created", "invalid", "created"], data
+    assert data[1]['errors'] and data[1]['id'] is None
+
+    response = client.get(f"/courier/{data[0]['id']}")
+    assert response.status_code == 200, response.text
+    assert response.json()['name'] == "Массовый 1"
+
+    ndjson = '{"name": "Потоковый", "districts": ["Розничный"]}\n{not json}\n'
+    response = client.post("/couriers/bulk", content=ndjson.encode(), headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200, response.text
+    assert [r['status'] for r in response.json()] == ["created", "invalid"]
+
+    assigned = set()
+    for _ in range(3):
+        response = client.post("/order", json={"name": "Заказ", "district": "Оптовый"})
+        if response.status_code == 200:
+            assigned.add(response.json()['courier_id'])
+    assert assigned == {data[0]['id'], data[2]['id']}
+
+    response = client.post("/couriers/bulk", json={"name": "Не массив"})
+    assert response.status_code == 422, response.text
+
+
+def test_create_orders_batch_minimizes_total_time():
+    response = client.post("/couriers/bulk", json=[
+        {"name": "Универсал", "districts": ["Пакетный А", "Пакетный Б"]},
+        {"name": "Местный", "districts": ["Пакетный А"]},
+    ])
+    universal, local = [r['id'] for r in response.json()]
+
+    db = get_session('test')
+    try:
+        db.query(models.Courier).filter(models.Courier.id == universal).update({"avg_order_complete_time": 100})
+        db.query(models.Courier).filter(models.Courier.id == local).update({"avg_order_complete_time": 900})
+        db.commit()
+        crud.load_dispatch_index(db)
+    finally:
+        db.close()
+
+    # жадный выбор отдал бы быстрого курьера первому заказу, и второй остался бы без курьера
+    response = client.post("/orders/batch", json=[
+        {"name": "Заказ 1", "district": "Пакетный А"},
+        {"name": "Заказ 2", "district": "Пакетный Б"},
+        {"name": "Заказ 3", "district": "Пакетный А"},
+        {"name": "Заказ 4", "district": "Неизвестный"},
+    ])
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert [r['courier_id'] for r in data[:2]] == [local, universal], data
+    assert data[2]['order_id'] is None and data[2]['reason'] == 'No suitable courier found'
+    assert data[3]['reason'] == 'District not found'
+
+    response = client.get(f"/order/{data[1]['order_id']}")
+    assert response.json() == {"courier_id": universal, "status": 1}
+
+    response = client.post("/orders/batch", json=[])
+    assert response.status_code == 422, response.text
+
+
+def test_create_orders_batch_locking_mode(monkeypatch):
+    monkeypatch.setattr(crud, "DISPATCH_MODE", "locking")
+    response = client.post("/couriers/bulk", json=[
+        {"name": "Универсал", "districts": ["Блокировка А", "Блокировка Б"]},
+        {"name": "Местный", "districts": ["Блокировка А"]},
+    ])
+    couriers = {r['id'] for r in response.json()}
+
+    response = client.post("/orders/batch", json=[
+        {"name": "Заказ 1", "district": "Блокировка А"},
+        {"name": "Заказ 2", "district": "Блокировка Б"},
+    ])
+    assert response.status_code == 200, response.text
+    assert {r['courier_id'] for r in response.json()} == couriers
+
+
+def test_get_couriers_pages_and_filters():
+    response = client.post("/couriers/bulk", json=[{"name": f"Страничный {i}", "districts": ["Страничный"]}
+                                                   for i in range(5)])
+    ids = sorted(r['id'] for r in response.json())
+
+    pages, cursor = [], None
+    while True:
+        params = {"district": "Страничный", "limit": 2} | ({"after": cursor} if cursor else {})
+        response = client.get("/courier", params=params)
+        assert response.status_code == 200, response.text
+        pages.append([c['id'] for c in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert sum(pages, []) == ids
+
+    response = client.post("/order", json={"name": "Заказ", "district": "Страничный"})
+    busy = response.json()['courier_id']
+    response = client.get("/courier", params={"district": "Страничный", "state": "busy"})
+    assert [c['id'] for c in response.json()] == [busy]
+    response = client.get("/courier", params={"district": "Страничный", "state": "idle"})
+    assert len(response.json()) == 4
+
+    response = client.get("/courier", params={"state": "unknown"})
+    assert response.status_code == 422, response.text
+    response = client.get("/courier", params={"limit": 0})
+    assert response.status_code == 422, response.text
+
+
+def test_stream_couriers():
+    response = client.get("/couriers/stream", params={"district": "Страничный"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 5 and all(row['name'].startswith("Страничный") for row in rows)
+
+
+def test_order_and_courier_cache_invalidation(monkeypatch):
+    monkeypatch.setattr(cache, "shared", MemoryBackend(ttl=60))
+    response = client.post("/courier", json={"name": "Кэшированный", "districts": ["Кэш"]})
+    assert response.status_code == 200, response.text
+    response = client.post("/order", json={"name": "Заказ", "district": "Кэш"})
+    data = response.json()
+
+    hits = cache.stats()['hits']
+    for _ in range(3):
+        response = client.get(f"/order/{data['order_id']}")
+        assert response.json()['status'] == 1
+        response = client.get(f"/courier/{data['courier_id']}")
+        assert response.json()['active_order']['order_id'] == data['order_id']
+    assert cache.stats()['hits'] - hits == 4
+
+    response = client.post(f"/order/{data['order_id']}")
+    assert response.status_code == 200, response.text
+    response = client.get(f"/order/{data['order_id']}")
+    assert response.json()['status'] == 2
+    response = client.get(f"/courier/{data['courier_id']}")
+    assert response.json()['active_order'] is None
+
+    response = client.get("/internal/cache")
+    assert response.status_code == 200, response.text
+    assert response.json()['invalidations'] > 0
+
+
+def test_metrics_count_sql_statements(monkeypatch, caplog):
+    from src import metrics
+
+    metrics.registry.clear()
+    monkeypatch.setattr(metrics, "SLOW_REQUEST_MS", 0.001)  # в лог попадает каждый запрос
+    client.get(f"/courier/{uuid.uuid4()}")
+
+    labels = 'method="GET",route="/courier/{id}"'
+    assert metrics.registry.statements[("GET", "/courier/{id}")].sum >= 1
+    assert metrics.registry.db_time[("GET", "/courier/{id}")] > 0
+    assert "Slow request GET /courier/" in caplog.text
+    assert "FROM couriers" in caplog.text
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert f'http_requests_total{{{labels},status="404"}} 1' in response.text
+    assert f'db_statements_per_request_count{{{labels}}} 1' in response.text
+
+
+def test_endpoints_statement_budget(monkeypatch, max_statements):
+    monkeypatch.setattr(cache, "local", None)  # каждое чтение идет в БД
+    with max_statements(6):
+        client.post("/courier", json={"name": "Budget", "districts": ["budget-district"]})
+    courier_id = crud.get_couriers(get_session('test'), schemas.CourierFilters(district="budget-district"))[0].id
+
+    with max_statements(1):
+        assert client.get(f"/courier/{courier_id}").json()["active_order"] is None
+    with max_statements(1):
+        client.get("/courier", params={"district": "budget-district", "state": "idle"})
+    with max_statements(1):
+        order_id = client.post("/order", json={"name": "Budget", "district": "budget-district"}).json()["order_id"]
+    with max_statements(1) as statements:
+        assert client.get(f"/courier/{courier_id}").json()["active_order"]["order_id"] == order_id
+    assert "LEFT OUTER JOIN orders" in statements[0]
+    with max_statements(1):
+        assert client.get(f"/order/{order_id}").json()["status"] == 1
+    with max_statements(4):
+        assert client.post(f"/order/{order_id}").status_code == 200
+
+
+def test_daily_stats_endpoints():
+    response = client.post("/courier", json={"name": "Stats", "districts": ["stats-district"]})
+    assert response.status_code == 200, response.text
+    for name in ("Stats 1", "Stats 2", "Stats 3"):
+        data = client.post("/order", json={"name": name, "district": "stats-district"}).json()
+        assert client.post(f"/order/{data['order_id']}").status_code == 200
+    courier_id = data["courier_id"]
+
+    response = client.get(f"/courier/{courier_id}/stats")
+    assert response.status_code == 200, response.text
+    report = response.json()
+    assert report["orders_count"] == 3
+    assert report["work_days"] == 1
+    assert report["avg_day_orders"] == 3
+    assert 0 <= report["min_complete_time"] <= report["avg_complete_time"] <= report["max_complete_time"]
+    assert len(report["days"]) == 1 and report["days"][0]["orders_count"] == 3
+
+    district = client.get("/district/Stats-District/stats").json()
+    assert district["orders_count"] == 3
+    assert district["days"][0]["day"] == report["days"][0]["day"]
+
+    today = report["days"][0]["day"]
+    empty = client.get(f"/courier/{courier_id}/stats", params={"date_to": "2000-01-01"}).json()
+    assert empty["orders_count"] == 0 and empty["days"] == [] and empty["avg_complete_time"] is None
+    assert client.get("/district/stats-district/stats", params={"date_from": today, "date_to": today}).json() == \
+        {**district, "date_from": today, "date_to": today}
+
+    assert client.get(f"/courier/{uuid.uuid4()}/stats").status_code == 404
+    assert client.get("/district/no-such-district/stats").status_code == 404
+
+    db = get_session('test')
+    try:
+        backfill_courier_stats(db)
+    finally:
+        db.close()
+    recalculated = client.get("/district/stats-district/stats").json()
+    assert recalculated["orders_count"] == 3
+    assert abs(recalculated["max_complete_time"] - district["max_complete_time"]) < 0.01
+
+
+def test_archive_completed_orders(monkeypatch):
+    monkeypatch.setattr(cache, "local", None)
+    client.post("/courier", json={"name": "Archive", "districts": ["archive-district"]})
+    order_ids = []
+    for name in ("Old 1", "Old 2", "Old 3", "Recent"):
+        data = client.post("/order", json={"name": name, "district": "archive-district"}).json()
+        assert client.post(f"/order/{data['order_id']}").status_code == 200
+        order_ids.append(data["order_id"])
+    courier_id = data["courier_id"]
+
+    db = get_session('test')
+    try:
+        db.execute(update(models.Order).where(models.Order.id.in_(order_ids[:3]))
+                   .values(date_completion=models.Order.date_completion - datetime.timedelta(days=60)))
+        db.commit()
+
+        # пока блокировку держит другой процесс, перенос не выполняется
+        other = get_session('test')
+        other.execute(select(func.pg_advisory_xact_lock(ARCHIVE_LOCK)))
+        assert archive_orders(db, after_days=30, batch_size=2) == 0
+        other.rollback()
+        other.close()
+
+        assert archive_orders(db, after_days=30, batch_size=2) >= 3
+        assert db.scalar(select(func.count()).select_from(models.Order)
+                         .where(models.Order.id.in_(order_ids))) == 1
+        assert db.scalar(select(func.count()).select_from(models.OrderArchive)
+                         .where(models.OrderArchive.id.in_(order_ids))) == 3
+
+        backfill_courier_stats(db)
+        assert db.get(models.Courier, courier_id).completed_orders == 4
+    finally:
+        db.close()
+
+    for order_id in order_ids:
+        response = client.get(f"/order/{order_id}")
+        assert response.status_code == 200, response.text
+        assert response.json() == {"courier_id": courier_id, "status": 2}
+    assert client.post(f"/order/{order_ids[0]}").status_code == 404
+
+
+def test_order_events_websocket(monkeypatch):
+    client.post("/courier", json={"name": "Events", "districts": ["events-district"]})
+    courier_id = crud.get_couriers(get_session('test'), schemas.CourierFilters(district="events-district"))[0].id
+
+    with client.websocket_connect(f"/ws/courier/{courier_id}") as courier_ws:
+        order_id = client.post("/order", json={"name": "Events", "district": "events-district"}).json()["order_id"]
+        assert courier_ws.receive_json() == {"event": "order_assigned", "order_id": order_id,
+                                             "courier_id": str(courier_id), "status": 1}
+        with client.websocket_connect(f"/ws/order/{order_id}") as order_ws:
+            assert client.post(f"/order/{order_id}").status_code == 200
+            expected = {"event": "order_completed", "order_id": order_id, "courier_id": str(courier_id), "status": 2}
+            assert order_ws.receive_json() == expected
+            assert courier_ws.receive_json() == expected
+    assert events.broker.subscribers(events.courier_topic(courier_id)) == 0
+
+    # события откаченной транзакции не рассылаются
+    db = get_session('test')
+    try:
+        db.execute(select(models.Courier.id).where(models.Courier.id == courier_id))
+        events.publish_on_commit(db, "order_assigned", uuid.uuid4(), courier_id, 1)
+        db.rollback()
+        assert "events" not in db.info
+    finally:
+        db.close()
+
+
+def test_order_events_notify_bridge(monkeypatch):
+    import asyncio
+    from src.database import SQLALCHEMY_DATABASE_URL_TEST
+
+    pytest.importorskip("asyncpg")
+    monkeypatch.setattr(events, "EVENTS_NOTIFY", True)
+    order_id = uuid.uuid4()
+
+    async def scenario():
+        bridge = asyncio.create_task(events.run_notify_bridge(SQLALCHEMY_DATABASE_URL_TEST))
+        async with events.broker.subscribe(events.order_topic(order_id)) as queue:
+            await asyncio.sleep(0.5)  # bridge подключается и выполняет LISTEN
+            db = get_session('test')
+            try:
+                events.publish_on_commit(db, "order_pending", order_id, status=0)
+                db.commit()
+            finally:
+                db.close()
+            assert queue.empty()  # локально событие не рассылается, оно придет через NOTIFY
+            message = await asyncio.wait_for(queue.get(), timeout=5)
+        bridge.cancel()
+        return message
+
+    message = asyncio.run(scenario())
+    assert message == {"event": "order_pending", "order_id": str(order_id), "courier_id": None, "status": 0}
+
+
+def test_idempotency_key(monkeypatch):
+    import time
+
+    client.post("/courier", json={"name": "Idempotent 1", "districts": ["idempotent-district"]})
+    client.post("/courier", json={"name": "Idempotent 2", "districts": ["idempotent-district"]})
+    order = {"name": "Idempotent", "district": "idempotent-district"}
+    key = str(uuid.uuid4())
+
+    create_order = crud.create_order
+
+    def slow_create_order(db, order):
+        time.sleep(0.3)  # повторы приходят, пока первый запрос еще выполняется
+        return create_order(db, order)
+
+    monkeypatch.setattr(crud, "create_order", slow_create_order)
+    with ThreadPoolExecutor(3) as pool:
+        responses = list(pool.map(lambda _: client.post("/order", json=order, headers={"Idempotency-Key": key}),
+                                  range(3)))
+    assert [r.status_code for r in responses] == [200] * 3
+    assert len({r.json()["order_id"] for r in responses}) == 1
+    assert sorted(r.headers.get("Idempotent-Replayed", "false") for r in responses) == ["false", "true", "true"]
+    order_id = responses[0].json()["order_id"]
+
+    db = get_session('test')
+    try:
+        district_id = crud.get_district(db, "idempotent-district").id
+        assert db.scalar(select(func.count()).select_from(models.Order)
+                         .where(models.Order.district_id == district_id)) == 1
+    finally:
+        db.close()
+
+    # тот же ключ с другим запросом - ошибка
+    response = client.post("/order", json={**order, "name": "Other"}, headers={"Idempotency-Key": key})
+    assert response.status_code == 422
+
+    complete_key = str(uuid.uuid4())
+    first = client.post(f"/order/{order_id}", headers={"Idempotency-Key": complete_key})
+    retry = client.post(f"/order/{order_id}", headers={"Idempotency-Key": complete_key})
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert client.post(f"/order/{order_id}").status_code == 404  # без ключа - обычное повторное завершение
+
+    # ответ с ошибкой тоже сохраняется
+    missing = uuid.uuid4()
+    missing_key = str(uuid.uuid4())
+    assert client.post(f"/order/{missing}", headers={"Idempotency-Key": missing_key}).status_code == 404
+    replay = client.post(f"/order/{missing}", headers={"Idempotency-Key": missing_key})
+    assert replay.status_code == 404 and replay.headers["Idempotent-Replayed"] == "true"
+
+
+def test_idempotency_key_uses_one_connection():
+    # пул меньше числа параллельных запросов: каждому запросу с ключом хватает одного соединения
+    engine = create_engine(SQLALCHEMY_DATABASE_URL_TEST, pool_size=2, max_overflow=0, pool_timeout=10)
+    district = f"idempotent-pool-{uuid.uuid4().hex[:8]}"
+    client.post("/couriers/bulk", json=[{"name": f"Пул {i}", "districts": [district]} for i in range(8)])
+
+    def small_pool_db():
+        db = Session(engine)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = small_pool_db
+    try:
+        with ThreadPoolExecutor(8) as pool:
+            responses = list(pool.map(lambda _: client.post("/order", json={"name": "Заказ", "district": district},
+                                                            headers={"Idempotency-Key": str(uuid.uuid4())}),
+                                      range(8)))
+    finally:
+        app.dependency_overrides[get_db] = override_get_db
+        engine.dispose()
+    assert [r.status_code for r in responses] == [200] * 8, [r.text for r in responses]
+    assert len({r.json()["courier_id"] for r in responses}) == 8
+
+
+def test_idempotency_key_commits_with_request(monkeypatch):
+    client.post("/courier", json={"name": "Атомарный", "districts": ["idempotent-atomic"]})
+    order = {"name": "Атомарный", "district": "idempotent-atomic"}
+    key = str(uuid.uuid4())
+
+    def lost_store(db, key, status_code, body):
+        raise RuntimeError("connection lost")
+
+    # ответ не сохранился - заказ откатывается вместе с ключом, и повтор назначает курьера один раз
+    with monkeypatch.context() as patch:
+        patch.setattr(idempotency, "store", lost_store)
+        with pytest.raises(RuntimeError):
+            client.post("/order", json=order, headers={"Idempotency-Key": key})
+    response = client.post("/order", json=order, headers={"Idempotency-Key": key})
+    assert response.status_code == 200, response.text
+    assert "Idempotent-Replayed" not in response.headers
+
+    db = get_session('test')
+    try:
+        district_id = crud.get_district(db, "idempotent-atomic").id
+        assert db.scalar(select(func.count()).select_from(models.Order)
+                         .where(models.Order.district_id == district_id)) == 1
+    finally:
+        db.close()
+
+
+def test_district_registry(max_statements):
+    from src.districts import district_registry
+
+    client.post("/courier", json={"name": "Registry", "districts": ["Registry-District"]})
+    assert district_registry.get("registry-district") is not None
+
+    # район, созданный другим воркером, находится запросом к БД и попадает в реестр
+    db = get_session('test')
+    try:
+        district_id = uuid.uuid4()
+        db.add(models.District(id=district_id, name="registry-other-worker"))
+        db.commit()
+        assert district_registry.get("registry-other-worker") is None
+        assert crud.get_district_id(db, "Registry-Other-Worker") == district_id
+        with max_statements(0):
+            assert crud.get_district_id(db, "registry-other-worker") == district_id
+            assert crud.get_district_ids(db, ["REGISTRY-DISTRICT", "registry-other-worker"]).keys() == \
+                {"registry-district", "registry-other-worker"}
+
+        # районы откаченной транзакции в реестр не попадают
+        crud.create_or_get_districts(db, ["registry-rolled-back"])
+        db.rollback()
+        assert district_registry.get("registry-rolled-back") is None
+        assert crud.get_district_id(db, "registry-rolled-back") is None
+    finally:
+        db.close()
+
+
+def test_locking_mode_location_of_unknown_courier(monkeypatch):
+    monkeypatch.setattr(repository, "DISPATCH_MODE", "locking")
+    monkeypatch.setattr(locations, "DISPATCH_MODE", "locking")
+    courier_id = uuid.UUID(client.post("/couriers/bulk", json=[{"name": "Без Индекса", "districts": ["Блокирующий"]}])
+                           .json()[0]['id'])
+    unknown = uuid.uuid4()
+
+    db = get_session('test')
+    try:
+        assert repository.SqlRepository(db).known_couriers([courier_id, unknown]) == {courier_id}
+    finally:
+        db.close()
+    # расстояния в режиме locking считает БД, сетка положений не растет
+    repository.SqlRepository(None).update_location(courier_id, 55.75, 37.60)
+    assert courier_grid.position(courier_id) is None
+    assert courier_id in locations.location_buffer.take()
+
+
+@pytest.mark.parametrize("dispatch_mode", ["index", "locking"])
+def test_create_order_assigns_nearest_courier(dispatch_mode, monkeypatch):
+    district = f"Гео {dispatch_mode}"
+    response = client.post("/couriers/bulk", json=[
+        {"name": "Быстрый Далекий", "districts": [district]},
+        {"name": "Медленный Близкий", "districts": [district]},
+        {"name": "Без Положения", "districts": [district]},
+    ])
+    far, near, unknown = [r['id'] for r in response.json()]
+
+    db = get_session('test')
+    try:
+        for courier_id, metric in ((far, 100), (near, 900), (unknown, 50)):
+            db.query(models.Courier).filter(models.Courier.id == courier_id).update({"avg_order_complete_time": metric})
+        db.commit()
+        crud.load_dispatch_index(db)
+    finally:
+        db.close()
+
+    # 10 км со скоростью 15 км/ч - 40 минут в пути, это дольше разницы метрик
+    response = client.put(f"/courier/{far}/location", json={"latitude": 55.84, "longitude": 37.60})
+    assert response.status_code == 204, response.text
+    response = client.post("/couriers/locations", json=[
+        {"courier_id": near, "latitude": 55.751, "longitude": 37.60},
+        {"courier_id": str(uuid.uuid4()), "latitude": 55.75, "longitude": 37.60},
+    ])
+    assert response.status_code == 204, response.text
+    response = client.put(f"/courier/{uuid.uuid4()}/location", json={"latitude": 55.75, "longitude": 37.60})
+    assert response.status_code == 404, response.text
+
+    db = get_session('test')
+    try:
+        assert flush_locations(db) == 2
+        locations = dict(db.execute(select(models.CourierLocation.courier_id, models.CourierLocation.latitude)).all())
+        assert locations[uuid.UUID(near)] == 55.751 and uuid.UUID(far) in locations
+    finally:
+        db.close()
+
+    monkeypatch.setattr(crud, "DISPATCH_MODE", dispatch_mode)
+    order = {"name": "Заказ", "district": district, "latitude": 55.75, "longitude": 37.60}
+    response = client.post("/order", json=order)
+    assert response.status_code == 200, response.text
+    assert response.json()['courier_id'] == near
+    response = client.post("/order", json=order)
+    assert response.json()['courier_id'] == far
+    # курьер без известного положения - только после курьеров рядом с заказом
+    response = client.post("/order", json=order)
+    assert response.json()['courier_id'] == unknown
+
+    response = client.post("/order", json={"name": "Заказ", "district": district, "latitude": 55.75})
+    assert response.status_code == 422, response.text
+
+
+def test_readiness(monkeypatch):
+    assert client.get("/internal/ready").status_code == 503
+
+    # индексы в этом тесте не перезагружаются: они построены по тестовой БД
+    monkeypatch.setattr(crud, "load_district_registry", lambda db: None)
+    monkeypatch.setattr(crud, "load_dispatch_index", lambda db: None)
+    with TestClient(app) as started:
+        response = started.get("/internal/ready")
+        assert response.status_code == 200, response.text
+        assert response.json() == {"status": "ready"}
+    assert client.get("/internal/ready").status_code == 503
+
+
+def test_schema_check_does_not_migrate():
+    # тестовая БД создана через metadata.create_all, версии alembic в ней нет
+    with pytest.raises(SchemaOutdated, match="python -m src.migrate"):
+        ensure_schema(upgrade=False, url=SQLALCHEMY_DATABASE_URL_TEST)
+
+
+def test_ensure_schema_migrates_empty_database():
+    # полный путь запуска контейнера: все миграции, включая CREATE INDEX CONCURRENTLY, на пустой БД
+    admin = create_engine(SQLALCHEMY_DATABASE_URL_TEST, isolation_level="AUTOCOMMIT", poolclass=NullPool)
+    name = f"migrate_{uuid.uuid4().hex[:8]}"
+    with admin.connect() as connection:
+        connection.execute(text(f"CREATE DATABASE {name}"))
+    try:
+        url = make_url(SQLALCHEMY_DATABASE_URL_TEST).set(database=name).render_as_string(hide_password=False)
+        heads = ensure_schema(url=url)
+        assert heads == tuple(sorted(ScriptDirectory.from_config(alembic_config()).get_heads()))
+        assert ensure_schema(upgrade=False, url=url) == heads
+    finally:
+        with admin.connect() as connection:
+            connection.execute(text(f"DROP DATABASE {name} WITH (FORCE)"))
+        admin.dispose()
+
+
+def test_migrations_fill_stats_from_existing_orders():
+    # завершенные до обновления заказы попадают в статистику при миграции, без ручного пересчета
+    admin = create_engine(SQLALCHEMY_DATABASE_URL_TEST, isolation_level="AUTOCOMMIT", poolclass=NullPool)
+    name = f"migrate_{uuid.uuid4().hex[:8]}"
+    with admin.connect() as connection:
+        connection.execute(text(f"CREATE DATABASE {name}"))
+    try:
+        url = make_url(SQLALCHEMY_DATABASE_URL_TEST).set(database=name).render_as_string(hide_password=False)
+        engine = create_engine(url, poolclass=NullPool)
+        courier_id, district_id = uuid.uuid4(), uuid.uuid4()
+        with engine.connect() as connection:
+            config = alembic_config()
+            config.attributes["connection"] = connection
+            command.upgrade(config, "ea8ac3eab941")
+            connection.execute(text("INSERT INTO couriers (id, name, avg_order_complete_time, avg_day_orders) "
+                                    "VALUES (:id, 'Старый', 450, 1)"), {"id": courier_id})
+            connection.execute(text("INSERT INTO districts (id, name) VALUES (:id, 'Старый')"), {"id": district_id})
+            connection.execute(text(
+                "INSERT INTO orders (id, name, district_id, courier_id, status, date_publication, date_completion) "
+                "VALUES (gen_random_uuid(), 'Заказ', :district, :courier, :status, :published, :completed)"),
+                [{"district": district_id, "courier": courier_id, "status": status,
+                  "published": datetime.datetime(2026, 10, day, 12),
+                  "completed": datetime.datetime(2026, 10, day, 12, 0, seconds) if seconds else None}
+                 for day, status, seconds in ((1, 2, 20), (1, 2, 40), (2, 2, 30), (2, 1, 0))])
+            connection.commit()
+        engine.dispose()
+        ensure_schema(url=url)
+
+        engine = create_engine(url, poolclass=NullPool)
+        with engine.connect() as connection:
+            courier = connection.execute(text("SELECT completed_orders, total_complete_time, work_days "
+                                              "FROM couriers WHERE id = :id"), {"id": courier_id}).one()
+            assert tuple(courier) == (3, 90, 2)
+            assert connection.execute(text("SELECT day, orders_count FROM courier_daily_stats "
+                                           "ORDER BY day")).all() == [
+                (datetime.date(2026, 10, 1), 2), (datetime.date(2026, 10, 2), 1)]
+            for table in ("courier_daily_stats", "district_daily_stats"):
+                assert connection.execute(text(f"SELECT day, orders_count, total_seconds, min_seconds, max_seconds "
+                                               f"FROM {table} ORDER BY day")).all() == [
+                    (datetime.date(2026, 10, 1), 2, 60, 20, 40), (datetime.date(2026, 10, 2), 1, 30, 30, 30)]
+        engine.dispose()
+    finally:
+        with admin.connect() as connection:
+            connection.execute(text(f"DROP DATABASE {name} WITH (FORCE)"))
+        admin.dispose()
+
+
+def test_complete_orders_bulk(max_statements):
+    district = "Пакетное завершение"
+    response = client.post("/couriers/bulk", json=[{"name": f"Курьер {i}", "districts": [district]} for i in range(3)])
+    courier_ids = {r['id'] for r in response.json()}
+    orders = [client.post("/order", json={"name": f"Заказ {i}", "district": district}).json() for i in range(3)]
+    assert {o['courier_id'] for o in orders} == courier_ids
+    order_ids = [o['order_id'] for o in orders]
+    assert client.post(f"/order/{order_ids[2]}").status_code == 200
+    unknown = str(uuid.uuid4())
+
+    # статистика всех курьеров пересчитывается теми же запросами, что и для одного заказа
+    with max_statements(5):
+        response = client.post("/orders/complete", json=[order_ids[0], unknown, order_ids[1], order_ids[2]])
+    assert response.status_code == 200, response.text
+    assert response.json() == [
+        {"order_id": order_ids[0], "completed": True, "reason": None},
+        {"order_id": unknown, "completed": False, "reason": "Order does not exist"},
+        {"order_id": order_ids[1], "completed": True, "reason": None},
+        {"order_id": order_ids[2], "completed": False, "reason": "Order has already been completed"},
+    ]
+
+    db = get_session('test')
+    try:
+        couriers = db.query(models.Courier).filter(models.Courier.id.in_(courier_ids)).all()
+        assert all(c.completed_orders == 1 and c.work_days == 1 and c.avg_day_orders == 1 for c in couriers)
+        stats = db.query(models.CourierDailyStats).filter(models.CourierDailyStats.courier_id.in_(courier_ids)).all()
+        assert sorted(s.orders_count for s in stats) == [1, 1, 1]
+        district_stats = (db.query(models.DistrictDailyStats)
+                          .join(models.District, models.District.id == models.DistrictDailyStats.district_id)
+                          .filter(models.District.name == district.lower()).one())
+        assert district_stats.orders_count == 3
+    finally:
+        db.close()
+
+    # освобожденные курьеры снова доступны для назначения
+    assigned = {client.post("/order", json={"name": "Заказ", "district": district}).json()['courier_id']
+                for _ in range(3)}
+    assert assigned == courier_ids
+
+    response = client.post("/orders/complete", json=[])
+    assert response.status_code == 422, response.text
+
+
+@pytest.mark.parametrize("dispatch_mode", ["index", "locking"])
+def test_district_dispatch_strategy(dispatch_mode, monkeypatch):
+    district = f"Стратегия {dispatch_mode}"
+    monkeypatch.setitem(strategy_selector.districts, district.lower(), "productive")
+    response = client.post("/couriers/bulk", json=[
+        {"name": "Быстрый", "districts": [district]},
+        {"name": "Продуктивный", "districts": [district]},
+    ])
+    fast, productive = [r['id'] for r in response.json()]
+
+    db = get_session('test')
+    try:
+        db.query(models.Courier).filter(models.Courier.id == fast).update(
+            {"avg_order_complete_time": 100, "avg_day_orders": 3})
+        db.query(models.Courier).filter(models.Courier.id == productive).update(
+            {"avg_order_complete_time": 900, "avg_day_orders": 12})
+        db.commit()
+        crud.load_dispatch_index(db)
+    finally:
+        db.close()
+
+    monkeypatch.setattr(crud, "DISPATCH_MODE", dispatch_mode)
+    response = client.post("/order", json={"name": "Заказ", "district": district})
+    assert response.status_code == 200, response.text
+    assert response.json()['courier_id'] == productive
+    response = client.post("/order", json={"name": "Заказ", "district": district})
+    assert response.json()['courier_id'] == fast
@@ -0,0 +1,97 @@
+import json
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.database import get_async_session, create_test_table
+from src.main import async_router, get_async_db
+
+pytest.importorskip("asyncpg")
+
+create_test_table()
+
+
+async def override_get_async_db():
+    async with get_async_session('test') as db:
+        yield db
+
+
+app = FastAPI()
+app.include_router(async_router)
+app.dependency_overrides[get_async_db] = override_get_async_db
+
+
+def test_async_courier_and_order():
+    with TestClient(app) as client:
+        response = client.post("/courier", json={"name": "Асинхронный Курьер", "districts": ["Асинхронный"]})
+        assert response.status_code == 200, response.text
+
+        response = client.post("/order", json={"name": "Заказ", "district": "Асинхронный"})
+        assert response.status_code == 200, response.text
+        data = response.json()
+
+        response = client.get(f"/courier/{data['courier_id']}")
+        assert response.status_code == 200, response.text
+        assert response.json()['active_order']['order_id'] == data['order_id']
+
+        response = client.post(f"/order/{data['order_id']}")
+        assert response.status_code == 200, response.text
+
+        response = client.get(f"/order/{data['order_id']}")
+        assert response.status_code == 200, response.text
+        assert response.json()['status'] == 2
+
+        response = client.post(f"/order/{data['order_id']}")
+        assert response.status_code == 404, response.text
+
+        response = client.get("/courier")
+        assert response.status_code == 200, response.text
+        assert any(c['id'] == data['courier_id'] for c in response.json())
+
+
+def test_async_idempotency_key():
+    with TestClient(app) as client:
+        client.post("/courier", json={"name": "Асинхронный Повтор", "districts": ["Асинхронный повтор"]})
+        order = {"name": "Заказ", "district": "Асинхронный повтор"}
+        headers = {"Idempotency-Key": str(uuid.uuid4())}
+
+        first = client.post("/order", json=order, headers=headers)
+        retry = client.post("/order", json=order, headers=headers)
+        assert first.status_code == retry.status_code == 200, first.text
+        assert retry.json() == first.json()
+        assert retry.headers["Idempotent-Replayed"] == "true"
+
+        order_id = first.json()["order_id"]
+        headers = {"Idempotency-Key": str(uuid.uuid4())}
+        assert client.post(f"/order/{order_id}", headers=headers).status_code == 200
+        retry = client.post(f"/order/{order_id}", headers=headers)
+        assert retry.status_code == 200 and retry.headers["Idempotent-Replayed"] == "true"
+
+
+def test_async_bulk_endpoints():
+    district = f"Асинхронный пакет {uuid.uuid4().hex[:8]}"
+    with TestClient(app) as client:
+        response = client.post("/couriers/bulk", json=[{"name": "Пакетный", "districts": [district]},
+                                                       {"name": "", "districts": [district]}])
+        assert response.status_code == 200, response.text
+        assert [r["status"] for r in response.json()] == ["created", "invalid"]
+        courier_id = response.json()[0]["id"]
+
+        response = client.get("/couriers/stream", params={"district": district})
+        assert response.status_code == 200, response.text
+        assert [json.loads(line) for line in response.text.splitlines()] == [{"id": courier_id, "name": "Пакетный"}]
+
+        response = client.post("/orders/batch", json=[{"name": "Заказ", "district": district},
+                                                      {"name": "Заказ", "district": "Несуществующий"}])
+        assert response.status_code == 200, response.text
+        first, missing = response.json()
+        assert first["courier_id"] == courier_id and missing["reason"] == "District not found"
+
+        response = client.post("/orders/complete", json=[first["order_id"], first["order_id"]])
+        assert response.status_code == 200, response.text
+        assert [r["completed"] for r in response.json()] == [True, True]
+
+        response = client.get("/orders/pending")
+        assert response.status_code == 200, response.text
@@ -0,0 +1,26 @@
+from src.matching import assign
+
+
+def test_assign_prefers_more_assignments_over_lower_cost():
+    # быстрый курьер 0 может взять оба заказа, медленный курьер 1 - только первый
+    costs = [[100, 900],
+             [100, None]]
+    assert assign(costs) == [1, 0]
+
+
+def test_assign_minimizes_total_cost():
+    costs = [[4, 1, 3],
+             [2, 0, 5],
+             [3, 2, 2]]
+    assert assign(costs) == [1, 0, 2]
+
+
+def test_assign_more_orders_than_couriers():
+    costs = [[5], [1], [None]]
+    assert assign(costs) == [None, 0, None]
+
+
+def test_assign_without_candidates():
+    assert assign([[None, None]]) == [None]
+    assert assign([[], []]) == [None, None]
+    assert assign([]) == []
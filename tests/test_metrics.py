@@ -0,0 +1,29 @@
+from src.metrics import Histogram, Registry, RequestStats
+
+
+def test_histogram_buckets():
+    histogram = Histogram((0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.sum == 3.65
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    stats = RequestStats()
+    stats.statements, stats.db_time, stats.rows = 3, 0.002, 7
+    registry.observe("GET", "/courier/{id}", 200, 0.02, stats)
+    registry.observe("GET", "/courier/{id}", 404, 0.5, RequestStats())
+
+    text = registry.render()
+    labels = 'method="GET",route="/courier/{id}"'
+    assert f'http_requests_total{{{labels},status="200"}} 1' in text
+    assert f'http_requests_total{{{labels},status="404"}} 1' in text
+    assert f'http_request_duration_seconds_bucket{{{labels},le="0.025"}} 1' in text
+    assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f'db_statements_per_request_bucket{{{labels},le="0"}} 1' in text
+    assert f'db_statements_per_request_sum{{{labels}}} 3.000000' in text
+    assert f'db_rows_total{{{labels}}} 7' in text
+    assert "# TYPE http_request_duration_seconds histogram" in text
@@ -0,0 +1,198 @@
+import datetime
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from src import schemas
+from src.config import DB_HOST_TEST
+from src.main import app, get_location_repository, get_repository
+from src.repository import MemoryRepository, Repository, SqlRepository
+from src.schemas import CourierFilters, CourierIn, CourierState, OrderIn
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime.datetime(2024, 3, 1, 10, 0)
+
+    def __call__(self) -> datetime.datetime:
+        return self.now
+
+    def advance(self, **delta) -> None:
+        self.now += datetime.timedelta(**delta)
+
+
+def test_incomplete_backend_rejected():
+    class Partial(Repository):
+        def create_couriers(self, couriers):
+            return []
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_memory_districts_deduplicated():
+    repository = MemoryRepository()
+    repository.create_courier(CourierIn(name="Курьер", districts=["Центральный", "центральный", "Северный"]))
+    repository.create_courier(CourierIn(name="Второй", districts=["ЦЕНТРАЛЬНЫЙ"]))
+    assert len(repository.get_couriers(CourierFilters(district="центральный"))) == 2
+    assert len(repository.get_couriers(CourierFilters(district="Северный"))) == 1
+    assert repository.get_district_stats("Южный") is None
+
+
+def test_memory_one_active_order_per_courier():
+    repository = MemoryRepository(queue=False)
+    courier = repository.create_courier(CourierIn(name="Курьер", districts=["Центральный"]))
+    order = repository.create_order(OrderIn(name="Заказ", district="Центральный"))
+    assert order.courier_id == courier.id
+    assert repository.get_courier(courier.id).active_order.order_id == order.order_id
+    with pytest.raises(HTTPException):
+        repository.create_order(OrderIn(name="Второй", district="Центральный"))
+
+    assert repository.complete_order(order.order_id)
+    assert repository.complete_order(order.order_id) is None
+    assert repository.get_courier(courier.id).active_order is None
+    assert repository.create_order(OrderIn(name="Второй", district="Центральный")).courier_id == courier.id
+
+
+def test_memory_stats_updates():
+    clock = Clock()
+    repository = MemoryRepository(clock=clock)
+    courier = repository.create_courier(CourierIn(name="Курьер", districts=["Центральный"]))
+    for minutes in (10, 30):
+        order = repository.create_order(OrderIn(name="Заказ", district="Центральный"))
+        clock.advance(minutes=minutes)
+        repository.complete_order(order.order_id)
+
+    info = repository.get_courier(courier.id)
+    assert info.avg_order_complete_time == "0:20:00"
+    assert info.avg_day_orders == 2
+    stats = repository.get_courier_stats(courier.id)
+    assert (stats.orders_count, stats.work_days, stats.min_complete_time, stats.max_complete_time) == (2, 1, 600, 1800)
+
+    clock.advance(days=1)
+    order = repository.create_order(OrderIn(name="Заказ", district="Центральный"))
+    clock.advance(minutes=20)
+    repository.complete_orders([order.order_id])
+    assert repository.get_courier(courier.id).avg_day_orders == 1
+    stats = repository.get_district_stats("Центральный", date_from=clock.now.date())
+    assert (stats.orders_count, stats.work_days) == (1, 1)
+    assert repository.get_courier_stats(courier.id).work_days == 2
+
+
+def test_memory_order_queue():
+    clock = Clock()
+    repository = MemoryRepository(queue=True, clock=clock)
+    repository.create_courier(CourierIn(name="Курьер", districts=["Заречный"]))
+    first = repository.create_order(OrderIn(name="Первый", district="Заречный"))
+    waiting = repository.create_order(OrderIn(name="Второй", district="Заречный"))
+    assert waiting.courier_id is None and waiting.status == 0
+    clock.advance(seconds=30)
+    assert repository.get_pending_orders() == [schemas.PendingOrders(district="заречный", pending_orders=1,
+                                                                      max_wait_time=30)]
+
+    results = repository.complete_orders([waiting.order_id, first.order_id, first.order_id, uuid.uuid4()])
+    assert [(r.completed, r.reason) for r in results] == [(False, "Order has no courier yet"), (True, None),
+                                                          (True, None), (False, "Order does not exist")]
+    # освободившийся курьер получил заказ из очереди
+    assert repository.get_order_info(waiting.order_id).courier_id == first.courier_id
+    assert repository.get_pending_orders() == []
+
+    queued = repository.create_order(OrderIn(name="Третий", district="Заречный"))
+    newcomer = repository.create_courier(CourierIn(name="Новый", districts=["Заречный"]))
+    assert repository.get_order_info(queued.order_id).courier_id == newcomer.id
+
+
+def test_memory_couriers_pagination():
+    repository = MemoryRepository(queue=False)
+    created = repository.create_couriers([CourierIn(name=f"Курьер {i}", districts=["Центральный"]) for i in range(5)])
+    repository.create_order(OrderIn(name="Заказ", district="Центральный"))
+
+    pages, after = [], None
+    while page := repository.get_couriers(after=after, limit=2):
+        pages.append([courier.id for courier in page])
+        after = page[-1].id
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert sum(pages, []) == sorted(courier.id for courier in created)
+    assert len(repository.get_couriers(CourierFilters(state=CourierState.busy))) == 1
+    assert len(repository.get_couriers(CourierFilters(district="Центральный", state=CourierState.idle))) == 4
+    assert len(list(repository.stream_couriers(CourierFilters()))) == 5
+
+
+@pytest.fixture
+def memory_client():
+    repository = MemoryRepository(queue=False)
+    app.dependency_overrides[get_repository] = lambda: repository
+    app.dependency_overrides[get_location_repository] = lambda: repository
+    try:
+        yield TestClient(app)
+    finally:
+        del app.dependency_overrides[get_repository], app.dependency_overrides[get_location_repository]
+
+
+def test_memory_backend_api(memory_client):
+    response = memory_client.post("/courier", json={"name": "Курьер", "districts": ["Центральный"]})
+    assert response.status_code == 200, response.text
+    courier_id = memory_client.get("/courier").json()[0]["id"]
+    assert memory_client.put(f"/courier/{courier_id}/location",
+                             json={"latitude": 55.75, "longitude": 37.61}).status_code == 204
+    assert memory_client.put(f"/courier/{uuid.uuid4()}/location",
+                             json={"latitude": 55.75, "longitude": 37.61}).status_code == 404
+
+    order = {"name": "Заказ", "district": "Центральный", "latitude": 55.76, "longitude": 37.62}
+    response = memory_client.post("/order", json=order, headers={"Idempotency-Key": "memory-order"})
+    assert response.status_code == 200, response.text
+    replayed = memory_client.post("/order", json=order, headers={"Idempotency-Key": "memory-order"})
+    assert replayed.headers["Idempotent-Replayed"] == "true"
+    assert replayed.json() == response.json()
+    order_id = response.json()["order_id"]
+    assert memory_client.get(f"/courier/{courier_id}").json()["active_order"]["order_id"] == order_id
+
+    assert memory_client.post(f"/order/{order_id}").status_code == 200
+    assert memory_client.get(f"/order/{order_id}").json() == {"courier_id": courier_id, "status": 2}
+    assert memory_client.get(f"/courier/{courier_id}/stats").json()["orders_count"] == 1
+
+
+def run_scenario(repository) -> dict:
+    district = f"Паритет-{uuid.uuid4().hex[:8]}"
+    other = f"{district}-2"
+    repository.create_couriers([CourierIn(name="Первый", districts=[district, district.upper()]),
+                                CourierIn(name="Второй", districts=[district, other])])
+    orders = [repository.create_order(OrderIn(name=f"Заказ {i}", district=district)).order_id for i in range(2)]
+    with pytest.raises(HTTPException):
+        repository.create_order(OrderIn(name="Лишний", district=district))
+    batch = repository.create_orders([OrderIn(name="Пакет", district=other), OrderIn(name="Пакет", district="нет")])
+    courier_id = repository.get_order_info(orders[0]).courier_id
+    completed = repository.complete_orders([orders[0], orders[0], uuid.uuid4()])
+    stats = repository.get_courier_stats(courier_id)
+    return {
+        "couriers": len(repository.get_couriers(CourierFilters(district=district))),
+        "busy": len(repository.get_couriers(CourierFilters(district=district, state=CourierState.busy))),
+        "batch": [(result.status, result.reason) for result in batch],
+        "completed": [(result.completed, result.reason) for result in completed],
+        "statuses": [repository.get_order_info(order_id).status for order_id in orders],
+        "active_order": repository.get_courier(courier_id).active_order,
+        "courier_stats": (stats.orders_count, stats.work_days),
+        "district_stats": repository.get_district_stats(district).orders_count,
+        "other_stats": repository.get_district_stats(other).orders_count,
+    }
+
+
+@pytest.fixture
+def sql_repository():
+    # остальные тесты модуля работают без БД
+    if DB_HOST_TEST is None:
+        pytest.skip("test database is not configured")
+    from src.database import get_session, create_test_table
+
+    create_test_table()
+    db = get_session('test')
+    try:
+        yield SqlRepository(db)
+    finally:
+        db.close()
+
+
+def test_memory_backend_matches_sql(sql_repository):
+    assert run_scenario(MemoryRepository(queue=False)) == run_scenario(sql_repository)
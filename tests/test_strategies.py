@@ -0,0 +1,78 @@
+import uuid
+
+import numpy as np
+import pytest
+
+from src.dispatch import DispatchIndex
+from src.strategies import (Candidates, DispatchStrategy, Fastest, LeastRecentlyAssigned, MostProductive,
+                            StrategySelector, Weighted)
+
+
+def make_candidates(**features):
+    size = len(next(iter(features.values())))
+    return Candidates(**{name: np.asarray(features.get(name, np.zeros(size)), dtype=float)
+                         for name in Candidates._fields})
+
+
+def test_builtin_scores():
+    candidates = make_candidates(avg_complete_time=[300, 100, 200], avg_day_orders=[5, 9, 7],
+                                 assigned_at=[30.0, 10.0, 0.0])
+    assert np.argmin(Fastest().score(candidates)) == 1
+    assert np.argmin(MostProductive().score(candidates)) == 1
+    assert np.argmin(LeastRecentlyAssigned().score(candidates)) == 2
+    with pytest.raises(TypeError):
+        DispatchStrategy()
+
+
+def test_weighted_score():
+    candidates = make_candidates(ewma_complete_time=[600, 600, 1200], orders_today=[10, 2, 2],
+                                 idle_seconds=[60, 60, 3600])
+    assert np.argmin(Weighted(time=1, load=1, idle=0).score(candidates)) == 1
+    # долгий простой перевешивает медленное время выполнения
+    assert np.argmin(Weighted(time=1, load=1, idle=2).score(candidates)) == 2
+    # одинаковые признаки не дают деления на ноль
+    same = make_candidates(ewma_complete_time=[600, 600], orders_today=[1, 1], idle_seconds=[5, 5])
+    assert np.isfinite(Weighted().score(same)).all()
+
+
+def test_selector_per_district():
+    selector = StrategySelector("fastest", {"Центральный": "productive"})
+    assert isinstance(selector.for_district("центральный"), MostProductive)
+    assert isinstance(selector.for_district("Заречный"), Fastest)
+    assert selector.for_district("Заречный") is selector.get("fastest")
+    with pytest.raises(ValueError):
+        StrategySelector("unknown").for_district("Заречный")
+    selector.validate()
+    with pytest.raises(ValueError):
+        StrategySelector("fastest", {"Заречный": "fastets"}).validate()
+
+
+def test_pop_scored():
+    district = uuid.uuid4()
+    fast, productive, busy = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    index = DispatchIndex()
+    index.load([(fast, 100, [district]), (productive, 300, [district]), (busy, 50, [district])],
+               busy_courier_ids=[busy], avg_day_orders={fast: 4, productive: 8, busy: 20})
+
+    assert index.pop_scored(district, MostProductive()) == productive
+    assert index.pop_scored(district, MostProductive()) == fast
+    assert index.pop_scored(district, MostProductive()) is None
+    assert index.pop_scored(uuid.uuid4(), MostProductive()) is None
+
+    # занятые курьеры освобождаются по очереди, least_recent выбирает того, кто получил заказ раньше
+    index.release(fast)
+    index.release(productive, 250, 9, completion_seconds=400)
+    assert index.pop_scored(district, LeastRecentlyAssigned()) == productive
+    assert index.pop(district) == fast
+
+
+def test_add_courier_moves_between_districts():
+    district_a, district_b = uuid.uuid4(), uuid.uuid4()
+    courier = uuid.uuid4()
+    index = DispatchIndex()
+    index.load([], busy_courier_ids=[])
+    index.add_courier(courier, 100, [district_a])
+    index.add_courier(courier, 100, [district_b])
+
+    assert index.pop_scored(district_a, MostProductive()) is None
+    assert index.pop_scored(district_b, MostProductive()) == courier